@@ -1,5 +1,11 @@
-from .create_crystals import species, crystals
 from .structures import structures
 
 fcc = structures.fcc
-LiF = crystals.LiF
+
+def __getattr__(name):
+    # The crystals need pymatgen and the database, which are loaded on first use only
+    if name in ['species', 'crystals', 'LiF']:
+        from .create_crystals import species, crystals
+        globals().update(species = species, crystals = crystals, LiF = crystals.LiF)
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Substitutional alloy supercells of two alkali halides, e.g. KCl(1-x)Br(x) or K(1-x)Na(x)Cl.
+
+The two crystals share one sublattice. The supercell of the host crystal is built with build_structure,
+its lattice constant interpolated between both crystals (Vegard's law) and a fraction x of the sites of
+the mixed sublattice is occupied by the guest element.
+
+Configurations are handled in batches as boolean occupation arrays (configurations, sites). They are
+either random, or optimized towards the pair correlations of the random alloy (special quasirandom
+structures, SQS). Configurations that are equal up to a translation of the supercell are removed.
+"""
+
+import numpy as np
+import os, json
+from pymatgen.core import Structure, Lattice
+from .attrdict import AttrDict
+from .neighbors import neighbor_pairs
+from .fingerprint import FingerprintIndex, structure_fingerprint
+from .scripts.filehandling import leading_zeros
+
+def get_crystal(crystal):
+    from .create_crystals import crystals
+    return crystals[crystal] if isinstance(crystal, str) else crystal
+
+def vegard_a0(host, guest, x:float):
+    """
+    Lattice constant of the alloy interpolated linearly between the host (x=0) and guest (x=1).
+    """
+    host, guest = get_crystal(host), get_crystal(guest)
+    return (1 - x) * host.calc.a0 + x * guest.calc.a0
+
+def alloy_host(host, guest, x:float, supercell = 2):
+    """
+    Supercell of the host crystal with the lattice constant of the alloy.
+
+    Parameters
+    ----------
+    host, guest : Crystal or str
+        The two crystals, which should differ in either the alkali or the halide.
+    x : float
+        Fraction of the mixed sublattice occupied by the guest element.
+    supercell : int(3), optional
+        Supercell specification as in build_structure.
+
+    Returns
+    -------
+    alloy : AttrDict
+        lattice, species and frac_coords of the host supercell, sites (indices of the mixed
+        sublattice), host and guest (elements), nguest (number of guest atoms) and x (the
+        composition after rounding to whole atoms).
+    """
+    host, guest = get_crystal(host), get_crystal(guest)
+    mixed = [ (a, b) for a, b in zip(host.species, guest.species) if a != b ]
+    if len(mixed) != 1:
+        raise ValueError(f'{host} and {guest} should differ in exactly one element.')
+    [(host_element, guest_element)] = mixed
+
+    structure = host.build_structure(supercell)
+    scale = vegard_a0(host, guest, x) / host.calc.a0
+    species = [ str(specie) for specie in structure.species ]
+    sites = np.array([ ii for ii, specie in enumerate(species) if specie == host_element ])
+    nguest = int(round(x * len(sites)))
+    return AttrDict(
+        lattice = structure.lattice.matrix * scale,
+        species = species,
+        frac_coords = structure.frac_coords,
+        sites = sites,
+        host = host_element,
+        guest = guest_element,
+        nguest = nguest,
+        x = nguest / len(sites),
+    )
+
+#%% CONFIGURATIONS
+
+def random_occupations(nconfigs:int, nsites:int, nguest:int, rng = None):
+    """
+    Random occupations with exactly nguest guest atoms, as a boolean array (nconfigs, nsites).
+    """
+    rng = np.random.default_rng(rng)
+    ranks = np.argsort(rng.random((nconfigs, nsites)), axis = 1)
+    return ranks < nguest
+
+def shell_pairs(alloy:AttrDict, nshells:int = 3, tol:float = 1e-3):
+    """
+    Pairs of sites on the mixed sublattice, grouped in neighbor shells.
+
+    Returns
+    -------
+    shells : list
+        For each shell a tuple (i, j) of index arrays into alloy.sites. Pairs with periodic
+        images are included as often as the image occurs.
+    distances : array (nshells)
+        Radius of each shell in Angstrom.
+    """
+    frac = alloy.frac_coords[alloy.sites]
+    cutoff = 2.0
+    while True:
+        _, i, j, distance, _ = neighbor_pairs(alloy.lattice, frac, cutoff)
+        radii = np.unique(np.round(distance / tol) * tol)
+        if len(radii) > nshells:
+            break
+        cutoff *= 1.5
+    radii = radii[:nshells]
+    shell = np.round(distance / tol) * tol
+    shells = [ (i[shell == radius], j[shell == radius]) for radius in radii ]
+    return shells, radii
+
+def pair_correlations(occupations, shells:list):
+    """
+    Pair correlation <s_i s_j> of every shell for a batch of configurations, with s = +1 for the
+    host and s = -1 for the guest element.
+
+    Returns
+    -------
+    correlations : array (nconfigs, nshells)
+    """
+    spins = 1 - 2 * np.asarray(occupations, float)
+    return np.stack([ np.mean(spins[:, i] * spins[:, j], axis = 1) for i, j in shells ], axis = 1)
+
+def sqs_objective(correlations, x:float, weights = None):
+    """
+    Weighted distance between the pair correlations and those of the random alloy, (1-2x)^2.
+    """
+    weights = np.ones(correlations.shape[1]) if weights is None else np.asarray(weights, float)
+    return np.sum(weights * np.abs(correlations - (1 - 2 * x)**2), axis = 1)
+
+def optimize_occupations(occupations, shells:list, x:float, steps:int = 200, weights = None, rng = None):
+    """
+    Move a batch of configurations towards the random-alloy pair correlations.
+
+    In every step one guest and one host site are swapped in all configurations at once, and the swap
+    is kept wherever it lowers sqs_objective.
+    """
+    rng = np.random.default_rng(rng)
+    occupations = np.array(occupations, bool)
+    nconfigs = len(occupations)
+    rows = np.arange(nconfigs)
+    objective = sqs_objective(pair_correlations(occupations, shells), x, weights)
+    for step in range(steps):
+        # Random guest and host site in every configuration
+        guest = np.argmax( np.where(occupations, rng.random(occupations.shape), -1), axis = 1 )
+        host = np.argmax( np.where(~occupations, rng.random(occupations.shape), -1), axis = 1 )
+        trial = occupations.copy()
+        trial[rows, guest] = False
+        trial[rows, host] = True
+        trial_objective = sqs_objective(pair_correlations(trial, shells), x, weights)
+        better = trial_objective < objective
+        occupations[better] = trial[better]
+        objective[better] = trial_objective[better]
+    return occupations
+
+def translation_permutations(alloy:AttrDict, tol:float = 1e-4):
+    """
+    Permutations of the mixed sublattice under the lattice translations that leave it invariant.
+
+    Returns
+    -------
+    permutations : int array (T, nsites)
+        permutations[t, i] is the site that site i is translated to.
+    """
+    frac = alloy.frac_coords[alloy.sites]
+    translations = frac - frac[0]
+    image = frac[None, :, :] + translations[:, None, :]            # (T, nsites, 3)
+    delta = image[:, :, None, :] - frac[None, None, :, :]           # (T, nsites, nsites, 3)
+    delta -= np.round(delta)
+    match = np.all(np.abs(delta) < tol, axis = -1)
+    return np.argmax(match, axis = 2)
+
+def canonical_keys(occupations, permutations):
+    """
+    Key of every configuration that is equal for configurations related by a translation.
+    """
+    images = np.asarray(occupations, bool)[:, permutations]        # (nconfigs, T, nsites)
+    # int64, so that the sentinel of the non-candidates does not wrap around as it would in uint8
+    packed = np.packbits(images, axis = 2).astype(np.int64)
+    # Lexicographically smallest image, narrowing down the candidates byte by byte
+    candidates = np.ones(packed.shape[:2], bool)
+    for column in np.moveaxis(packed, 2, 0):
+        smallest = np.where(candidates, column, np.iinfo(np.int64).max).min(axis = 1)
+        candidates &= column == smallest[:, None]
+    smallest = packed[ np.arange(len(packed)), np.argmax(candidates, axis = 1) ]
+    return [ row.tobytes() for row in smallest ]
+
+#%% GENERATION
+
+def alloy_structure(alloy:AttrDict, occupation):
+    """
+    pymatgen Structure of one configuration.
+    """
+    species = list(alloy.species)
+    for site in alloy.sites[ np.asarray(occupation, bool) ]:
+        species[site] = alloy.guest
+    return Structure(Lattice(alloy.lattice), species, alloy.frac_coords)
+
+def generate_alloys(host, guest, x:float, supercell = 2, nconfigs:int = 100, method:str = 'random',
+                    nshells:int = 3, batch:int = 1000, steps:int = 200, max_batches:int = 100, seed = None):
+    """
+    Generate unique alloy configurations in batches.
+
+    Parameters
+    ----------
+    host, guest : Crystal or str
+        The two crystals, e.g. 'KCl' and 'KBr' for KCl(1-x)Br(x).
+    x : float
+        Fraction of guest atoms on the mixed sublattice.
+    supercell : int(3), optional
+        Supercell specification as in build_structure.
+    nconfigs : int, optional
+        Number of unique configurations to generate.
+    method : str, optional
+        'random' for random configurations, 'sqs' for configurations optimized towards the pair
+        correlations of the random alloy.
+    nshells : int, optional
+        Number of neighbor shells in the pair correlations.
+    batch : int, optional
+        Number of configurations generated at once.
+    steps : int, optional
+        Optimization steps per batch for 'sqs'.
+    max_batches : int, optional
+        Stop after this many batches, e.g. when fewer unique configurations exist.
+    seed : int, optional
+        Seed of the random number generator.
+
+    Yields
+    ------
+    alloy : AttrDict
+        The host supercell, see alloy_host (first item only).
+    occupation, correlations : arrays (nsites), (nshells)
+        Each unique configuration and its pair correlations.
+    """
+    if method not in ['random', 'sqs']:
+        raise ValueError(f'Option {method} is not a valid method. Please choose from:\n\t{["random", "sqs"]}')
+    rng = np.random.default_rng(seed)
+    alloy = alloy_host(host, guest, x, supercell)
+    shells, _ = shell_pairs(alloy, nshells)
+    permutations = translation_permutations(alloy)
+    yield alloy
+
+    seen = set()
+    for _ in range(max_batches):
+        occupations = random_occupations(batch, len(alloy.sites), alloy.nguest, rng)
+        if method == 'sqs':
+            occupations = optimize_occupations(occupations, shells, alloy.x, steps, rng = rng)
+        correlations = pair_correlations(occupations, shells)
+        if method == 'sqs':
+            # Best configurations first
+            order = np.argsort(sqs_objective(correlations, alloy.x))
+            occupations, correlations = occupations[order], correlations[order]
+        for occupation, correlation, key in zip(occupations, correlations, canonical_keys(occupations, permutations)):
+            if key in seen:
+                continue
+            seen.add(key)
+            yield occupation, correlation
+            if len(seen) == nconfigs:
+                return
+
+def write_alloys(host, guest, x:float, dirname:str = 'alloys', index:str = None, **kwargs):
+    """
+    Stream unique alloy configurations to json files <dirname>/A####/<prefix>.json.
+
+    A summary with the occupations and pair correlations is written to <dirname>/alloys.json.
+    With an index (see fingerprint.FingerprintIndex), configurations that were calculated before are
+    not written; the summary points to the existing directory instead.
+    See generate_alloys for the other parameters.
+
+    Returns the list of written files.
+    """
+    index = FingerprintIndex(index) if index is not None else None
+    generator = generate_alloys(host, guest, x, **kwargs)
+    alloy = next(generator)
+    nconfigs = kwargs.get('nconfigs', 100)
+    N10 = leading_zeros(nconfigs)
+    elements = list(dict.fromkeys(alloy.species))
+    elements.insert(elements.index(alloy.host) + 1, alloy.guest)
+    prefix = ''.join(elements)
+
+    files, summary = [], []
+    for ii, (occupation, correlation) in enumerate(generator):
+        new_dir = os.path.join(dirname, f'A{ii:0{N10}d}')
+        structure = alloy_structure(alloy, occupation)
+        entry = dict(guest_sites = alloy.sites[occupation].tolist(), correlations = correlation.tolist())
+        if index is not None:
+            fingerprint = structure_fingerprint(structure)
+            existing = index.lookup(fingerprint)
+            # a rerun finds its own earlier entry, which is rewritten
+            if existing not in [None, os.path.abspath(new_dir)]:
+                summary += [dict(duplicate_of = existing, **entry)]
+                continue
+            index.add(fingerprint, new_dir)
+        os.makedirs(new_dir, exist_ok = True)
+        fn = os.path.join(new_dir, prefix + '.json')
+        with open(fn, 'w') as file:
+            json.dump(structure.as_dict(), file)
+        files += [fn]
+        summary += [dict(file = fn, **entry)]
+
+    if index is not None:
+        index.save()
+    os.makedirs(dirname, exist_ok = True)
+    with open(os.path.join(dirname, 'alloys.json'), 'w') as file:
+        json.dump(dict(host = alloy.host, guest = alloy.guest, x = alloy.x, configurations = summary), file, indent = 1)
+    return files
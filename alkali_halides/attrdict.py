@@ -9,3 +9,45 @@ class AttrDict(dict):
     def __init__(self, *args, **kwargs):
         super(AttrDict, self).__init__(*args, **kwargs)
         self.__dict__ = self
+
+def freeze(value):
+    """
+    Immutable version of a value: AttrDicts and dicts become FrozenAttrDicts, lists tuples and numpy
+    arrays read-only copies. Values that are already immutable are shared, not copied.
+    """
+    import numpy as np
+    if isinstance(value, FrozenAttrDict):
+        return value
+    if isinstance(value, dict):
+        return FrozenAttrDict(value)
+    if isinstance(value, (list, tuple)):
+        return tuple( freeze(item) for item in value )
+    if isinstance(value, np.ndarray) and value.flags.writeable:
+        value = value.copy()
+        value.flags.writeable = False
+    return value
+
+class FrozenAttrDict(AttrDict):
+    """
+    AttrDict that cannot be changed after it is made, with frozen values (see freeze).
+    Copies with changes are made with replace, which shares all unchanged values.
+    """
+    def __init__(self, *args, **kwargs):
+        items = dict(*args, **kwargs)
+        dict.__init__(self, { key: freeze(value) for key, value in items.items() })
+        object.__setattr__(self, '__dict__', self)
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(f'{type(self).__name__} is immutable, use replace for a changed copy.')
+
+    __setitem__ = __delitem__ = __setattr__ = __delattr__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+    def replace(self, **changes):
+        """
+        Copy with changed values. Unchanged values are shared with this dictionary.
+        """
+        return FrozenAttrDict(self, **changes)
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+Physical constants and element groups shared by the models and the post-processing.
+Lengths are in Angstrom and energies in eV; BOHR is in fft.
+"""
+
+K_COULOMB = 14.3996454784     # eV Angstrom
+RYDBERG = 13.605693123        # eV
+RY_BOHR3_TO_KBAR = 147105.08
+ALKALIS = ['Li', 'Na', 'K', 'Rb', 'Cs']
+HALIDES = ['F', 'Cl', 'Br', 'I']
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Convergence sweeps with early stopping.
+
+A sweep converges the settings of one crystal one axis at a time: the wavefunction cutoff (ecutwfc),
+then the scf k-grid (kpoints, N x N x N), then the bands of epsilon (nbnd). Every axis is a ladder of
+values with a fixed step. The sweep hands out small batches of calculations, takes their results in any
+order, and stops an axis at the first value whose next step changes the quantities of the axis by less
+than their tolerances (the keys of the conv section: total_energy and pressure for ecutwfc and kpoints,
+eps for nbnd).
+
+The first batch of an axis brackets a value predicted from the converged settings of the neighbours of
+the crystal in the database (the crystals with the same alkali or halide), so that a sweep usually
+takes a few calculations per axis instead of a full grid. A sweep is saved to json between sessions,
+and its history and the new conv values can be recorded in a ResultsStore.
+
+Example
+-------
+    sweep = ConvergenceSweep('NaCl')
+    while not sweep.done:
+        for point in sweep.next_batch():
+            ... run point.crystal (a frozen variant with the settings of the point) ...
+            sweep.add_result(point, total_energy = ..., pressure = ..., eps = ...)
+    sweep.converged_settings
+"""
+
+import numpy as np
+import json
+from .attrdict import AttrDict
+from .qe import read_pw_output
+
+AXES = ['ecutwfc', 'kpoints', 'nbnd']
+QUANTITIES = dict(ecutwfc = ('total_energy', 'pressure'), kpoints = ('total_energy', 'pressure'), nbnd = ('eps',))
+TOLERANCES = dict(total_energy = 1e-3, pressure = 0.5, eps = 0.01) # Ry, kbar, relative
+STEPS = dict(ecutwfc = 10., kpoints = 1, nbnd = 10)
+MINIMA = dict(ecutwfc = 20., kpoints = 1, nbnd = 1)
+MAX_RUNS = 12   # per axis
+
+#%% STARTING POINTS
+
+def axis_values(crystal):
+    """
+    Current values of the axes of a crystal.
+    """
+    return dict(ecutwfc = float(crystal.settings.ecutwfc), kpoints = int(np.max(crystal.settings.ngkpt_scf)),
+                nbnd = int(crystal.settings.nbnd))
+
+def predict_start(crystal, crystals = None):
+    """
+    Starting values of the axes from the converged settings of the neighbours of a crystal.
+
+    The cutoff is set by the hardest pseudopotential: the larger of the median cutoffs of the crystals
+    with the same alkali and of those with the same halide. The k-grid keeps the median k-point density
+    of the neighbours (N a0 constant), the bands scale with the volume of the primitive cell.
+
+    Parameters
+    ----------
+    crystal : Crystal
+    crystals : list, optional
+        Crystals to take the neighbours from. The default of None uses the database. The crystal itself
+        is never used, its settings are what the sweep replaces.
+
+    Returns
+    -------
+    start : dict
+        {axis: value}, the current settings of the crystal where it has no neighbours.
+    """
+    from .create_crystals import crystals as all_crystals
+    if crystals is None:
+        crystals = all_crystals.values()
+    neighbours = [ other for other in crystals if other.crystal != crystal.crystal ]
+    alkali = [ other for other in neighbours if other.alkali == crystal.alkali ]
+    halide = [ other for other in neighbours if other.halide == crystal.halide ]
+    start = axis_values(crystal)
+    if not alkali + halide:
+        return start
+
+    cutoffs = [ np.median([ other.settings.ecutwfc for other in group ]) for group in [alkali, halide] if group ]
+    start['ecutwfc'] = float(np.ceil(max(cutoffs) / STEPS['ecutwfc']) * STEPS['ecutwfc'])
+    volume = abs(np.linalg.det(crystal.lattice))
+    density = [ axis_values(other)['kpoints'] * other.calc.a0 for other in alkali + halide ]
+    start['kpoints'] = max(MINIMA['kpoints'], int(round(np.median(density) / crystal.calc.a0)))
+    bands = [ other.settings.nbnd * volume / abs(np.linalg.det(other.lattice)) for other in alkali + halide ]
+    start['nbnd'] = max(int(crystal.valence) + 1, int(np.ceil(np.median(bands) / STEPS['nbnd']) * STEPS['nbnd']))
+    return start
+
+#%% SWEEP
+
+class ConvergenceSweep(object):
+    """
+    Planner of the convergence calculations of one crystal.
+
+    Parameters
+    ----------
+    crystal : Crystal or str
+    axes : list, optional
+        Axes to converge, in order. The default is AXES.
+    tolerances : dict, optional
+        Largest change of a quantity per step of a converged axis, updates TOLERANCES.
+    steps : dict, optional
+        Step of every axis, updates STEPS.
+    start : dict, optional
+        Starting value of every axis, updates the prediction of predict_start.
+    batch : int, optional
+        Number of values handed out at once on an axis.
+    """
+    def __init__(self, crystal, axes = AXES, tolerances:dict = None, steps:dict = None, start:dict = None, batch:int = 3):
+        from .create_crystals import crystals
+        self.crystal = crystals[crystal] if isinstance(crystal, str) else crystal
+        unknown = [ axis for axis in axes if axis not in AXES ]
+        if unknown:
+            raise ValueError(f'Options {unknown} are not valid axes. Please choose from:\n\t{AXES}')
+        self.axes = list(axes)
+        self.tolerances = dict(TOLERANCES, **(tolerances or {}))
+        self.steps = dict(STEPS, **(steps or {}))
+        self.start = dict(predict_start(self.crystal), **(start or {}))
+        self.batch = batch
+        self.values = axis_values(self.crystal)   # settings of the axes that are not swept (yet)
+        self.converged = {}                       # {axis: value}
+        self.failed = []                          # axes that did not converge within MAX_RUNS
+        self.started = []                         # axes whose first batch was handed out
+        self.results = {}                         # {(ecutwfc, kpoints, nbnd): {quantity: value}}
+        self.pending = set()                      # handed out without a result
+        self.history = []                         # points in the order they were handed out
+
+    def __repr__(self):
+        return f'<ConvergenceSweep({self.crystal.crystal}, {len(self.results)} results, axis {self.axis})>'
+
+    @property
+    def axis(self):
+        """
+        Axis that is being converged, None when all are done.
+        """
+        for axis in self.axes:
+            if axis not in self.converged and axis not in self.failed:
+                return axis
+        return None
+
+    @property
+    def done(self):
+        return self.axis is None
+
+    @property
+    def converged_settings(self):
+        """
+        Settings with the converged (or, for axes not swept, the current) values.
+        """
+        values = dict(self.values, **self.converged)
+        return dict(ecutwfc = values['ecutwfc'], ngkpt_scf = np.array([ values['kpoints'] ] * 3), nbnd = values['nbnd'])
+
+    def key(self, axis:str, value):
+        """
+        Settings (ecutwfc, kpoints, nbnd) of a value on an axis, with the converged values of earlier axes.
+        """
+        values = dict(self.values, **self.converged)
+        values[axis] = value
+        return (float(values['ecutwfc']), int(values['kpoints']), int(values['nbnd']))
+
+    def point(self, axis:str, value):
+        ecutwfc, kpoints, nbnd = self.key(axis, value)
+        crystal = self.crystal.with_settings(ecutwfc = ecutwfc, ngkpt_scf = kpoints, nbnd = nbnd)
+        return AttrDict(axis = axis, value = value, ecutwfc = ecutwfc, kpoints = kpoints, nbnd = nbnd, crystal = crystal)
+
+    def ladder(self, axis:str):
+        """
+        Values of an axis with results, sorted, and their results.
+        """
+        values = sorted( value for value in self.tried(axis) if self.key(axis, value) in self.results )
+        return values, [ self.results[self.key(axis, value)] for value in values ]
+
+    def tried(self, axis:str):
+        """
+        Values of an axis that were handed out (with the current values of the other axes).
+        """
+        position = AXES.index(axis)
+        return { key[position] for key in set(self.results) | self.pending if key == self.key(axis, key[position]) }
+
+    def change(self, quantity:str, before:dict, after:dict):
+        """
+        Change of a quantity between two results, relative for eps.
+        """
+        change = abs(after[quantity] - before[quantity])
+        return change / abs(before[quantity]) if quantity == 'eps' else change
+
+    def first_converged(self, axis:str):
+        """
+        Smallest value of an axis whose next step changes its quantities less than the tolerances.
+        Both values need a result and must be one step apart.
+        """
+        values, results = self.ladder(axis)
+        for ii in range(len(values) - 1):
+            if not np.isclose(values[ii + 1] - values[ii], self.steps[axis]):
+                continue
+            common = [ quantity for quantity in QUANTITIES[axis] if quantity in results[ii] and quantity in results[ii + 1] ]
+            if common and all( self.change(quantity, results[ii], results[ii + 1]) < self.tolerances[quantity] for quantity in common ):
+                return values[ii]
+        return None
+
+    def extrapolate(self, axis:str):
+        """
+        Value of an axis where the changes reach the tolerances, from an exponential fit of the changes
+        along the ladder. None without two decreasing changes of a quantity.
+        """
+        values, results = self.ladder(axis)
+        predictions = []
+        for quantity in QUANTITIES[axis]:
+            pairs = [ (values[ii], self.change(quantity, results[ii], results[ii + 1])) for ii in range(len(values) - 1)
+                      if np.isclose(values[ii + 1] - values[ii], self.steps[axis])
+                      and quantity in results[ii] and quantity in results[ii + 1] ]
+            pairs = [ (value, change) for value, change in pairs if change > 0 ]
+            if len(pairs) < 2:
+                continue
+            slope, offset = np.polyfit([ value for value, _ in pairs ], np.log([ change for _, change in pairs ]), 1)
+            if slope < 0:
+                predictions += [ (np.log(self.tolerances[quantity]) - offset) / slope ]
+        if not predictions:
+            return None
+        # on the ladder of the starting value
+        start, step = self.start[axis], self.steps[axis]
+        return max(MINIMA[axis], start + np.ceil((max(predictions) - start) / step) * step)
+
+    def next_batch(self):
+        """
+        Next calculations to run.
+
+        Returns
+        -------
+        points : list
+            AttrDicts with the axis, value, ecutwfc, kpoints, nbnd and crystal (a frozen variant) of
+            every calculation. Empty only while the results of the current axis are pending, or when done.
+        """
+        while not self.done:
+            axis = self.axis
+            step, minimum = self.steps[axis], MINIMA[axis]
+            tried = self.tried(axis)
+            if any( self.key(axis, value) in self.pending for value in tried ):
+                return []
+            if axis not in self.started:
+                # bracket the starting value, results of earlier axes on the ladder are reused
+                self.started += [axis]
+                start = max(minimum, self.start[axis])
+                values = [ start + step * (ii - 1) for ii in range(self.batch) ]
+                values = sorted({ value for value in values if value >= minimum and value not in tried })
+                if not values:
+                    continue
+            else:
+                value = self.first_converged(axis)
+                if value is not None:
+                    lower = value - step
+                    if lower >= minimum and lower not in tried:
+                        # a smaller value may converge as well, jump to the extrapolation if it is lower
+                        guess = self.extrapolate(axis)
+                        lower = lower if guess is None else max(minimum, min(lower, guess))
+                        values = [ value for value in [lower, lower + step] if value not in tried ]
+                        # both were tried where the changes are not monotonic, go down one step instead
+                        values = values or [ value - step ]
+                    else:
+                        self.converged[axis] = value
+                        continue
+                elif len(tried) >= MAX_RUNS:
+                    self.failed += [axis]
+                    continue
+                else:
+                    top, guess = max(tried), self.extrapolate(axis)
+                    first = top + step if guess is None else min(max(top + step, guess), top + 2 * self.batch * step)
+                    values = [ first + step * ii for ii in range(self.batch) ]
+            cast = float if axis == 'ecutwfc' else int
+            values = [ cast(value) for value in values ]
+            points = [ self.point(axis, value) for value in values ]
+            for point in points:
+                key = self.key(axis, point.value)
+                self.pending.add(key)
+                self.history += [key]
+            return points
+        return []
+
+    def add_result(self, point, **quantities):
+        """
+        Result of a calculation handed out by next_batch.
+
+        Parameters
+        ----------
+        point : dict
+            The point, or any dict with its ecutwfc, kpoints and nbnd.
+        **quantities
+            total_energy (Ry), pressure (kbar) and/or eps. None values are left out.
+        """
+        key = (float(point['ecutwfc']), int(point['kpoints']), int(point['nbnd']))
+        self.pending.discard(key)
+        values = { name: float(value) for name, value in quantities.items() if value is not None }
+        self.results[key] = dict(self.results.get(key, {}), **values)
+
+    def add_output(self, point, filename:str):
+        """
+        Result of a calculation from its pw.x output, see qe.read_pw_output.
+        """
+        output = read_pw_output(filename)
+        self.add_result(point, total_energy = output.total_energy, pressure = output.pressure)
+
+    #%% RECORDS
+
+    def conv(self):
+        """
+        New conv section: the results at the converged settings, as far as they were calculated.
+        """
+        values = dict(self.values, **self.converged)
+        key = (float(values['ecutwfc']), int(values['kpoints']), int(values['nbnd']))
+        conv = AttrDict(pressure = None, total_energy = None, eps = None)
+        conv.update({ name: value for name, value in self.results.get(key, {}).items() if name in conv })
+        return conv
+
+    def record(self, store, calculation:str = 'sweep'):
+        """
+        Store the history of the sweep and the new conv values in a ResultsStore.
+
+        Every calculation is stored with its settings (ecutwfc, kpoints, nbnd); when the sweep is
+        done, the conv values are stored as conv_* of the calculation 'conv', which overlays the
+        database (see results.overlay).
+
+        Returns the number of stored values.
+        """
+        calculations = [ (self.crystal.crystal, calculation, result, dict(ecutwfc = key[0], kpoints = key[1], nbnd = key[2]), None)
+                         for key, result in self.results.items() ]
+        if self.done and not self.failed:
+            conv = { f'conv_{name}': value for name, value in self.conv().items() if value is not None }
+            calculations += [ (self.crystal.crystal, 'conv', conv, self.converged_settings, None) ]
+        return store.insert_many(calculations)
+
+    def save(self, filename:str):
+        """
+        Write the state of the sweep to json.
+        """
+        state = dict(crystal = self.crystal.crystal, axes = self.axes, tolerances = self.tolerances, steps = self.steps,
+                     start = self.start, batch = self.batch, values = self.values, converged = self.converged,
+                     failed = self.failed, started = self.started, pending = sorted(self.pending), history = self.history,
+                     results = [ dict(key = list(key), result = result) for key, result in self.results.items() ])
+        with open(filename, 'w') as file:
+            json.dump(state, file, indent = 1, default = float)
+
+    @classmethod
+    def load(cls, filename:str, crystal = None):
+        """
+        Sweep saved with save. The crystal defaults to the crystal of the database with its name.
+        """
+        with open(filename) as file:
+            state = json.load(file)
+        sweep = cls(crystal or state['crystal'], state['axes'], state['tolerances'], state['steps'], state['start'], state['batch'])
+        sweep.values = state['values']
+        sweep.converged = state['converged']
+        sweep.failed = state['failed']
+        sweep.started = state['started']
+        as_key = lambda key : (float(key[0]), int(key[1]), int(key[2]))
+        sweep.pending = { as_key(key) for key in state['pending'] }
+        sweep.history = [ as_key(key) for key in state['history'] ]
+        sweep.results = { as_key(entry['key']): entry['result'] for entry in state['results'] }
+        return sweep
@@ -8,6 +8,7 @@ import numpy as np
 from io import StringIO
 from .crystal import Crystal
 from .attrdict import AttrDict
+from .results import overlay
 import os, sys
 
 def load_database(filename):
@@ -32,12 +33,13 @@ def convert_to_dictionary(header, database, dict_database = {}):
         dict_database[key_crystal] = dict_crystal
     return dict_database
 
-def construct_database():
+def construct_database(results = None):
     dict_database = {}
     for fn in FILENAMES:
         header, database = load_database(fn)
         dict_database = convert_to_dictionary(header, database, dict_database)
-    return dict_database
+    # Overlay the latest results from the local results database, see results.py
+    return overlay(dict_database, results)
 
 def make_species(crystal_key):
     crystal = DICT_DATABASE[crystal_key]
@@ -75,8 +77,9 @@ FILENAME_CALCULATED = 'calculated.csv'
 FILENAME_SETTINGS   = 'settings.csv'
 FILENAME_LITERATURE = 'literature.csv'
 FILENAMES = [FILENAME_CALCULATED, FILENAME_SETTINGS, FILENAME_LITERATURE]
+FILENAME_RESULTS = os.environ.get('AH_RESULTS')
 
 # Construct database from these
-DICT_DATABASE = construct_database()
+DICT_DATABASE = construct_database(FILENAME_RESULTS)
 species = [ make_species(crystal_key) for crystal_key in DICT_DATABASE.keys() ]
 crystals = get_all_crystals()
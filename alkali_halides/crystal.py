@@ -4,14 +4,37 @@ Created on Thu Dec 19 13:38:34 2024
 
 @author: dholl
 """
-from .attrdict import AttrDict
+from .attrdict import AttrDict, freeze
 from .structures import structures
+from .fft import fft_grid
+from .neighbors import screen_frames
 
 from pymatgen.core import Structure, Lattice
 from pymatgen.transformations.standard_transformations import PerturbStructureTransformation, SupercellTransformation
 import numpy as np
 
+MAX_PERTURB_TRIES = 100
+
+def supercell_matrix(supercell = None):
+    """
+    Convert a supercell specification to a (3,3) integer matrix.
+    
+    None gives the identity, an integer N gives (N,N,N), and three integers X, Y, Z give (X,Y,Z).
+    A (3,3) matrix is returned as is.
+    """
+    if supercell is None:
+        return np.identity(3, int)
+    supercell = np.asarray(supercell, int)
+    if supercell.ndim == 0:
+        supercell = np.repeat(supercell, 3)
+    if supercell.ndim == 1:
+        supercell = np.diag(supercell)
+    return supercell
+
 class Crystal(object):
+    # Frozen snapshots (see freeze) cannot be changed, variants are made with with_settings
+    frozen = False
+    
     def __init__(self, species, *args, **kwargs):
         # TODO : Use @property @setter for name protection
         self.species = species
@@ -25,6 +48,7 @@ class Crystal(object):
         lit.a0 = kwargs.get('lit_a0')
         lit.Eg = kwargs.get('lit_Eg')
         lit.E1s = kwargs.get('lit_E1s')
+        lit.wL0 = kwargs.get('lit_wL0') # LO phonon frequency in 10^13 rad/s
         lit.eps0 = kwargs.get('lit_eps0')
         lit.epsinf = kwargs.get('lit_epsinf')
         self.lit = lit
@@ -68,6 +92,67 @@ class Crystal(object):
         # Structure is fcc, bcc, etc.
         self.set_structure( kwargs.get('use_literature_structure', False) )
     
+    def __setattr__(self, name, value):
+        if self.frozen:
+            raise AttributeError(f'{self} is a frozen snapshot, use with_settings for a changed copy.')
+        super().__setattr__(name, value)
+    
+    def freeze(self):
+        """
+        Immutable snapshot of the crystal.
+
+        All sections (lit, calc, conv, settings, structure) become FrozenAttrDicts with read-only
+        arrays, so that a snapshot can be shared between threads without locks or copies. A snapshot
+        is taken once; its variants (with_settings) share all unchanged sections.
+
+        Returns
+        -------
+        snapshot : Crystal
+            A frozen copy, or the crystal itself if it is already frozen.
+        """
+        if self.frozen:
+            return self
+        snapshot = object.__new__(type(self))
+        snapshot.__dict__.update({ key : freeze(value) for key, value in self.__dict__.items() })
+        snapshot.__dict__['frozen'] = True
+        return snapshot
+    
+    def with_settings(self, **changes):
+        """
+        Frozen variant of the crystal with changed settings, e.g. crystal.with_settings(ecutwfc = 60).
+
+        Only the settings section is new (a shallow copy with the changes), all other sections and
+        unchanged settings are shared with the snapshot of this crystal. Variants of a mutable crystal
+        first take a snapshot (see freeze), so freeze a crystal once before making many variants.
+
+        Parameters
+        ----------
+        **changes
+            New values of settings. Integers for the k-point and FFT grids (ngkpt_scf, ngkpt_co,
+            ngkpt_fi, fft) are used along all three directions, as in the database.
+
+        Returns
+        -------
+        variant : Crystal
+        """
+        unknown = [ key for key in changes if key not in self.settings ]
+        if unknown:
+            raise ValueError(f'Options {unknown} are not valid settings. Please choose from:\n\t{list(self.settings)}')
+        for key in ['ngkpt_scf', 'ngkpt_co', 'ngkpt_fi', 'fft']:
+            if key in changes and np.ndim(changes[key]) == 0:
+                changes[key] = np.array([ changes[key] ] * 3)
+        if 'screened_cutoff' in changes and 'ecutsig' not in changes:
+            changes['ecutsig'] = changes['screened_cutoff']
+        
+        snapshot = self.freeze()
+        variant = object.__new__(type(self))
+        variant.__dict__.update(snapshot.__dict__)
+        settings = snapshot.settings.replace(**changes)
+        variant.__dict__.update(settings = settings, nbnd = settings.nbnd, valence = settings.valence)
+        if 'structure' in changes:
+            variant.__dict__['structure'] = freeze(structures[ settings.structure ])
+        return variant
+    
     def set_structure(self, use_literature:bool = False):
         code = self.lit.structure if use_literature else self.settings.structure
         if code is None:
@@ -75,20 +160,76 @@ class Crystal(object):
         self.structure = structures[ code ]
     
     @property
-    def bgwpy_kwargs(self): # TODO: return bgwpy ready kwargs
+    def bgwpy_kwargs(self):
+        """
+        Keyword arguments shared by the BGWpy tasks and flows of this crystal.
+        
+        Band counts for sigma and the BSE follow from the number of occupied
+        bands (`valence`): the three highest valence bands (the halide p-states)
+        and the three lowest conduction bands are included.
+        """
+        settings = self.settings
+        valence = int(self.valence)
+        structure = self.build_structure()
         bgwpy = dict(
+            prefix = str(self.prefix),
+            structure = structure,
+            pseudos = self.pseudos,
+            ecutwfc = float(settings.ecutwfc),
+            nbnd = int(settings.nbnd),
+            ngkpt_scf = settings.ngkpt_scf.tolist(),
+            ngkpt = settings.ngkpt_co.tolist(),
+            ngkpt_fine = settings.ngkpt_fi.tolist(),
+            kshift = [0., 0., 0.],
+            qshift = [.001, 0., 0.],
+            fft = structure.properties['fft'],
+            ecuteps = float(settings.ecuteps),
+            ibnd_min = valence - 2,
+            ibnd_max = valence + 3,
+            nbnd_val = valence,
+            nbnd_val_co = 3,
+            nbnd_cond_co = 3,
+            nbnd_val_fi = 3,
+            nbnd_cond_fi = 3,
+            epsilon_extra_lines = [],
+            epsilon_extra_variables = {},
+            sigma_extra_lines = ['screening_semiconductor'],
+            sigma_extra_variables = dict(screened_coulomb_cutoff = float(settings.ecutsig)),
         )
         return bgwpy
     
     def __repr__(self):
         return f'<Crystal({self.crystal})>'
     
+    @property
+    def lattice(self):
+        """
+        Lattice vectors (rows) of the primitive cell in Angstrom.
+        """
+        return self.calc.a0 * self.structure.basic_to_primitive * self.structure.rprim
+    
+    def fft_grid(self, supercell = None, ecutwfc:float = None):
+        """
+        Fastest admissible dense FFT grid for the cutoff, see fft.fft_grid.
+
+        Parameters
+        ----------
+        supercell : int(3), optional
+            Supercell specification as in build_structure.
+        ecutwfc : float, optional
+            Wavefunction cutoff in Ry. The default is settings.ecutwfc.
+        """
+        if ecutwfc is None:
+            ecutwfc = self.settings.ecutwfc
+        lattice = supercell_matrix(supercell) @ self.lattice
+        return fft_grid(lattice, ecutwfc)
+    
     @property
     def pseudos(self):
         ext = '.upf'
         return [self.alkali + ext, self.halide + ext]
     
-    def build_structure(self, supercell:int = None, perturbed:float = None, round_to_em8:bool = True):
+    def build_structure(self, supercell:int = None, perturbed:float = None, round_to_em8:bool = True, min_distance:float = None):
         """
         Generate a crystal structure to build using pymatgen.
 
@@ -98,33 +239,34 @@ class Crystal(object):
             The supercell specifications. The default of None means no supercell. 
             If only 1 integer N is provided, the result will be a (N,N,N) supercell.
             If 3 integers X, Y, Z are provided, the results will be a (X,Y,Z) supercell.
+            A (3,3) integer matrix gives the lattice matrix @ lattice, see supercells.optimal_supercell.
         perturbed : float(2), optional
             Perturbation applied to the crystal (after any supercell operations). 
             The default is no perturbation.
             See PerturbStructureTransformation for more information.
         round_to_em8 : bool (false), optional
             Whether to round to 8 decimal places after applying any transformations.
+        min_distance : float, optional
+            Smallest allowed interatomic distance in Angstrom for perturbed structures. Perturbations
+            that bring atoms closer are drawn again, up to MAX_PERTURB_TRIES times.
         
         Returns
         -------
         structure : Structure
             pymatgen Structure after applying all appropriate transformations.
+            The FFT grid for settings.ecutwfc is stored in structure.properties['fft'].
 
         """
         # Create the initial crystal structure
         
         species = self.species
-        a0 = self.calc.a0 * self.structure.basic_to_primitive
-        
-        rprim = Lattice( a0 * self.structure.rprim )
+        rprim = Lattice( self.lattice )
         coords = self.structure.coordinates
         structure = Structure(rprim, species, coords)
         
         # Apply supercell transformation
         if supercell is not None:
-            if type(supercell) is int:
-                supercell = (supercell, supercell, supercell)
-            trans_supercell = SupercellTransformation(supercell)
+            trans_supercell = SupercellTransformation(supercell_matrix(supercell).tolist())
             structure = trans_supercell.apply_transformation(structure)
         
         # Apply perturbations
@@ -134,7 +276,17 @@ class Crystal(object):
             else:
                 max_dist, min_dist = perturbed, None
             trans_perturb = PerturbStructureTransformation(max_dist, min_dist)
-            structure = trans_perturb.apply_transformation(structure)
+            unperturbed = structure
+            for tries in range(MAX_PERTURB_TRIES):
+                structure = trans_perturb.apply_transformation(unperturbed)
+                if min_distance is None:
+                    break
+                accepted, _ = screen_frames(structure.lattice.matrix, structure.frac_coords, min_distance)
+                if accepted[0]:
+                    break
+            else:
+                raise ValueError(f'No perturbation of {self} with atoms at least {min_distance} \u212b apart '
+                                 f'was found in {MAX_PERTURB_TRIES} tries.')
         
         # Round coordinates
         if round_to_em8:
@@ -150,4 +302,7 @@ class Crystal(object):
                 coords_are_cartesian=False  # Indicate that the coords are cell coordinates
             )
         
+        # FFT grid of the final cell
+        structure.properties['fft'] = fft_grid(structure.lattice.matrix, self.settings.ecutwfc).tolist()
+        
         return structure
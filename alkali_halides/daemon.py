@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Local daemon that keeps the package loaded for job scripts.
+
+Importing pymatgen and building the crystal database takes seconds, which dominates thousands of tiny
+tasks that each need one structure, one set of displacements or one input deck. The daemon loads them
+once and serves requests over a Unix domain socket. Without a running daemon, requests are executed in
+the calling process instead, so scripts work either way.
+
+Requests and responses are single lines of json, e.g.
+    {"command": "structure", "crystal": "LiF", "supercell": 2}
+    {"ok": true, "result": {...}}
+so that shell scripts can also talk to the daemon directly, e.g. with nc -U or socat. What a command
+prints (e.g. warnings) is returned as a list of lines, {"ok": true, "result": ..., "warnings": [...]}, and
+printed to stderr by the client.
+
+This module only imports the standard library; the package is loaded when the first request is handled.
+"""
+
+import os, io, sys, json, time, socket, socketserver, tempfile, threading, warnings
+from contextlib import contextmanager
+
+SOCKET = os.environ.get('AH_SOCKET', os.path.join(tempfile.gettempdir(), f'alkali_halides-{os.getuid()}.sock'))
+TIMEOUT = 600
+
+#%% COMMANDS
+
+def to_builtin(value):
+    """
+    Convert numpy values (also inside lists and dicts) to python values for json.
+    """
+    from .results import to_builtin
+    return to_builtin(value)
+
+def get_crystal(crystal):
+    from .create_crystals import crystals
+    if crystal not in crystals:
+        raise ValueError(f'Crystal {crystal} is not one of:\n\t{[ str(key) for key in crystals ]}')
+    return crystals[crystal]
+
+def command_ping():
+    return dict(pid = os.getpid(), started = STARTED)
+
+def command_structure(crystal:str, supercell = None, perturbed = None, min_distance:float = None, round_to_em8:bool = True):
+    """
+    Structure of a crystal, see Crystal.build_structure, as a pymatgen dictionary.
+    """
+    perturbed = tuple(perturbed) if isinstance(perturbed, list) else perturbed
+    structure = get_crystal(crystal).build_structure(supercell, perturbed, round_to_em8, min_distance)
+    return structure.as_dict()
+
+def command_displace(input:str, recipe:dict, atom:int = 0, dirname:str = '.', **kwargs):
+    """
+    Displacements of one Quantum Espresso input, see displacements.displace_input.
+    """
+    from .displacements import displace_input
+    return displace_input(input, recipe, atom, dirname, **kwargs)
+
+def command_deck(crystal:str, dirname:str = 'decks', pseudo_dir:str = 'pseudos', force:bool = False):
+    """
+    Input deck of one crystal, see decks.write_deck.
+    """
+    from .decks import make_job, write_deck
+    return write_deck(make_job(get_crystal(crystal), pseudo_dir), dirname, force)
+
+COMMANDS = dict(
+    ping = command_ping,
+    structure = command_structure,
+    displace = command_displace,
+    deck = command_deck,
+)
+STARTED = time.time()
+
+def handle(request:dict):
+    """
+    Execute a request in this process.
+
+    Returns
+    -------
+    response : dict
+        {'ok': True, 'result': ...} or {'ok': False, 'error': ...}
+    """
+    params = dict(request)
+    command = params.pop('command', None)
+    if command not in COMMANDS:
+        return dict(ok = False, error = f'Command {command} is not valid. Please choose from:\n\t{list(COMMANDS)}')
+    try:
+        return dict(ok = True, result = to_builtin(COMMANDS[command](**params)))
+    except Exception as error:
+        return dict(ok = False, error = f'{type(error).__name__}: {error}')
+
+#%% SERVER
+
+class ThreadOutput(object):
+    """
+    Replacement of sys.stdout or sys.stderr that collects what the thread of a request writes, see
+    captured_output. Other threads write to the original stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+
+    def write(self, text:str):
+        return self.buffers.get(threading.get_ident(), self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+@contextmanager
+def captured_output():
+    """
+    Collect what this thread writes to stdout and stderr, if they are ThreadOutput (see serve).
+    """
+    buffer = io.StringIO()
+    streams = [ stream for stream in (sys.stdout, sys.stderr) if isinstance(stream, ThreadOutput) ]
+    for stream in streams:
+        stream.buffers[threading.get_ident()] = buffer
+    try:
+        yield buffer
+    finally:
+        for stream in streams:
+            stream.buffers.pop(threading.get_ident(), None)
+
+def handle_captured(request:dict):
+    """
+    Execute a request as in handle, with the lines it prints in response['warnings'].
+    """
+    with captured_output() as output:
+        response = handle(request)
+    lines = output.getvalue().splitlines()
+    if lines:
+        response['warnings'] = lines
+    return response
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answer every line of json on a connection with a line of json.
+    """
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as error:
+                response = dict(ok = False, error = f'Invalid request: {error}')
+            else:
+                if request.get('command') == 'shutdown':
+                    self.reply(dict(ok = True, result = None))
+                    threading.Thread(target = self.server.shutdown).start()
+                    return
+                response = handle_captured(request)
+            self.reply(response)
+
+    def reply(self, response:dict):
+        self.wfile.write( (json.dumps(response) + '\n').encode() )
+        self.wfile.flush()
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def is_running(socket_path:str = None):
+    """
+    Whether a daemon answers on the socket.
+    """
+    try:
+        return request('ping', socket_path, fallback = False) is not None
+    except (OSError, RuntimeError):
+        return False
+
+def serve(socket_path:str = None, preload:bool = True):
+    """
+    Serve requests on a Unix domain socket until a shutdown request.
+
+    While serving, stdout and stderr are replaced by ThreadOutput so that the output of every request is
+    returned to its client, and every warning is shown (not only the first one of the daemon).
+
+    Parameters
+    ----------
+    socket_path : str, optional
+        The socket, default AH_SOCKET or alkali_halides-<uid>.sock in the temporary directory.
+    preload : bool, optional
+        Load pymatgen and the crystal database before accepting requests.
+    """
+    socket_path = socket_path or SOCKET
+    if os.path.exists(socket_path):
+        if is_running(socket_path):
+            raise RuntimeError(f'A daemon is already running on {socket_path}')
+        os.remove(socket_path)
+    if preload:
+        from .create_crystals import crystals
+        from . import displacements, decks
+    with Server(socket_path, RequestHandler) as server, warnings.catch_warnings():
+        os.chmod(socket_path, 0o600)
+        print(f'Serving on {socket_path} (pid {os.getpid()})', flush = True)
+        warnings.simplefilter('always')
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = ThreadOutput(stdout), ThreadOutput(stderr)
+        try:
+            server.serve_forever(poll_interval = 0.1)
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            os.remove(socket_path)
+
+#%% CLIENT
+
+def request(command:str, socket_path:str = None, fallback:bool = True, **params):
+    """
+    Send a request to the daemon, or execute it in this process if no daemon is running.
+
+    Parameters
+    ----------
+    command : str
+        One of COMMANDS, or 'shutdown'.
+    socket_path : str, optional
+        The socket of the daemon, see serve.
+    fallback : bool, optional
+        Execute the request in this process when no daemon is running. Otherwise raise an OSError.
+    params :
+        Parameters of the command. Paths should be absolute, the daemon has its own working directory.
+
+    Returns the result of the command, raises a RuntimeError for a failed command. What the command
+    printed in the daemon is printed to stderr.
+    """
+    message = dict(command = command, **params)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(TIMEOUT)
+            client.connect(socket_path or SOCKET)
+            client.sendall( (json.dumps(message) + '\n').encode() )
+            with client.makefile('rb') as file:
+                response = json.loads(file.readline())
+    except (FileNotFoundError, ConnectionRefusedError):
+        if not fallback or command == 'shutdown':
+            raise
+        response = handle(message)
+    for line in response.get('warnings', []):
+        print(line, file = sys.stderr)
+    if not response['ok']:
+        raise RuntimeError(response['error'])
+    return response['result']
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Input decks for Quantum Espresso and BerkeleyGW.
+
+Turns the settings of the crystals into the BGWpy kwargs (see Crystal.bgwpy_kwargs) and writes
+the directory tree of inputs for every step of a GW/BSE calculation:
+
+    <dirname>/<crystal>/kwargs.json
+    <dirname>/<crystal>/01-scf/scf.in
+    <dirname>/<crystal>/02-wfn/wfn.in
+    <dirname>/<crystal>/03-wfnq/wfn.in
+    <dirname>/<crystal>/04-wfn_fi/wfn.in
+    <dirname>/<crystal>/05-epsilon/epsilon.inp
+    <dirname>/<crystal>/06-sigma/sigma.inp
+    <dirname>/<crystal>/07-kernel/kernel.inp
+    <dirname>/<crystal>/08-absorption/absorption.inp
+
+Crystals are written concurrently in a process pool. A crystal whose rendered inputs are identical
+to what is already on disk is skipped, so regenerating the decks after changing one setting only
+touches the files that changed.
+"""
+
+import numpy as np
+import os, json, hashlib
+from concurrent.futures import ProcessPoolExecutor
+from pymatgen.core import Element
+from .kpoints import grid_kpoints
+
+MANIFEST = 'deck.sha1'
+
+#%% FORMATTING
+
+def fortran(value):
+    """
+    Format a python value as a Fortran namelist value.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return '.true.' if value else '.false.'
+    if isinstance(value, str):
+        return f"'{value}'"
+    return str(value)
+
+def namelist(name:str, variables:dict):
+    """
+    Render a Fortran namelist, e.g. &SYSTEM.
+    """
+    lines = [f'&{name}']
+    lines += [ f'   {key} = {fortran(value)}' for key, value in variables.items() ]
+    lines += ['/']
+    return '\n'.join(lines)
+
+#%% INPUT FILES
+
+def pw_input(job:dict, calculation:str, ngkpt, kshift = (0., 0., 0.), qshift = (0., 0., 0.)):
+    """
+    Render a pw.x input. The scf run uses an automatic grid, the other runs list every k-point
+    explicitly, as is needed to produce wavefunctions for BerkeleyGW.
+    """
+    kwargs = job['kwargs']
+    structure = kwargs['structure']
+    cell = structure['lattice']['matrix']
+    sites = [ (site['species'][0]['element'], site['abc']) for site in structure['sites'] ]
+    species = list(dict.fromkeys( element for element, _ in sites ))
+
+    control = dict(
+        calculation = calculation,
+        prefix = kwargs['prefix'],
+        pseudo_dir = job['pseudo_dir'],
+        outdir = '../tmp',
+    )
+    system = dict(
+        ibrav = 0,
+        nat = len(sites),
+        ntyp = len(species),
+        ecutwfc = kwargs['ecutwfc'],
+    )
+    if calculation != 'scf':
+        system['nbnd'] = kwargs['nbnd']
+        system['nosym'] = True
+    if min(kwargs['fft']) > 0:
+        system.update( nr1 = kwargs['fft'][0], nr2 = kwargs['fft'][1], nr3 = kwargs['fft'][2] )
+    electrons = dict(conv_thr = 1e-10)
+
+    lines  = [ namelist('CONTROL', control), namelist('SYSTEM', system), namelist('ELECTRONS', electrons) ]
+    lines += ['ATOMIC_SPECIES']
+    lines += [ f'  {element} {job["masses"][element]} {pseudo}' for element, pseudo in zip(species, kwargs['pseudos']) ]
+    lines += ['CELL_PARAMETERS angstrom']
+    lines += [ '  ' + ' '.join(f'{x:.10f}' for x in vector) for vector in cell ]
+    lines += ['ATOMIC_POSITIONS crystal']
+    lines += [ f'  {element} ' + ' '.join(f'{x:.10f}' for x in abc) for element, abc in sites ]
+    if calculation == 'scf':
+        lines += ['K_POINTS automatic']
+        lines += [ '  ' + ' '.join(str(n) for n in ngkpt) + ' ' + ' '.join(str(int(2*s)) for s in kshift) ]
+    else:
+        kpoints = grid_kpoints(ngkpt, kshift) + np.asarray(qshift, float)
+        lines += ['K_POINTS crystal', f'  {len(kpoints)}']
+        lines += [ '  ' + ' '.join(f'{x:.10f}' for x in k) + ' 1.0' for k in kpoints ]
+    return '\n'.join(lines) + '\n'
+
+def bgw_input(variables:dict, flags:list = (), blocks:dict = None):
+    """
+    Render a BerkeleyGW input file from keyword variables, flags and begin/end blocks.
+    """
+    lines  = [ f'{key} {value}' for key, value in variables.items() ]
+    lines += list(flags)
+    for name, rows in (blocks or {}).items():
+        lines += [f'begin {name}']
+        lines += [ '  ' + ' '.join(str(x) for x in row) for row in rows ]
+        lines += ['end']
+    return '\n'.join(lines) + '\n'
+
+def epsilon_input(kwargs:dict):
+    qpoints = grid_kpoints(kwargs['ngkpt'])
+    qpoints[0] = kwargs['qshift']
+    rows = [ [*(f'{x:.6f}' for x in q), '1.0', int(ii == 0)] for ii, q in enumerate(qpoints) ]
+    variables = dict(
+        epsilon_cutoff = kwargs['ecuteps'],
+        number_bands = kwargs['nbnd'] - 1,
+        **kwargs['epsilon_extra_variables'],
+    )
+    return bgw_input(variables, kwargs['epsilon_extra_lines'], dict(qpoints = rows))
+
+def sigma_input(kwargs:dict):
+    kpoints = grid_kpoints(kwargs['ngkpt'])
+    rows = [ [*(f'{x:.6f}' for x in k), '1.0'] for k in kpoints ]
+    variables = dict(
+        number_bands = kwargs['nbnd'] - 1,
+        band_index_min = kwargs['ibnd_min'],
+        band_index_max = kwargs['ibnd_max'],
+        **kwargs['sigma_extra_variables'],
+    )
+    return bgw_input(variables, kwargs['sigma_extra_lines'], dict(kpoints = rows))
+
+def kernel_input(kwargs:dict):
+    variables = dict(
+        number_val_bands = kwargs['nbnd_val_co'],
+        number_cond_bands = kwargs['nbnd_cond_co'],
+        **kwargs['sigma_extra_variables'],
+    )
+    flags = ['use_symmetries_coarse_grid', 'screening_semiconductor']
+    return bgw_input(variables, flags)
+
+def absorption_input(kwargs:dict):
+    variables = dict(
+        number_val_bands_coarse = kwargs['nbnd_val_co'],
+        number_cond_bands_coarse = kwargs['nbnd_cond_co'],
+        number_val_bands_fine = kwargs['nbnd_val_fi'],
+        number_cond_bands_fine = kwargs['nbnd_cond_fi'],
+        energy_resolution = 0.1,
+    )
+    flags = ['use_symmetries_coarse_grid', 'no_symmetries_fine_grid', 'screening_semiconductor',
+             'use_velocity', 'gaussian_broadening', 'eqp_co_corrections', 'diagonalization']
+    return bgw_input(variables, flags)
+
+def deck_inputs(job:dict):
+    """
+    Render all inputs of a single crystal.
+
+    Returns a dictionary of file contents keyed by their path relative to the crystal directory.
+    """
+    kwargs = job['kwargs']
+    files = {
+        'kwargs.json' : json.dumps(kwargs, indent = 1) + '\n',
+        '01-scf/scf.in' : pw_input(job, 'scf', kwargs['ngkpt_scf'], kwargs['kshift']),
+        '02-wfn/wfn.in' : pw_input(job, 'bands', kwargs['ngkpt'], kwargs['kshift']),
+        '03-wfnq/wfn.in' : pw_input(job, 'bands', kwargs['ngkpt'], kwargs['kshift'], kwargs['qshift']),
+        '04-wfn_fi/wfn.in' : pw_input(job, 'bands', kwargs['ngkpt_fine'], kwargs['kshift']),
+        '05-epsilon/epsilon.inp' : epsilon_input(kwargs),
+        '06-sigma/sigma.inp' : sigma_input(kwargs),
+        '07-kernel/kernel.inp' : kernel_input(kwargs),
+        '08-absorption/absorption.inp' : absorption_input(kwargs),
+    }
+    return files
+
+#%% WRITING
+
+def make_job(crystal, pseudo_dir:str = 'pseudos'):
+    """
+    Collect everything needed to render the decks of a crystal into plain python types, so that it
+    can be sent to a worker process.
+    """
+    kwargs = crystal.bgwpy_kwargs
+    kwargs['structure'] = kwargs['structure'].as_dict()
+    masses = { element : float(Element(element).atomic_mass) for element in crystal.species }
+    return dict(crystal = crystal.crystal, kwargs = kwargs, masses = masses, pseudo_dir = os.path.abspath(pseudo_dir))
+
+def write_deck(job:dict, dirname:str = 'decks', force:bool = False):
+    """
+    Write the decks of a single crystal (as returned by make_job).
+
+    Returns the crystal, whether it was written, and the number of files that changed.
+    """
+    files = deck_inputs(job)
+    digest = hashlib.sha1( json.dumps(files, sort_keys = True).encode() ).hexdigest()
+    root = os.path.join(dirname, job['crystal'])
+    manifest = os.path.join(root, MANIFEST)
+
+    # Skip the crystal if nothing changed since the previous run
+    if not force and os.path.exists(manifest):
+        with open(manifest) as file:
+            complete = all( os.path.exists(os.path.join(root, fn)) for fn in files )
+            if complete and file.read().strip() == digest:
+                return job['crystal'], False, 0
+
+    changed = 0
+    for fn, contents in files.items():
+        fn = os.path.join(root, fn)
+        if not force and os.path.exists(fn):
+            with open(fn) as file:
+                if file.read() == contents:
+                    continue
+        os.makedirs(os.path.dirname(fn), exist_ok = True)
+        with open(fn, 'w') as file:
+            file.write(contents)
+        changed += 1
+    with open(manifest, 'w') as file:
+        file.write(digest + '\n')
+    return job['crystal'], True, changed
+
+def write_decks(crystals = None, dirname:str = 'decks', pseudo_dir:str = 'pseudos', processes:int = None, force:bool = False):
+    """
+    Write the input decks of several crystals in parallel.
+
+    Parameters
+    ----------
+    crystals : list, optional
+        Crystals or crystal keys (e.g. 'LiF'). The default of None writes all 20 alkali halides.
+    dirname : str, optional
+        Root directory of the decks.
+    pseudo_dir : str, optional
+        Directory containing the pseudopotentials, written as an absolute path into the pw.x inputs.
+    processes : int, optional
+        Number of worker processes. The default of None uses all cores, 1 runs in this process.
+    force : bool, optional
+        Rewrite all files, even if they did not change.
+
+    Returns
+    -------
+    summary : list
+        Tuples (crystal, written, number of changed files) in the order of crystals.
+    """
+    from .create_crystals import crystals as all_crystals
+    if crystals is None:
+        crystals = all_crystals.values()
+    crystals = [ all_crystals[crystal] if isinstance(crystal, str) else crystal for crystal in crystals ]
+    jobs = [ make_job(crystal, pseudo_dir) for crystal in crystals ]
+
+    if processes == 1 or len(jobs) < 2:
+        return [ write_deck(job, dirname, force) for job in jobs ]
+    with ProcessPoolExecutor(processes) as pool:
+        return list( pool.map(write_deck, jobs, [dirname] * len(jobs), [force] * len(jobs)) )
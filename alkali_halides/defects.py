@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Point defect supercells: vacancies, substitutions, interstitials, F-centres and V_k centres.
+
+The supercell of a crystal is built with build_structure and its space group is found as permutations
+of the atoms: the point operations that map the lattice onto itself (kpoints.lattice_operations),
+each combined with the translations that map the atoms onto atoms of the same element. Positions are
+compared as integer keys, so that all operations are applied to all atoms (or candidate sites) at once.
+Sites, interstitial voids and halide pairs are reduced to their symmetry-inequivalent orbits with these
+operations, and one defect structure is built per orbit.
+
+Every defect carries its charge state (as tot_charge of pw.x: -1 is one extra electron) and unpaired
+electrons:
+
+- vacancy of an alkali (V_M, -1) or of a halide (the bare anion vacancy or alpha centre, +1),
+- F-centre: an electron trapped in a halide vacancy (0, one unpaired electron),
+- V_k centre: a hole shared by two neighbouring halides that form an X2- molecule (+1, one unpaired
+  electron). The two halides are moved together to the bond length VK_BOND, a starting geometry for
+  a relaxation,
+- substitution of an element of the same group (0) and interstitial ions (+1 for alkalis, -1 for
+  halides).
+
+The distance between a defect and its periodic images is the shortest lattice vector of the supercell,
+computed for all defects at once without building pymatgen structures.
+"""
+
+import numpy as np
+import os, json
+from pymatgen.core import Structure, Lattice
+from .attrdict import AttrDict
+from .kpoints import lattice_operations
+from .neighbors import neighbor_pairs, query_pairs
+from .constants import ALKALIS, HALIDES
+
+KINDS = ['vacancy', 'f-centre', 'vk-centre', 'substitution', 'interstitial']
+KEY_RESOLUTION = 10**4     # positions are compared on a grid of 1e-4 of the supercell vectors
+VK_BOND = dict(F = 1.95, Cl = 2.65, Br = 2.95, I = 3.30)   # Angstrom, X2- bond length of a V_k centre
+
+def get_crystal(crystal):
+    from .create_crystals import crystals
+    return crystals[crystal] if isinstance(crystal, str) else crystal
+
+#%% SYMMETRY
+
+def position_keys(frac):
+    """
+    Integer key of fractional positions (...,3), equal for positions that are equal modulo the lattice.
+    """
+    grid = np.round(np.asarray(frac, float) * KEY_RESOLUTION).astype(np.int64) % KEY_RESOLUTION
+    return (grid[..., 0] * KEY_RESOLUTION + grid[..., 1]) * KEY_RESOLUTION + grid[..., 2]
+
+def defect_host(crystal, supercell = 2):
+    """
+    Supercell of a crystal and its space group.
+
+    Returns
+    -------
+    host : AttrDict
+        lattice, species and frac_coords of the supercell, crystal, alkali and halide, and the space
+        group: rotations (O,3,3) and translations (O,3) acting on fractional coordinates as
+        frac @ rotation + translation, and permutations (O,N) of the atoms.
+    """
+    crystal = get_crystal(crystal)
+    structure = crystal.build_structure(supercell)
+    lattice = structure.lattice.matrix
+    species = np.array([ str(specie) for specie in structure.species ])
+    frac = structure.frac_coords % 1
+
+    # Point operations in fractional coordinates of the supercell
+    rotations = lattice_operations(lattice).transpose(0, 2, 1)
+    rotated = np.einsum('nx,rxy->rny', frac, rotations)                    # (R,N,3)
+    # Translations that bring the first atom back onto an atom of its element
+    targets = frac[species == species[0]]
+    translations = targets[None, :, :] - rotated[:, :1, :]                 # (R,T,3)
+    mapped = rotated[:, None, :, :] + translations[:, :, None, :]          # (R,T,N,3)
+
+    keys = position_keys(frac)
+    order = np.argsort(keys)
+    mapped_keys = position_keys(mapped)
+    index = np.minimum(np.searchsorted(keys[order], mapped_keys), len(keys) - 1)
+    permutations = order[index]
+    valid = np.all((keys[permutations] == mapped_keys) & (species[permutations] == species), axis = -1)
+
+    nops = rotations.shape[0] * translations.shape[1]
+    valid = valid.reshape(nops)
+    return AttrDict(
+        lattice = lattice,
+        species = species,
+        frac_coords = frac,
+        crystal = crystal.crystal,
+        alkali = crystal.alkali,
+        halide = crystal.halide,
+        rotations = np.repeat(rotations, translations.shape[1], axis = 0)[valid],
+        translations = (translations.reshape(nops, 3) % 1)[valid],
+        permutations = permutations.reshape(nops, -1)[valid],
+    )
+
+def point_orbits(host:AttrDict, points):
+    """
+    Symmetry-inequivalent points of a list of fractional positions.
+
+    Returns
+    -------
+    representatives : int array (U)
+        Index of the first point of every orbit.
+    multiplicity : int array (U)
+        Number of equivalent positions of every orbit in the supercell.
+    """
+    points = np.asarray(points, float)
+    images = np.einsum('mx,oxy->omy', points, host.rotations) + host.translations[:, None, :]
+    keys = np.sort(position_keys(images), axis = 0)                        # (O,M)
+    _, representatives = np.unique(keys[0], return_index = True)
+    multiplicity = 1 + np.sum(np.diff(keys[:, representatives], axis = 0) != 0, axis = 0)
+    return np.sort(representatives), multiplicity[np.argsort(representatives)]
+
+def atom_orbits(host:AttrDict, element:str):
+    """
+    Symmetry-inequivalent atoms of an element: indices of the representatives and multiplicities.
+    """
+    atoms = np.flatnonzero(host.species == element)
+    canonical = host.permutations[:, atoms].min(axis = 0)
+    unique, counts = np.unique(canonical, return_counts = True)
+    return unique, counts
+
+def pair_orbits(host:AttrDict, i, j):
+    """
+    Symmetry-inequivalent pairs of atoms (i, j): indices of the representative pairs and multiplicities.
+    """
+    natoms = len(host.species)
+    first, second = host.permutations[:, i], host.permutations[:, j]
+    keys = np.minimum(first, second) * natoms + np.maximum(first, second)   # (O,P)
+    canonical = keys.min(axis = 0)
+    _, representatives, counts = np.unique(canonical, return_index = True, return_counts = True)
+    return representatives, counts
+
+#%% SITES
+
+def image_distance(lattices, reach:int = 2):
+    """
+    Distance between a defect and its nearest periodic image: the shortest lattice vector (Angstrom)
+    of every lattice (...,3,3).
+    """
+    lattices = np.asarray(lattices, float)
+    shifts = np.array(np.meshgrid(*[ np.arange(-reach, reach + 1) ] * 3, indexing = 'ij')).reshape(3, -1).T
+    shifts = shifts[np.any(shifts != 0, axis = 1)]
+    return np.linalg.norm(np.einsum('sx,...xy->...sy', shifts, lattices), axis = -1).min(axis = -1)
+
+def interstitial_sites(host:AttrDict, divisions:int = 8, tol:float = 0.05):
+    """
+    Symmetry-inequivalent centres of the largest voids of the supercell.
+
+    Candidates lie on a grid of the supercell with divisions points per primitive lattice vector
+    (commensurate with the high symmetry points of the primitive cell). The candidates furthest from
+    any atom (within tol Angstrom) are the voids.
+
+    Returns
+    -------
+    sites : array (U,3)
+        Fractional coordinates of one site per orbit.
+    multiplicity : int array (U)
+    distance : float
+        Distance of the voids to the nearest atom in Angstrom.
+    """
+    crystal = get_crystal(host.crystal)
+    grid = np.array(np.meshgrid(*[ np.arange(divisions) ] * 3, indexing = 'ij')).reshape(3, -1).T / divisions
+    # primitive grid in supercell coordinates; its images in other primitive cells are equivalent
+    candidates = (grid @ crystal.lattice @ np.linalg.inv(host.lattice)) % 1
+    cutoff = np.linalg.norm(crystal.lattice, axis = -1).max()
+    query, _, distances = query_pairs(host.lattice, host.frac_coords, candidates, cutoff)
+    nearest = np.full(len(candidates), cutoff)
+    np.minimum.at(nearest, query, distances)
+    voids = candidates[nearest > nearest.max() - tol]
+    representatives, multiplicity = point_orbits(host, voids)
+    return voids[representatives], multiplicity, nearest.max()
+
+def halide_pairs(host:AttrDict, tol:float = 1e-3):
+    """
+    Symmetry-inequivalent pairs of nearest neighbour halides.
+
+    Returns
+    -------
+    i, j : int arrays (U)
+        Atoms of every pair.
+    image : int array (U,3)
+        Lattice translation of j.
+    multiplicity : int array (U)
+    """
+    halides = np.flatnonzero(host.species == host.halide)
+    cutoff = 1.5 * np.min(np.linalg.norm(get_crystal(host.crystal).lattice, axis = -1))
+    _, i, j, distance, image = neighbor_pairs(host.lattice, host.frac_coords[halides], cutoff)
+    nearest = distance < distance.min() + tol
+    i, j, image = halides[i[nearest]], halides[j[nearest]], image[nearest]
+    representatives, multiplicity = pair_orbits(host, i, j)
+    return i[representatives], j[representatives], image[representatives], multiplicity
+
+#%% DEFECTS
+
+def defect_entry(host:AttrDict, name:str, kind:str, species, frac, charge:int, unpaired:int, multiplicity:int, **kwargs):
+    return AttrDict(name = name, kind = kind, crystal = host.crystal, lattice = host.lattice, species = list(species),
+                    frac_coords = np.asarray(frac, float), charge = int(charge), unpaired = int(unpaired),
+                    multiplicity = int(multiplicity), **kwargs)
+
+def generate_defects(crystal, supercell = 2, kinds = ('vacancy', 'f-centre', 'vk-centre'), substitutes = (),
+                     interstitials = (), divisions:int = 8, vk_bond:float = None):
+    """
+    Build the symmetry-inequivalent defects of a crystal in a supercell.
+
+    Parameters
+    ----------
+    crystal : Crystal or str
+    supercell : int(3), optional
+        Supercell specification as in build_structure.
+    kinds : list, optional
+        Defects to build, see KINDS. Substitutions and interstitials are built for the elements in
+        substitutes and interstitials as well.
+    substitutes : list, optional
+        Elements that replace an atom of the same group, e.g. ['Br'] in KCl.
+    interstitials : list, optional
+        Elements added at the largest voids, e.g. ['K', 'Cl'].
+    divisions : int, optional
+        Grid of candidate interstitial sites per primitive lattice vector.
+    vk_bond : float, optional
+        Bond length of the X2- molecule of a V_k centre in Angstrom. The default is VK_BOND.
+
+    Returns
+    -------
+    host : AttrDict
+        The supercell and its space group, see defect_host.
+    defects : list
+        One AttrDict per defect: name, kind, crystal, lattice, species, frac_coords, charge (tot_charge
+        of pw.x), unpaired electrons, multiplicity (equivalent sites in the supercell), site (index or
+        fractional position of the defect), image_distance (Angstrom) and nearest (shortest distance of
+        an added or moved atom to the other atoms, inf for vacancies).
+    """
+    unknown = [ kind for kind in kinds if kind not in KINDS ]
+    if unknown:
+        raise ValueError(f'Options {unknown} are not valid kinds. Please choose from:\n\t{KINDS}')
+    host = defect_host(crystal, supercell)
+    species, frac = host.species, host.frac_coords
+    defects = []
+
+    if 'vacancy' in kinds or 'f-centre' in kinds:
+        for element, charge in [(host.alkali, -1), (host.halide, +1)]:
+            sites, multiplicity = atom_orbits(host, element)
+            for ii, (site, count) in enumerate(zip(sites, multiplicity)):
+                suffix = f'-{ii}' if len(sites) > 1 else ''
+                remaining = np.arange(len(species)) != site
+                if 'vacancy' in kinds:
+                    defects += [ defect_entry(host, f'V_{element}{suffix}', 'vacancy', species[remaining], frac[remaining],
+                                              charge, 0, count, site = int(site)) ]
+                if 'f-centre' in kinds and element == host.halide:
+                    defects += [ defect_entry(host, f'F_centre{suffix}', 'f-centre', species[remaining], frac[remaining],
+                                              0, 1, count, site = int(site)) ]
+
+    if 'vk-centre' in kinds:
+        bond = VK_BOND.get(host.halide) if vk_bond is None else vk_bond
+        i, j, image, multiplicity = halide_pairs(host)
+        for ii, (a, b, shift, count) in enumerate(zip(i, j, image, multiplicity)):
+            delta = (frac[b] + shift - frac[a]) @ host.lattice
+            middle = frac[a] @ host.lattice + delta / 2
+            unit = delta / np.linalg.norm(delta)
+            moved = frac.copy()
+            moved[a] = (middle - unit * bond / 2) @ np.linalg.inv(host.lattice) % 1
+            moved[b] = (middle + unit * bond / 2) @ np.linalg.inv(host.lattice) % 1
+            suffix = f'-{ii}' if len(i) > 1 else ''
+            defects += [ defect_entry(host, f'Vk{suffix}', 'vk-centre', species, moved, +1, 1, count,
+                                      site = [int(a), int(b)], bond = float(bond)) ]
+
+    for element in substitutes:
+        group = ALKALIS if element in ALKALIS else HALIDES if element in HALIDES else None
+        if group is None:
+            raise ValueError(f'Element {element} is not an alkali or halide.')
+        replaced = host.alkali if group is ALKALIS else host.halide
+        if replaced == element:
+            continue
+        sites, multiplicity = atom_orbits(host, replaced)
+        for ii, (site, count) in enumerate(zip(sites, multiplicity)):
+            suffix = f'-{ii}' if len(sites) > 1 else ''
+            new = species.copy().astype(object)
+            new[site] = element
+            defects += [ defect_entry(host, f'{element}_{replaced}{suffix}', 'substitution', new, frac, 0, 0, count,
+                                      site = int(site)) ]
+
+    if interstitials:
+        sites, multiplicity, _ = interstitial_sites(host, divisions)
+        for element in interstitials:
+            if element not in ALKALIS + HALIDES:
+                raise ValueError(f'Element {element} is not an alkali or halide.')
+            charge = +1 if element in ALKALIS else -1
+            for ii, (site, count) in enumerate(zip(sites, multiplicity)):
+                suffix = f'-{ii}' if len(sites) > 1 else ''
+                defects += [ defect_entry(host, f'{element}_i{suffix}', 'interstitial', list(species) + [element],
+                                          np.vstack([frac, site]), charge, 0, count, site = site.tolist()) ]
+
+    # Distances of all defects at once
+    distances = image_distance(np.array([ defect.lattice for defect in defects ])) if defects else []
+    for defect, distance in zip(defects, distances):
+        defect.image_distance = float(distance)
+        defect.nearest = nearest_distance(defect)
+    return host, defects
+
+def nearest_distance(defect:AttrDict, cutoff:float = 4.0):
+    """
+    Shortest distance between an added or moved atom of a defect and the other atoms (inf for vacancies
+    and when further than the cutoff).
+    """
+    if defect.kind == 'interstitial':
+        moved = [len(defect.species) - 1]
+    elif defect.kind == 'vk-centre':
+        moved = defect.site
+    else:
+        return np.inf
+    others = np.setdiff1d(np.arange(len(defect.species)), moved)
+    _, _, distance = query_pairs(defect.lattice, defect.frac_coords[others], defect.frac_coords[moved], cutoff)
+    return float(distance.min()) if len(distance) else np.inf
+
+def defect_structure(defect:AttrDict):
+    """
+    pymatgen Structure of a defect.
+    """
+    return Structure(Lattice(defect.lattice), [ str(specie) for specie in defect.species ], defect.frac_coords)
+
+def pw_settings(defect:AttrDict):
+    """
+    Settings of the &SYSTEM namelist of pw.x for the charge state of a defect.
+    """
+    settings = dict(tot_charge = defect.charge)
+    if defect.unpaired:
+        settings.update(nspin = 2, tot_magnetization = defect.unpaired)
+    return settings
+
+def write_defects(crystal, supercell = 2, dirname:str = 'defects', **kwargs):
+    """
+    Write the defects of a crystal to json files <dirname>/<name>/<crystal>.json.
+
+    A summary with the charge states, pw.x settings, multiplicities and image distances is written to
+    <dirname>/defects.json. See generate_defects for the other parameters.
+
+    Returns the list of written files.
+    """
+    host, defects = generate_defects(crystal, supercell, **kwargs)
+    files, summary = [], []
+    for defect in defects:
+        new_dir = os.path.join(dirname, defect.name)
+        os.makedirs(new_dir, exist_ok = True)
+        fn = os.path.join(new_dir, host.crystal + '.json')
+        with open(fn, 'w') as file:
+            json.dump(defect_structure(defect).as_dict(), file)
+        files += [fn]
+        summary += [ dict(file = fn, name = defect.name, kind = defect.kind, charge = defect.charge,
+                          unpaired = defect.unpaired, system = pw_settings(defect), multiplicity = defect.multiplicity,
+                          site = defect.site, image_distance = defect.image_distance, nearest = defect.nearest) ]
+    with open(os.path.join(dirname, 'defects.json'), 'w') as file:
+        json.dump(dict(crystal = host.crystal, natoms = len(host.species), operations = len(host.permutations),
+                       defects = summary), file, indent = 1)
+    return files
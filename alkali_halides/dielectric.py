@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Model dielectric functions to pre-screen the screening cutoff (ecuteps) and bands of epsilon.
+
+The static dielectric function eps(q) of an insulator is modelled from two numbers per crystal: the
+electronic dielectric constant epsinf (calc.epsinf, or lit.epsinf when not calculated) and the average
+valence density n = 2 * valence / volume of the primitive cell at calc.a0. Two models are available:
+
+- 'hybertsen-louie': eps(q) = 1 + 1 / [1 / (epsinf - 1) + alpha (q / q_TF)^2 + q^4 / (4 wp^2)],
+  the interpolation of Hybertsen and Louie, Phys. Rev. B 37, 2733 (1988), with alpha = 1.563.
+- 'levine-louie': the random phase approximation of the electron gas with its absorption shifted up
+  by a gap lambda = wp / sqrt(epsinf - 1), Levine and Louie, Phys. Rev. B 25, 6310 (1982). The static
+  limit follows from the Kramers-Kronig relation, integrated numerically for all q at once.
+
+Both go to epsinf for q -> 0 and to 1 as 4 wp^2 / q^4 for large q. The screening beyond a cutoff
+|q|^2 = ecuteps is negligible once eps(q) - 1 is below a tolerance, which gives the suggested
+ecuteps; the bands follow from the rule that epsilon needs about as many bands as G-vectors.
+
+The models are evaluated for all crystals and q-points at once, as arrays (crystals, q-points).
+Atomic units: q in 1/Bohr, energies in Hartree, cutoffs in Ry (ecut = q^2).
+"""
+
+import numpy as np
+from .fft import BOHR
+from .estimate import count_plane_waves
+
+HARTREE = 27.211386245988     # eV
+ALPHA_HL = 1.563
+MODELS = ['hybertsen-louie', 'levine-louie']
+NQUAD = 48                    # Gauss-Legendre points per interval of the Kramers-Kronig integral
+
+SCREENING_DTYPE = [
+    ('crystal', 'U8'),
+    ('epsinf', float),
+    ('source', 'U4'),          # 'calc' or 'lit'
+    ('density', float),        # valence electrons per Bohr^3
+    ('wp', float),             # eV, plasma energy of the valence electrons
+    ('ecuteps', float),        # Ry, suggested
+    ('set_ecuteps', float),    # Ry, settings.ecuteps
+    ('nbnd', int),             # suggested bands of epsilon
+    ('set_nbnd', int),         # settings.nbnd
+    ('eps_cutoff', float),     # eps(q) - 1 at settings.ecuteps
+    ('ok', bool),              # settings.ecuteps is at least the suggested cutoff
+]
+
+#%% PARAMETERS
+
+def crystal_parameters(crystals = None, source:str = 'auto'):
+    """
+    Parameters of the model for a list of crystals.
+
+    Parameters
+    ----------
+    crystals : list, optional
+        Crystals or crystal keys. The default of None uses all 20 alkali halides.
+    source : str, optional
+        Dielectric constant: 'calc', 'lit' or 'auto' (calc.epsinf where calculated, else lit.epsinf).
+
+    Returns
+    -------
+    crystals : list
+    epsinf, density, volume : arrays (C)
+        Dielectric constant, valence density (1/Bohr^3) and volume of the primitive cell (Bohr^3).
+    sources : list
+        Source of every dielectric constant.
+    """
+    from .create_crystals import crystals as all_crystals
+    if crystals is None:
+        crystals = all_crystals.values()
+    crystals = [ all_crystals[crystal] if isinstance(crystal, str) else crystal for crystal in crystals ]
+    if source not in ['auto', 'calc', 'lit']:
+        raise ValueError(f'Option {source} is not a valid source. Please choose from:\n\t{["auto", "calc", "lit"]}')
+
+    epsinf, sources = np.zeros(len(crystals)), []
+    for ii, crystal in enumerate(crystals):
+        calc = crystal.calc.epsinf
+        use_calc = source == 'calc' or (source == 'auto' and calc is not None and np.isfinite(calc))
+        epsinf[ii] = calc if use_calc else crystal.lit.epsinf
+        sources += ['calc' if use_calc else 'lit']
+    volume = np.array([ abs(np.linalg.det(crystal.lattice)) for crystal in crystals ]) / BOHR**3
+    density = 2 * np.array([ crystal.valence for crystal in crystals ], float) / volume
+    return crystals, epsinf, density, volume, sources
+
+def plasma_frequency(density):
+    """
+    Plasma frequency (Hartree) of an electron gas of a density (1/Bohr^3).
+    """
+    return np.sqrt(4 * np.pi * np.asarray(density, float))
+
+def fermi_wavevector(density):
+    return np.cbrt(3 * np.pi**2 * np.asarray(density, float))
+
+#%% MODELS
+
+def hybertsen_louie(q, epsinf, density, alpha:float = ALPHA_HL):
+    """
+    Static dielectric function of the Hybertsen-Louie model, arrays broadcast to (..., Q).
+    """
+    q = np.asarray(q, float)
+    epsinf = np.asarray(epsinf, float)[..., None]
+    density = np.asarray(density, float)[..., None]
+    wp2 = plasma_frequency(density)**2
+    qtf2 = 4 * fermi_wavevector(density) / np.pi
+    return 1 + 1 / (1 / (epsinf - 1) + alpha * q**2 / qtf2 + q**4 / (4 * wp2))
+
+def lindhard_absorption(q, nu, kf):
+    """
+    Imaginary part of the random phase approximation dielectric function of the electron gas.
+
+    Parameters
+    ----------
+    q, nu, kf : arrays
+        Wavevector (1/Bohr), frequency (Hartree) and Fermi wavevector, broadcast against each other.
+    """
+    z = q / (2 * kf)
+    u = nu / (q * kf)
+    inner = (z + u) < 1
+    outer = ~inner & (np.abs(z - u) < 1)
+    absorption = np.where(inner, np.pi / 2 * u, 0.) + np.where(outer, np.pi / (8 * z) * (1 - (z - u)**2), 0.)
+    return 4 * kf / (np.pi * q**2) * absorption
+
+def levine_louie(q, epsinf, density):
+    """
+    Static dielectric function of the Levine-Louie model, arrays broadcast to (..., Q).
+
+    eps(q) = 1 + 2 / pi int eps2_RPA(q, nu) nu / (nu^2 + lambda^2) dnu, with Gauss-Legendre quadrature
+    on the two intervals between the kinks of eps2_RPA, at all (crystal, q) at once.
+    """
+    q = np.maximum(np.asarray(q, float), 1e-8)
+    epsinf = np.asarray(epsinf, float)[..., None, None]
+    density = np.asarray(density, float)[..., None, None]
+    kf = fermi_wavevector(density)
+    gap2 = plasma_frequency(density)**2 / (epsinf - 1)
+
+    q = q[..., None]
+    kink = np.abs(q * kf - q**2 / 2)
+    top = q * kf + q**2 / 2
+    nodes, weights = np.polynomial.legendre.leggauss(NQUAD)
+    t, w = (nodes + 1) / 2, weights / 2
+    integral = 0.
+    for start, stop in [(0, kink), (kink, top)]:
+        nu = start + (stop - start) * t
+        integrand = lindhard_absorption(q, nu, kf) * nu / (nu**2 + gap2)
+        integral = integral + np.sum(integrand * w, axis = -1) * (stop - start)[..., 0]
+    return 1 + 2 / np.pi * integral
+
+def model_epsilon(q, epsinf, density, model:str = 'hybertsen-louie'):
+    """
+    Static dielectric function eps(q) of a model.
+
+    Parameters
+    ----------
+    q : array (Q)
+        Wavevectors in 1/Bohr.
+    epsinf, density : arrays (C)
+        Dielectric constants and valence densities (1/Bohr^3) of C crystals.
+
+    Returns
+    -------
+    eps : array (C,Q)
+    """
+    if model == 'hybertsen-louie':
+        return hybertsen_louie(q, epsinf, density)
+    if model == 'levine-louie':
+        return levine_louie(q, epsinf, density)
+    raise ValueError(f'Option {model} is not a valid model. Please choose from:\n\t{MODELS}')
+
+def epsilon_grid(crystal, ngkpt, ecut:float, model:str = 'hybertsen-louie', source:str = 'auto'):
+    """
+    Model dielectric function on the q-points of a k-grid plus all G-vectors within a cutoff.
+
+    Parameters
+    ----------
+    crystal : Crystal or str
+    ngkpt : int(3)
+        q-grid (Gamma centred).
+    ecut : float
+        Cutoff of |q+G|^2 in Ry.
+
+    Returns
+    -------
+    qG : array (M,3)
+        Cartesian q+G in 1/Bohr.
+    eps : array (M)
+    """
+    from .kpoints import grid_kpoints
+    crystals, epsinf, density, _, _ = crystal_parameters([crystal], source)
+    reciprocal = 2 * np.pi * np.linalg.inv(crystals[0].lattice / BOHR).T
+    gmax = np.sqrt(ecut)
+    nmax = np.ceil(gmax * np.linalg.norm(crystals[0].lattice / BOHR, axis = -1) / (2 * np.pi)).astype(int) + 1
+    G = np.array(np.meshgrid(*[ np.arange(-n, n + 1) for n in nmax ], indexing = 'ij')).reshape(3, -1).T
+    qpoints = grid_kpoints(ngkpt)
+    qG = ((qpoints[:, None, :] + G[None, :, :]) @ reciprocal).reshape(-1, 3)
+    norms = np.linalg.norm(qG, axis = -1)
+    qG, norms = qG[norms**2 <= ecut], norms[norms**2 <= ecut]
+    return qG, model_epsilon(norms, epsinf, density, model)[0]
+
+#%% CUTOFFS
+
+def suggest_cutoffs(crystals = None, tol:float = 0.01, model:str = 'hybertsen-louie', source:str = 'auto', nq:int = 4000):
+    """
+    Suggested screening cutoffs and bands of epsilon for crystals, compared with their settings.
+
+    Parameters
+    ----------
+    crystals : list, optional
+        Crystals or crystal keys. The default of None uses all 20 alkali halides.
+    tol : float, optional
+        Largest eps(q) - 1 left out: the suggested ecuteps is the smallest |q|^2 beyond which the
+        screening stays below tol.
+    model : str, optional
+        One of MODELS.
+    source : str, optional
+        Source of epsinf, see crystal_parameters.
+    nq : int, optional
+        Number of wavevectors of the radial grid.
+
+    Returns
+    -------
+    table : structured array (SCREENING_DTYPE)
+        One row per crystal. ok is False where settings.ecuteps is below the suggested cutoff, so that
+        full convergence runs are only needed near the suggestion.
+    """
+    crystals, epsinf, density, volume, sources = crystal_parameters(crystals, source)
+    q = np.linspace(0, 30, nq)[1:]
+    eps = model_epsilon(q, epsinf, density, model)
+    # beyond the last q where the screening exceeds tol
+    screened = eps - 1 >= tol
+    last = np.where(screened.any(axis = 1), nq - 2 - np.argmax(screened[:, ::-1], axis = 1), 0)
+    ecuteps = q[np.minimum(last + 1, len(q) - 1)]**2
+
+    set_ecuteps = np.array([ crystal.settings.ecuteps for crystal in crystals ], float)
+    table = np.zeros(len(crystals), SCREENING_DTYPE)
+    table['crystal'] = [ crystal.crystal for crystal in crystals ]
+    table['epsinf'] = epsinf
+    table['source'] = sources
+    table['density'] = density
+    table['wp'] = plasma_frequency(density) * HARTREE
+    table['ecuteps'] = ecuteps
+    table['set_ecuteps'] = set_ecuteps
+    table['nbnd'] = np.ceil(count_plane_waves(volume, ecuteps))
+    table['set_nbnd'] = [ crystal.settings.nbnd for crystal in crystals ]
+    table['eps_cutoff'] = model_epsilon(np.sqrt(set_ecuteps)[:, None], epsinf, density, model)[:, 0] - 1
+    table['ok'] = set_ecuteps >= ecuteps
+    return table
@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+"""
+Programmatic displacements of a single atom, independent of user input.
+
+Every method of AH_displace is a parameterized object. Its length is known up front and any displacement
+can be computed from its index, so displacements are produced lazily in chunks and a 200x200x200 volume
+never has to exist in memory at once. All displacements are in cell coordinates (abc); methods with
+cart = True take their parameters in cartesian coordinates and need the cell (rprim) to convert.
+
+Example
+-------
+    recipe = Volume(np.identity(3), [(-0.1, 0.1, 200)] * 3)
+    write_displacements(recipe, 'LiF.in', 0, rprim, species, pos_abc)
+"""
+
+import numpy as np
+import os, json, fnmatch
+from concurrent.futures import ProcessPoolExecutor
+from pymatgen.core import Structure, Lattice
+from .neighbors import screen_frames
+from .grid import ProductGrid, shard_range
+from .fingerprint import FingerprintIndex, fingerprints
+from .scripts.filehandling import leading_zeros
+
+CHUNK_SIZE = 10000
+DUPLICATE_FILE = 'DUPLICATE'
+
+#%% METHODS
+
+class Displacement(object):
+    """
+    Base class of the displacement methods. Subclasses set self.size and implement displacements.
+    """
+    size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f'<{type(self).__name__}({self.size} displacements)>'
+
+    def displacements(self, indices):
+        """
+        Displacements (abc) of the given indices, as an array (len(indices),3).
+        """
+        raise NotImplementedError
+
+    def chunks(self, chunk_size:int = CHUNK_SIZE):
+        """
+        Yield (start index, displacements) in chunks of at most chunk_size.
+        """
+        for start in range(0, self.size, chunk_size):
+            yield start, self.displacements( np.arange(start, min(start + chunk_size, self.size)) )
+
+    def __iter__(self):
+        for _, chunk in self.chunks():
+            yield from chunk
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.displacements( np.arange(self.size)[index] )
+        indices = np.arange(self.size)[index]
+        return self.displacements(np.atleast_1d(indices)).reshape(np.shape(indices) + (3,))
+
+    def to_array(self):
+        """
+        All displacements at once, as an array (len,3).
+        """
+        return self.displacements( np.arange(self.size) )
+
+    def shard(self, rank:int, nranks:int):
+        """
+        One of nranks contiguous parts of the displacements, e.g. for one of several workers.
+        """
+        return Shard(self, *shard_range(self.size, rank, nranks))
+
+    def to_cell(self, vectors, cart:bool, rprim):
+        """
+        Convert vectors to cell coordinates if they are cartesian.
+        """
+        if not cart:
+            return vectors
+        if rprim is None:
+            raise ValueError(f'{type(self).__name__} in cartesian coordinates needs the cell (rprim).')
+        return vectors @ np.linalg.inv(rprim)
+
+class Array(Displacement):
+    """
+    Displacements given as an array (N,3) in cell coordinates.
+    """
+    def __init__(self, dis_abc):
+        self.dis_abc = np.asarray(dis_abc, float).reshape(-1, 3)
+        self.size = len(self.dis_abc)
+
+    def displacements(self, indices):
+        return self.dis_abc[indices]
+
+class Zero(Displacement):
+    """
+    Zero displacement. Effectively converts QE input to JSON.
+    """
+    size = 1
+
+    def displacements(self, indices):
+        return np.zeros((len(indices), 3))
+
+class Line(Displacement):
+    """
+    Displacements along a single vector, vector * linspace(start, stop, number).
+    """
+    def __init__(self, vector, start:float, stop:float, number:int, cart:bool = False, rprim = None):
+        self.vector = self.to_cell(np.asarray(vector, float), cart, rprim)
+        self.mults = np.linspace(start, stop, int(number))
+        self.size = len(self.mults)
+
+    def displacements(self, indices):
+        return self.mults[indices, None] * self.vector
+
+class Magnitude(Line):
+    """
+    Displacements along a direction with a given magnitude, e.g. direction (1,1,1) and magnitude 0.66
+    give the vector 0.66 * (1,1,1) / sqrt(3).
+    """
+    def __init__(self, direction, magnitude:float, start:float, stop:float, number:int, cart:bool = False, rprim = None):
+        direction = np.asarray(direction, float)
+        vector = magnitude * direction / np.sqrt(np.sum(direction**2))
+        super().__init__(vector, start, stop, number, cart, rprim)
+
+class Grid(Displacement):
+    """
+    Displacements on a grid spanned by several vectors, each with its own range (start, stop, number).
+    The first vector runs slowest.
+    """
+    def __init__(self, vectors, ranges, cart:bool = False, rprim = None):
+        self.vectors = self.to_cell(np.asarray(vectors, float).reshape(-1, 3), cart, rprim)
+        if len(ranges) != len(self.vectors):
+            raise ValueError(f'{len(self.vectors)} vectors need as many ranges, got {len(ranges)}.')
+        self.grid = ProductGrid([ (vector, np.linspace(start, stop, int(number)))
+                                  for vector, (start, stop, number) in zip(self.vectors, ranges) ])
+        self.shape = self.grid.shape
+        self.size = self.grid.size
+
+    def displacements(self, indices):
+        return self.grid.take(indices)
+
+    def to_array(self):
+        return self.grid.to_array()
+
+class Plane(Grid):
+    """
+    Displacements on a plane spanned by two vectors.
+    """
+    def __init__(self, vectors, ranges, cart:bool = False, rprim = None):
+        if len(vectors) != 2:
+            raise ValueError(f'A plane is spanned by 2 vectors, got {len(vectors)}.')
+        super().__init__(vectors, ranges, cart, rprim)
+
+class Volume(Grid):
+    """
+    Displacements in a volume spanned by three vectors.
+    """
+    def __init__(self, vectors, ranges, cart:bool = False, rprim = None):
+        if len(vectors) != 3:
+            raise ValueError(f'A volume is spanned by 3 vectors, got {len(vectors)}.')
+        super().__init__(vectors, ranges, cart, rprim)
+
+class Step(Displacement):
+    """
+    4 displacements: none, and a step along each cell (or cartesian) axis.
+    """
+    size = 4
+
+    def __init__(self, step:float, cart:bool = False, rprim = None):
+        self.dis_abc = np.append([[0, 0, 0]], self.to_cell(np.identity(3), cart, rprim) * step, axis = 0)
+
+    def displacements(self, indices):
+        return self.dis_abc[indices]
+
+class Shell(Displacement):
+    """
+    Displacements on a sphere of a given radius, made by projecting the surface of a cube with npoints
+    per edge onto the sphere. With octant = True only the three faces in the positive octant are used.
+    """
+    # (first axis, second axis, fixed axis, sign of the fixed axis) of every face
+    FACES = [(0, 1, 2, -1), (0, 1, 2, 1), (0, 2, 1, -1), (0, 2, 1, 1), (1, 2, 0, -1), (1, 2, 0, 1)]
+
+    def __init__(self, radius:float, npoints:int, cart:bool = False, octant:bool = False, rprim = None):
+        self.radius = radius
+        self.npoints = int(npoints)
+        mult = np.linspace(0, 1, self.npoints) if octant else np.linspace(-1, 1, self.npoints)
+        axes = np.identity(3)
+        # Every face is a grid of its two axes, shifted along the fixed axis
+        self.faces = [ ProductGrid([ (axes[u], mult), (axes[v], mult), sign * axes[w][None] ])
+                       for u, v, w, sign in self.FACES if not octant or sign > 0 ]
+        self.cart, self.rprim = cart, rprim
+        self.size = len(self.faces) * self.npoints**2
+
+    def displacements(self, indices):
+        face, index = np.divmod(indices, self.npoints**2)
+        cube = np.zeros((len(indices), 3))
+        for ii, grid in enumerate(self.faces):
+            cube[face == ii] = grid.take(index[face == ii])
+        sphere = cube / np.sqrt(np.sum(cube**2, axis = 1))[:, None] * self.radius
+        return self.to_cell(sphere, self.cart, self.rprim)
+
+class Shard(Displacement):
+    """
+    Contiguous part [start, stop) of another displacement method, see Displacement.shard.
+    Its offset and total keep the numbering of the full set when writing.
+    """
+    def __init__(self, parent:Displacement, start:int, stop:int):
+        self.parent = parent
+        self.offset = start
+        self.total = len(parent)
+        self.size = stop - start
+
+    def displacements(self, indices):
+        return self.parent.displacements( np.asarray(indices, int) + self.offset )
+
+#%% WRITING
+
+def create_json(fn, rprim, species, coords):
+    """
+    Create a json file containing the pymatgen structure.
+    fn : str
+        filename of the Quantum Espresso file used to make the structure.
+    rprim : array (3,3)
+        the real space primitive cell.
+    species : list (N)
+        which atoms are present.
+    coords : array (N,3)
+        the coordinates of the atoms in the cell corresponding to species.
+    """
+    structure = Structure(
+        lattice = Lattice(rprim),
+        species = species,
+        coords = coords
+    )
+    fn = fn[:-3] + '.json' if fn[-3:] == '.in' else fn
+    with open(fn,'w') as file:
+        json.dump(structure.as_dict(), file)
+    return fn
+
+def point_to_existing(new_dir, existing, nodir:bool = False):
+    """
+    Write a note instead of a json file for a structure that is already calculated elsewhere.
+    Returns the message for the user.
+    """
+    if not nodir:
+        os.makedirs(new_dir, exist_ok=True)
+        note = new_dir + '/' + DUPLICATE_FILE
+    else:
+        note = new_dir + '-' + DUPLICATE_FILE
+    with open(note, 'w') as file:
+        file.write(existing + '\n')
+    return f'Duplicate: {new_dir} is the same structure as {existing}'
+
+def stream_displacements(displacement, fn, move_index, rprim, species, pos_abc, nodir:bool = False,
+                         min_dist:float = 0.5, reject:bool = False, index:str = None, chunk_size:int = CHUNK_SIZE,
+                         dirname:str = None, messages:list = None):
+    """
+    Write displaced structures to json files [dirname/]D####/<fn>.json, chunk by chunk.
+
+    Parameters
+    ----------
+    displacement : Displacement or array (N,3)
+        The displacements (abc) of the moved atom.
+    fn : str
+        Filename of the Quantum Espresso file used to make the structure.
+    move_index : int
+        Index of the moved atom.
+    rprim, species, pos_abc :
+        Cell, species and positions (abc) of the undisplaced structure.
+    nodir : bool, optional
+        Write files D####-<fn>.json instead of subdirectories.
+    min_dist : float, optional
+        Flag displacements that bring atoms closer than min_dist Angstrom (0 disables).
+    reject : bool, optional
+        Do not write flagged displacements.
+    index : str or FingerprintIndex, optional
+        Fingerprint index (see fingerprint.FingerprintIndex). Structures in the index get a note
+        pointing to the existing result instead of a json file. The index stores the D#### path,
+        also with nodir, so that a rerun recognises its own files. A filename is saved at the end, a
+        FingerprintIndex is left to the caller to save.
+    chunk_size : int, optional
+        Number of displacements that are screened and fingerprinted at once.
+    dirname : str, optional
+        Directory in which the D#### directories are made. The default is the working directory.
+    messages : list, optional
+        Warnings about close atoms and duplicates are appended to this list instead of printed.
+
+    Yields
+    ------
+    json_fn : str
+        Filename of each displacement, '' for skipped displacements and duplicates.
+    """
+    if not isinstance(displacement, Displacement):
+        displacement = Array(displacement)
+    pos_abc = np.asarray(pos_abc, float)
+
+    # Leading zeros in dir/file names, numbered as in the full set for a Shard
+    N10 = leading_zeros(getattr(displacement, 'total', len(displacement)))
+    offset = getattr(displacement, 'offset', 0)
+    save = isinstance(index, str)
+    index = FingerprintIndex(index) if save else index
+    report = print if messages is None else messages.append
+
+    for start, dis_abc in displacement.chunks(chunk_size):
+        start += offset
+        frames = np.repeat(pos_abc[None], len(dis_abc), axis=0)
+        frames[:, move_index] += dis_abc
+
+        ## SCREEN FOR ATOMS THAT ARE TOO CLOSE
+        accepted = np.ones(len(dis_abc), bool)
+        if min_dist > 0:
+            accepted, distances = screen_frames(rprim, frames, min_dist, moved=[move_index])
+            for ii in np.flatnonzero(~accepted):
+                action = 'Skipped' if reject else 'Warning'
+                report(f'{action}: D{start + ii:0{N10}d} has atoms {distances[ii]:.3f} Å apart (< {min_dist} Å)')
+
+        ## LOOK UP STRUCTURES THAT ARE ALREADY CALCULATED
+        if index is not None:
+            prints = fingerprints(rprim, species, frames)
+
+        ## CREATE JASONS
+        for ii, npos_abc in enumerate(frames):
+            if reject and not accepted[ii]:
+                yield ''
+                continue
+            # location of file
+            new_dir = f'D{start + ii:0{N10}d}'
+            if dirname is not None:
+                new_dir = os.path.join(dirname, new_dir)
+            if index is not None and index.lookup(prints[ii]) not in [None, os.path.abspath(new_dir)]:
+                report(point_to_existing(new_dir, index.lookup(prints[ii]), nodir))
+                yield ''
+                continue
+            if not nodir:
+                new_fn = new_dir + '/' + fn
+                if not os.path.exists(new_dir):
+                    os.makedirs(new_dir)
+            else:
+                new_fn = new_dir + '-' + fn
+            json_fn = create_json(new_fn, rprim, species, npos_abc)
+            if index is not None:
+                index.add(prints[ii], new_dir)
+            yield json_fn
+
+    if save:
+        index.save()
+
+def write_displacements(displacement, fn, move_index, rprim, species, pos_abc, **kwargs):
+    """
+    Write displaced structures to json files, see stream_displacements.
+
+    Returns the list of json files ('' for skipped displacements and duplicates).
+    """
+    return list( stream_displacements(displacement, fn, move_index, rprim, species, pos_abc, **kwargs) )
+
+#%% RECIPES
+
+RECIPE_KEYS = {
+    'line': ['vector', 'range'], 'line-cart': ['vector', 'range'],
+    'mag': ['direction', 'magnitude', 'range'], 'mag-cart': ['direction', 'magnitude', 'range'],
+    'zero': [],
+    'plane': ['vectors', 'ranges'], 'volume': ['vectors', 'ranges'],
+    'step': ['step'], 'step-cart': ['step'],
+    'shell': ['radius', 'npoints'], 'shell-cart': ['radius', 'npoints'],
+    'shell-oct': ['radius', 'npoints'], 'shell-cart-oct': ['radius', 'npoints'],
+}
+
+def make_displacement(recipe:dict, rprim = None):
+    """
+    Displacement of a recipe, a dictionary with the method of AH_displace and its parameters, e.g.
+    {'method': 'shell-cart', 'radius': 0.3, 'npoints': 5} or
+    {'method': 'line', 'vector': [1, 0, 0], 'range': [-0.1, 0.1, 11]}.
+    The cell (rprim) is needed for the cartesian methods.
+    """
+    method = recipe.get('method', 'line')
+    if method not in RECIPE_KEYS:
+        raise ValueError(f'Option {method} is not a valid option. Please choose from:\n\t{list(RECIPE_KEYS)}')
+    missing = [ key for key in RECIPE_KEYS[method] if key not in recipe ]
+    if missing:
+        raise ValueError(f'Recipe for {method} is missing {missing}.')
+    cart = 'cart' in method
+    if method in ['line', 'line-cart']:
+        return Line(recipe['vector'], *recipe['range'], cart = cart, rprim = rprim)
+    if method in ['mag', 'mag-cart']:
+        return Magnitude(recipe['direction'], recipe['magnitude'], *recipe['range'], cart = cart, rprim = rprim)
+    if method == 'zero':
+        return Zero()
+    if method == 'plane':
+        return Plane(recipe['vectors'], recipe['ranges'])
+    if method == 'volume':
+        return Volume(recipe['vectors'], recipe['ranges'])
+    if method in ['step', 'step-cart']:
+        return Step(recipe['step'], cart = cart, rprim = rprim)
+    return Shell(recipe['radius'], recipe['npoints'], cart = cart, octant = 'oct' in method, rprim = rprim)
+
+#%% MANY INPUTS
+
+def find_inputs(root:str = '.', include = ('*.in',), exclude = ()):
+    """
+    Recursively find Quantum Espresso input files.
+
+    Patterns are matched against the file name and against the path relative to root, e.g.
+    include ['*.in'] and exclude ['*/old/*', 'scf.in'].
+
+    Returns the sorted list of files.
+    """
+    matches = lambda path, patterns : any( fnmatch.fnmatch(os.path.basename(path), pattern) or
+                                           fnmatch.fnmatch(path, pattern) for pattern in patterns )
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(dirpath, filename), root)
+            if matches(path, include) and not matches(path, exclude):
+                files += [ os.path.join(root, path) ]
+    return sorted(files)
+
+def displace_input(fn, recipe:dict, move_index:int, dirname:str, **kwargs):
+    """
+    Apply a recipe to one Quantum Espresso input and write its displacements into dirname.
+    Errors are reported in the summary instead of raised, so that one input does not stop the others.
+
+    Returns
+    -------
+    summary : dict
+        input, output, atom, displacements, written (json files), skipped, error and warnings (list of
+        the warnings about close atoms and duplicates).
+    """
+    from .qe import read_QE
+    summary = dict(input = fn, output = dirname, atom = None, displacements = 0, written = 0, skipped = 0, error = '',
+                   warnings = [])
+    try:
+        rprim, species, pos_abc = read_QE(fn)
+        summary['atom'] = f'[{move_index}] {species[move_index]}'
+        displacement = make_displacement(recipe, rprim)
+        json_files = write_displacements(displacement, os.path.basename(fn), move_index, rprim, species, pos_abc,
+                                         dirname = dirname, messages = summary['warnings'], **kwargs)
+        summary['displacements'] = len(json_files)
+        summary['written'] = sum( bool(json_fn) for json_fn in json_files )
+        summary['skipped'] = len(json_files) - summary['written']
+    except Exception as error:
+        summary['error'] = f'{type(error).__name__}: {error}'
+    return summary
+
+def displace_indexed(fn, recipe:dict, move_index:int, dirname:str, index:str = None, **kwargs):
+    """
+    Worker of displace_inputs: displace one input against an index (filename or FingerprintIndex).
+    A filename is read as it is at the start, and the index is not saved here.
+
+    Returns
+    -------
+    summary : dict
+        See displace_input.
+    added : dict
+        Fingerprints {fingerprint: directory} that this input added to the index.
+    """
+    if index is None:
+        return displace_input(fn, recipe, move_index, dirname, **kwargs), {}
+    index = FingerprintIndex(index) if isinstance(index, str) else index
+    known = set(index.entries)
+    summary = displace_input(fn, recipe, move_index, dirname, index = index, **kwargs)
+    return summary, { key: value for key, value in index.entries.items() if key not in known }
+
+def displace_inputs(files, recipe:dict, move_index:int = 0, dirname:str = 'displacements', root:str = '.',
+                    processes:int = None, **kwargs):
+    """
+    Apply one recipe to many Quantum Espresso inputs in parallel.
+
+    Parameters
+    ----------
+    files : list
+        Quantum Espresso input files, e.g. from find_inputs.
+    recipe : dict
+        Displacement recipe, see make_displacement.
+    move_index : int, optional
+        Index of the moved atom in every input.
+    dirname : str, optional
+        Output root. The displacements of root/a/LiF.in are written to dirname/a/LiF/D####.
+    root : str, optional
+        Directory the input paths are taken relative to.
+    processes : int, optional
+        Number of worker processes. The default of None uses all cores, 1 runs in this process.
+    kwargs :
+        Passed to stream_displacements (nodir, min_dist, reject, index, chunk_size). The workers
+        return the fingerprints they add to the index, which is saved once at the end. Worker
+        processes only see the index as it was at the start, so the same structure in two inputs is
+        only recognised when running in this process.
+
+    Returns
+    -------
+    summary : list
+        Summary of every input (see displace_input), also written to dirname/summary.json.
+    """
+    make_displacement(recipe, np.identity(3)) # check the recipe before starting
+    outputs = [ os.path.join(dirname, os.path.splitext(os.path.relpath(fn, root))[0]) for fn in files ]
+    jobs = [ (fn, recipe, move_index, output) for fn, output in zip(files, outputs) ]
+    index = kwargs.pop('index', None)
+    index = FingerprintIndex(index) if index is not None else None
+    if processes == 1 or len(jobs) < 2:
+        results = [ displace_indexed(*job, index = index, **kwargs) for job in jobs ]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [ pool.submit(displace_indexed, *job, index = None if index is None else index.filename,
+                                     **kwargs) for job in jobs ]
+            results = [ future.result() for future in futures ]
+    summary = [ entry for entry, _ in results ]
+    if index is not None:
+        for _, added in results:
+            for fingerprint, directory in added.items():
+                index.add(fingerprint, directory)
+        index.save()
+    os.makedirs(dirname, exist_ok = True)
+    with open(os.path.join(dirname, 'summary.json'), 'w') as file:
+        json.dump(dict(recipe = recipe, atom = move_index, inputs = summary), file, indent = 1)
+    return summary
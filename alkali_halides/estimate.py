@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Resource estimates for planned calculations.
+
+All estimates are computed for a whole table of calculations at once. A table is a numpy structured
+array with one row per calculation (a crystal, a crystal in a supercell or a displaced frame), see
+plan_table. The estimate adds the number of plane waves, the dense FFT grid, the number of irreducible
+k-points, the wavefunction memory and the relative cost of epsilon and sigma.
+
+Units are those of Quantum Espresso: cutoffs in Ry, lengths in Bohr.
+"""
+
+import numpy as np
+from .crystal import supercell_matrix
+from .kpoints import irreducible_kpoints
+from .fft import BOHR, fft_grid
+
+BYTES_COMPLEX = 16
+NSIGMA = 6 # bands computed by sigma, see Crystal.bgwpy_kwargs
+
+PLAN_DTYPE = [
+    ('crystal', 'U16'),
+    ('natoms', int),
+    ('lattice', float, (3,3)), # Angstrom
+    ('ecutwfc', float),
+    ('ecuteps', float),
+    ('nbnd', int),
+    ('valence', int),
+    ('ngkpt_scf', int, 3),
+    ('ngkpt_co', int, 3),
+    ('ngkpt_fi', int, 3),
+    ('symmetric', bool),
+]
+
+ESTIMATE_DTYPE = [
+    ('volume', float),       # Bohr^3
+    ('npw', float),          # plane waves per k-point
+    ('ngeps', float),        # G-vectors of the dielectric matrix
+    ('fft', int, 3),         # dense FFT grid, rounded to fast sizes
+    ('nk_scf', int),         # irreducible k-points
+    ('nk_co', int),
+    ('nk_fi', int),
+    ('mem_scf', float),      # bytes of the occupied wavefunctions on the scf grid
+    ('mem_wfn', float),      # bytes of nbnd wavefunctions on the coarse grid
+    ('cost_epsilon', float), # relative cost, the cheapest calculation of the table is 1
+    ('cost_sigma', float),
+]
+
+def scale_kgrid(ngkpt, lattice, supercell):
+    """
+    K-grid of a supercell with the same k-point density as ngkpt on the primitive lattice.
+    """
+    reciprocal = np.linalg.inv(lattice).T
+    reciprocal_super = np.linalg.inv(supercell @ lattice).T
+    spacing = np.linalg.norm(reciprocal, axis = -1) / ngkpt
+    return np.maximum(1, np.ceil( np.linalg.norm(reciprocal_super, axis = -1) / spacing.max() - 1e-6 )).astype(int)
+
+def plan_table(crystals = None, supercells = None, displaced:bool = False):
+    """
+    Table of planned calculations for every combination of crystal and supercell.
+
+    Parameters
+    ----------
+    crystals : list, optional
+        Crystals or crystal keys (e.g. 'LiF'). The default of None uses all 20 alkali halides.
+    supercells : list, optional
+        Supercell specifications as accepted by build_structure (None, N, (X,Y,Z) or a (3,3) matrix).
+        The default of None only plans the primitive cells.
+    displaced : bool, optional
+        Whether the atoms are displaced, which removes the symmetry used to reduce the k-points.
+
+    Returns
+    -------
+    table : structured array
+        One row per calculation, see PLAN_DTYPE. Bands and valence scale with the supercell size,
+        k-grids are scaled to keep the k-point density.
+    """
+    from .create_crystals import crystals as all_crystals
+    if crystals is None:
+        crystals = all_crystals.values()
+    crystals = [ all_crystals[crystal] if isinstance(crystal, str) else crystal for crystal in crystals ]
+    if supercells is None:
+        supercells = [None]
+
+    table = np.zeros(len(crystals) * len(supercells), PLAN_DTYPE)
+    for row, (crystal, supercell) in zip(table, [ (c, s) for c in crystals for s in supercells ]):
+        matrix = supercell_matrix(supercell)
+        size = int(round(abs(np.linalg.det(matrix))))
+        settings = crystal.settings
+        row['crystal'] = crystal.crystal
+        row['natoms'] = len(crystal.species) * size
+        row['lattice'] = matrix @ crystal.lattice
+        row['ecutwfc'] = settings.ecutwfc
+        row['ecuteps'] = settings.ecuteps
+        row['nbnd'] = settings.nbnd * size
+        row['valence'] = crystal.valence * size
+        for grid in ['ngkpt_scf', 'ngkpt_co', 'ngkpt_fi']:
+            row[grid] = scale_kgrid(settings[grid], crystal.lattice, matrix)
+        row['symmetric'] = not displaced
+    return table
+
+def count_plane_waves(volume, ecut):
+    """
+    Number of plane waves within a cutoff sphere (Ry) of a cell with a volume in Bohr^3.
+    """
+    return volume * np.asarray(ecut, float)**1.5 / (6 * np.pi**2)
+
+def count_kpoints(ngkpt, lattice, symmetric):
+    """
+    Number of irreducible k-points for every row.
+    """
+    counts = np.zeros(len(ngkpt), int)
+    for ii, (grid, cell, sym) in enumerate(zip(ngkpt, lattice, symmetric)):
+        if sym:
+            counts[ii] = len(irreducible_kpoints(grid, cell)[0])
+        else:
+            # Only time reversal remains
+            total = np.prod(grid)
+            counts[ii] = (total + np.sum(np.all((2 * np.indices(grid)) % grid[:,None,None,None] == 0, axis = 0))) // 2
+    return counts
+
+def estimate(table):
+    """
+    Estimate the resources of every calculation in a table (see plan_table).
+
+    Returns a structured array with the fields of the table followed by those of ESTIMATE_DTYPE.
+    """
+    result = np.zeros(len(table), PLAN_DTYPE + ESTIMATE_DTYPE)
+    for name in table.dtype.names:
+        result[name] = table[name]
+
+    volume = np.abs(np.linalg.det(table['lattice'])) / BOHR**3
+    result['volume'] = volume
+    result['npw'] = count_plane_waves(volume, table['ecutwfc'])
+    result['ngeps'] = count_plane_waves(volume, table['ecuteps'])
+    result['fft'] = fft_grid(table['lattice'], table['ecutwfc'])
+
+    for grid in ['scf', 'co', 'fi']:
+        result[f'nk_{grid}'] = count_kpoints(table[f'ngkpt_{grid}'], table['lattice'], table['symmetric'])
+
+    result['mem_scf'] = BYTES_COMPLEX * result['npw'] * table['valence'] * result['nk_scf']
+    result['mem_wfn'] = BYTES_COMPLEX * result['npw'] * table['nbnd'] * result['nk_co']
+
+    # chi0 ~ Nq * Nk * Nv * Nc * NG^2 and sigma ~ Nk * Nq * Nb * NG^2 * Nsigma
+    nk_full = np.prod(table['ngkpt_co'], axis = -1)
+    nv = table['valence']
+    nc = table['nbnd'] - nv
+    ngeps2 = result['ngeps']**2
+    cost_epsilon = result['nk_co'] * nk_full * nv * nc * ngeps2
+    cost_sigma = result['nk_co'] * nk_full * table['nbnd'] * ngeps2 * NSIGMA
+    result['cost_epsilon'] = cost_epsilon / cost_epsilon.min()
+    result['cost_sigma'] = cost_sigma / cost_sigma.min()
+    return result
+
+def estimate_database(crystals = None, supercells = None, displaced:bool = False):
+    """
+    Estimate the resources of all crystals (and supercells) in the database.
+
+    See plan_table for the parameters and estimate for the result.
+    """
+    return estimate( plan_table(crystals, supercells, displaced) )
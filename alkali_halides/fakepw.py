@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+A fake pw.x for testing the throughput of the displacement, run and harvest pipeline.
+
+Instead of solving the Kohn-Sham equations, the energy, forces and stress follow from a rigid-ion model:
+charges of +1 and -1, Coulomb interactions with the damped shifted force sum (short-ranged and pairwise,
+Fennell and Gezelter, J. Chem. Phys. 124, 234104 (2006)) and a Born-Mayer repulsion A exp(-r/rho)
+between cations and anions. The prefactor A of every cation-anion pair is fitted such that the rock salt
+crystal of the pair has no pressure at its calculated lattice constant calc.a0.
+
+The output mimics that of pw.x, so that it is read by qe.read_pw_output and qe.read_stress, and a
+configurable latency stands in for the run time. The lattice constants are those of the crystal database,
+including the AH_RESULTS overlay, which is only loaded when a prefactor is first needed.
+"""
+
+import numpy as np
+import sys, time
+from math import erfc
+from functools import lru_cache
+from .neighbors import neighbor_pairs
+from .structures import structures
+from .fft import BOHR
+from .qe import read_structure
+from .constants import K_COULOMB, RYDBERG, RY_BOHR3_TO_KBAR, ALKALIS, HALIDES
+
+RHO = 0.3                     # Angstrom, Born-Mayer range
+ALPHA = 0.2                   # 1/Angstrom, damping of the Coulomb sum
+CUTOFF = 10.0                 # Angstrom
+
+#%% MODEL
+
+def charge(element:str):
+    if element in ALKALIS:
+        return 1.
+    if element in HALIDES:
+        return -1.
+    raise ValueError(f'Element {element} is not an alkali or halide.')
+
+def coulomb(r, qq, alpha:float = ALPHA, cutoff:float = CUTOFF):
+    """
+    Damped shifted force Coulomb energy (eV) and its derivative with respect to r of pairs at distance r.
+    """
+    from scipy.special import erfc as erfc_array
+    shift = erfc(alpha * cutoff) / cutoff
+    slope = erfc(alpha * cutoff) / cutoff**2 + 2 * alpha / np.sqrt(np.pi) * np.exp(-(alpha * cutoff)**2) / cutoff
+    damped = erfc_array(alpha * r) / r
+    energy = K_COULOMB * qq * (damped - shift + slope * (r - cutoff))
+    derivative = K_COULOMB * qq * (-damped / r - 2 * alpha / np.sqrt(np.pi) * np.exp(-(alpha * r)**2) / r + slope)
+    return energy, derivative
+
+def model(lattice, species, frac_coords, prefactors:dict, cutoff:float = CUTOFF):
+    """
+    Energy, forces and stress of the rigid-ion model.
+
+    Parameters
+    ----------
+    lattice : array (3,3)
+        Lattice vectors as rows in Angstrom.
+    species : list (N)
+        Elements of the atoms.
+    frac_coords : array (N,3)
+        Fractional coordinates.
+    prefactors : dict
+        Born-Mayer prefactor A (eV) of every (alkali, halide) pair.
+
+    Returns
+    -------
+    energy : float
+        eV
+    forces : array (N,3)
+        eV/Angstrom
+    stress : array (3,3)
+        eV/Angstrom^3, positive under compression as printed by pw.x.
+    """
+    lattice = np.asarray(lattice, float)
+    frac = np.asarray(frac_coords, float)
+    _, i, j, r, image = neighbor_pairs(lattice, frac, cutoff)
+    delta = (frac[j] + image - frac[i]) @ lattice
+
+    charges = np.array([ charge(element) for element in species ])
+    energy, derivative = coulomb(r, charges[i] * charges[j], cutoff = cutoff)
+
+    # Born-Mayer repulsion between cations and anions
+    A = np.zeros(len(r))
+    elements = np.asarray(species)
+    for (alkali, halide), value in prefactors.items():
+        pair = ((elements[i] == alkali) & (elements[j] == halide)) | ((elements[i] == halide) & (elements[j] == alkali))
+        A[pair] = value
+    repulsion = A * np.exp(-r / RHO)
+    energy = energy + repulsion
+    derivative = derivative - repulsion / RHO
+
+    # Pair forces along the pair vectors, and the virial
+    pair_force = derivative[:, None] * delta / r[:, None]
+    forces = np.zeros((len(frac), 3))
+    np.add.at(forces, i, pair_force)
+    np.add.at(forces, j, -pair_force)
+    volume = abs(np.linalg.det(lattice))
+    stress = -np.einsum('pa,pb->ab', pair_force, delta) / volume
+
+    # Self energy of the damped shifted force sum
+    self_energy = -K_COULOMB * np.sum(charges**2) * (erfc(ALPHA * cutoff) / (2 * cutoff) + ALPHA / np.sqrt(np.pi))
+    return float(np.sum(energy) + self_energy), forces, stress
+
+#%% PARAMETERS
+
+def rock_salt(alkali:str, halide:str, a0:float):
+    """
+    Primitive cell of the rock salt crystal of a pair: lattice, species and fractional coordinates.
+    """
+    fcc = structures.fcc
+    return a0 * fcc.basic_to_primitive * fcc.rprim, [alkali, halide], np.asarray(fcc.coordinates, float)
+
+@lru_cache
+def prefactor(alkali:str, halide:str):
+    """
+    Born-Mayer prefactor A (eV) of a cation-anion pair, for no pressure in its rock salt crystal at calc.a0.
+    Energy and stress are linear in A, so that A follows from one evaluation with and without repulsion.
+    """
+    from .create_crystals import crystals
+    if alkali + halide not in crystals or not np.isfinite(crystals[alkali + halide].calc.a0):
+        raise ValueError(f'No calculated lattice constant for {alkali}{halide}.')
+    a0 = crystals[alkali + halide].calc.a0
+    cell = rock_salt(alkali, halide, a0)
+    _, _, coulomb_stress = model(*cell, {})
+    _, _, unit_stress = model(*cell, {(alkali, halide): 1.})
+    return -np.trace(coulomb_stress) / np.trace(unit_stress - coulomb_stress)
+
+def prefactors(species):
+    """
+    Born-Mayer prefactors {(alkali, halide): A} of all cation-anion pairs in a list of elements.
+    """
+    elements = set(species)
+    return { (alkali, halide): prefactor(alkali, halide) for alkali in ALKALIS for halide in HALIDES
+             if alkali in elements and halide in elements }
+
+#%% INPUT AND OUTPUT
+
+def write_output(file, filename:str, lattice, species, energy:float, forces, stress, namelists:dict):
+    """
+    Write the results in the format of a pw.x output (energies in Ry, forces in Ry/bohr, stress in
+    Ry/bohr^3 and kbar).
+    """
+    alat = np.linalg.norm(lattice[0]) / BOHR
+    volume = abs(np.linalg.det(lattice)) / BOHR**3
+    ecutwfc = float(namelists.get('system', {}).get('ecutwfc', 0))
+    kinds = list(dict.fromkeys(species))
+    forces = forces * BOHR / RYDBERG
+    stress = stress * BOHR**3 / RYDBERG
+    kbar = stress * RY_BOHR3_TO_KBAR
+
+    out  = f'\n     Program PWSCF (fake pw.x of alkali_halides) starts on {time.strftime("%d%b%Y at %H:%M:%S")}\n\n'
+    out += f'     Reading input from {filename}\n\n'
+    out += f'     lattice parameter (alat)  = {alat:12.4f}  a.u.\n'
+    out += f'     unit-cell volume          = {volume:12.4f} (a.u.)^3\n'
+    out += f'     number of atoms/cell      = {len(species):12d}\n'
+    out += f'     number of atomic types    = {len(kinds):12d}\n'
+    out += f'     kinetic-energy cutoff     = {ecutwfc:12.4f}  Ry\n\n'
+    out += f'     convergence has been achieved in   1 iterations\n\n'
+    out += f'!    total energy              = {energy / RYDBERG:17.8f} Ry\n\n'
+    out += f'     Forces acting on atoms (cartesian axes, Ry/au):\n\n'
+    for ii, (element, force) in enumerate(zip(species, forces)):
+        out += f'     atom {ii+1:4d} type {kinds.index(element)+1:2d}   force = {force[0]:14.8f}{force[1]:14.8f}{force[2]:14.8f}\n'
+    out += f'\n     Total force = {np.sqrt(np.sum(forces**2)):12.6f}     Total SCF correction =     0.000000\n\n'
+    out += f'     Computing stress (Cartesian axis) and pressure\n\n'
+    out += f'          total   stress  (Ry/bohr**3)                   (kbar)     P= {np.trace(kbar) / 3:12.2f}\n'
+    for row, row_kbar in zip(stress, kbar):
+        out += f'  {row[0]:13.8f}{row[1]:13.8f}{row[2]:13.8f}  {row_kbar[0]:12.2f}{row_kbar[1]:12.2f}{row_kbar[2]:12.2f}\n'
+    out += f'\n     JOB DONE.\n'
+    file.write(out)
+
+def run(filename:str, output = None, latency:float = 0., per_atom:float = 0., jitter:float = 0., seed = None):
+    """
+    Run the fake pw.x on an input file.
+
+    Parameters
+    ----------
+    filename : str
+        pw.x input or pymatgen json file.
+    output : file, optional
+        Where the output is written. The default is stdout.
+    latency : float, optional
+        Run time in seconds.
+    per_atom : float, optional
+        Additional run time per atom in seconds.
+    jitter : float, optional
+        Relative random variation of the run time, e.g. 0.1 for +-10%.
+    seed : int, optional
+        Seed of the jitter.
+
+    Returns
+    -------
+    energy, forces, stress : as returned by model (eV, eV/Angstrom, eV/Angstrom^3)
+    """
+    start = time.perf_counter()
+    lattice, species, frac, namelists = read_structure(filename)
+    energy, forces, stress = model(lattice, species, frac, prefactors(species))
+    write_output(output or sys.stdout, filename, lattice, species, energy, forces, stress, namelists)
+    duration = (latency + per_atom * len(species)) * (1 + jitter * np.random.default_rng(seed).uniform(-1, 1))
+    time.sleep(max(0., duration - (time.perf_counter() - start)))
+    return energy, forces, stress
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+FFT grids from the cutoff and the lattice.
+
+The dense grid has to contain the sphere of the density cutoff (dual * ecutwfc). The minimal grid is
+rounded up to the next size whose prime factors are all in PRIMES, for which FFT libraries are fast.
+"""
+
+import numpy as np
+from functools import lru_cache
+
+BOHR = 0.529177210903 # Angstrom
+PRIMES = (2, 3, 5, 7)
+
+@lru_cache(maxsize = 16)
+def smooth_sizes(nmax:int = 4096, primes:tuple = PRIMES):
+    """
+    All integers up to nmax whose prime factors are in primes, sorted.
+    """
+    sizes = np.array([1])
+    for prime in primes:
+        powers = prime ** np.arange( int(np.log(nmax) / np.log(prime)) + 1 )
+        sizes = np.outer(sizes, powers).ravel()
+        sizes = sizes[sizes <= nmax]
+    return np.sort(sizes)
+
+def round_to_smooth(n, primes:tuple = PRIMES):
+    """
+    Round integers up to the next size with only small prime factors.
+    """
+    n = np.asarray(n, int)
+    sizes = smooth_sizes( max(16, 2 * int(n.max(initial = 1))), tuple(primes) )
+    return sizes[ np.searchsorted(sizes, n) ]
+
+def min_fft_grid(lattice, ecutwfc, dual:float = 4):
+    """
+    Smallest FFT grid that contains the density cutoff sphere (dual * ecutwfc).
+
+    Parameters
+    ----------
+    lattice : array (...,3,3)
+        Lattice vectors as rows in Angstrom.
+    ecutwfc : float (...)
+        Wavefunction cutoff in Ry.
+    dual : float, optional
+        Ratio of the density and wavefunction cutoff.
+
+    Returns
+    -------
+    fft : int array (...,3)
+    """
+    lengths = np.linalg.norm(np.asarray(lattice, float) / BOHR, axis = -1)
+    gmax = np.sqrt(dual * np.asarray(ecutwfc, float))[..., None]
+    return 2 * np.floor(gmax * lengths / (2 * np.pi) + 1e-8).astype(int) + 1
+
+def fft_grid(lattice, ecutwfc, dual:float = 4, primes:tuple = PRIMES):
+    """
+    Fastest admissible FFT grid for a cutoff, vectorized over lattices and cutoffs.
+
+    Parameters
+    ----------
+    lattice : array (...,3,3)
+        Lattice vectors as rows in Angstrom, e.g. of many crystals or supercells.
+    ecutwfc : float (...)
+        Wavefunction cutoff in Ry, broadcast against the lattices.
+    dual : float, optional
+        Ratio of the density and wavefunction cutoff.
+    primes : tuple, optional
+        Allowed prime factors of the grid sizes.
+
+    Returns
+    -------
+    fft : int array (...,3)
+    """
+    return round_to_smooth( min_fft_grid(lattice, ecutwfc, dual), primes )
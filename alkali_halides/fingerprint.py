@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Canonical structure fingerprints and an on-disk index of calculated structures.
+
+Two structures get the same fingerprint when they are identical up to a translation of all atoms and a
+permutation of atoms of the same species. The fingerprint hashes the lattice and the fractional
+coordinates, wrapped into the cell and rounded to a tolerance, after moving each atom of the rarest
+species to the origin in turn and keeping the smallest sorted result. The lattice is compared as given,
+so structures should come from the same generator (e.g. build_structure) to be recognised.
+
+Coordinates that lie right at the edge of a rounding interval can still give different fingerprints for
+equal structures, which only means that a duplicate is calculated again.
+"""
+
+import numpy as np
+import os, json, hashlib, fcntl, tempfile
+
+CHUNK_SIZE = 2**22 # elements of the (frames, origins, atoms) arrays
+
+def canonical_coords(species, frac_coords, tol:float = 1e-4):
+    """
+    Canonical integer coordinates of a batch of frames.
+
+    Parameters
+    ----------
+    species : list (N)
+        Species of the atoms, equal for all frames.
+    frac_coords : array (N,3) or (F,N,3)
+        Fractional coordinates.
+    tol : float, optional
+        Rounding tolerance in fractional coordinates.
+
+    Returns
+    -------
+    canonical : int array (F,N,4)
+        Species code and rounded coordinates of each atom, sorted.
+    """
+    frac = np.asarray(frac_coords, float)
+    frac = frac[None] if frac.ndim == 2 else frac
+    _, codes = np.unique(np.asarray(species, str), return_inverse = True)
+    steps = int(round(1 / tol))
+
+    # Limit the size of the (frames, origins, atoms) arrays
+    counts = np.bincount(codes)
+    chunk = max(1, CHUNK_SIZE // (counts.min() * len(codes)))
+    if len(frac) > chunk:
+        return np.concatenate([ canonical_coords(species, frac[ii:ii+chunk], tol) for ii in range(0, len(frac), chunk) ])
+
+    # Atoms of the rarest species are the candidate origins
+    origins = np.flatnonzero(codes == np.argmin(counts))
+    shifted = frac[:, None, :, :] - frac[:, origins, None, :]               # (F,C,N,3)
+    quantized = np.mod(np.round(shifted * steps).astype(np.int64), steps)
+    keys = np.concatenate((np.broadcast_to(codes[:, None], quantized.shape[:-1] + (1,)), quantized), axis = -1)
+
+    # Sort the atoms of every candidate by species and coordinates
+    flat = keys[..., 0] * steps**3 + keys[..., 1] * steps**2 + keys[..., 2] * steps + keys[..., 3]
+    order = np.argsort(flat, axis = -1)
+    flat = np.take_along_axis(flat, order, axis = -1)                        # (F,C,N)
+
+    # Lexicographically smallest candidate, narrowing down atom by atom
+    candidates = np.ones(flat.shape[:2], bool)
+    for column in np.moveaxis(flat, 2, 0):
+        smallest = np.where(candidates, column, np.iinfo(np.int64).max).min(axis = 1)
+        candidates &= column == smallest[:, None]
+    best = np.argmax(candidates, axis = 1)
+    frames = np.arange(len(frac))
+    return np.take_along_axis(keys[frames, best], order[frames, best][..., None], axis = 1)
+
+def fingerprints(lattice, species, frac_coords, tol:float = 1e-4, lattice_tol:float = 1e-4):
+    """
+    Fingerprints of a batch of frames that share the lattice and species.
+
+    Parameters
+    ----------
+    lattice : array (3,3)
+        Lattice vectors as rows in Angstrom.
+    species : list (N)
+        Species of the atoms.
+    frac_coords : array (N,3) or (F,N,3)
+        Fractional coordinates.
+    tol : float, optional
+        Rounding tolerance in fractional coordinates.
+    lattice_tol : float, optional
+        Rounding tolerance of the lattice in Angstrom.
+
+    Returns
+    -------
+    fingerprints : list (F)
+        Hexadecimal sha1 strings.
+    """
+    canonical = canonical_coords(species, frac_coords, tol)
+    names = ' '.join(np.unique(np.asarray(species, str)))
+    header = np.round(np.asarray(lattice, float) / lattice_tol).astype(np.int64).tobytes() + names.encode()
+    return [ hashlib.sha1(header + frame.tobytes()).hexdigest() for frame in canonical ]
+
+def structure_fingerprint(structure, tol:float = 1e-4):
+    """
+    Fingerprint of a pymatgen Structure.
+    """
+    species = [ str(specie) for specie in structure.species ]
+    return fingerprints(structure.lattice.matrix, species, structure.frac_coords, tol)[0]
+
+class FingerprintIndex(object):
+    """
+    Index mapping fingerprints to the directories in which the structure is (being) calculated,
+    stored as a json file.
+    """
+    def __init__(self, filename:str = 'fingerprints.json'):
+        self.filename = filename
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename) as file:
+                self.entries = json.load(file)
+
+    def __repr__(self):
+        return f'<FingerprintIndex({self.filename}, {len(self.entries)} entries)>'
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, fingerprint:str):
+        return fingerprint in self.entries
+
+    def lookup(self, fingerprint:str):
+        """
+        Directory of a fingerprint, or None if it is not in the index.
+        """
+        return self.entries.get(fingerprint)
+
+    def add(self, fingerprint:str, dirname:str):
+        """
+        Add a fingerprint with the directory of its results, stored as an absolute path.
+        Existing entries are kept. Returns the directory in the index.
+        """
+        return self.entries.setdefault(fingerprint, os.path.abspath(dirname))
+
+    def save(self):
+        """
+        Write the index, merging entries that other processes added in the meantime.
+
+        Reading, merging and replacing the file happen under an exclusive lock on <filename>.lock, and
+        the merged index is written to a unique temporary file next to it, so that concurrent writers
+        neither lose entries nor replace the index with a half-written file.
+        """
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        with open(self.filename + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = {}
+            if os.path.exists(self.filename):
+                with open(self.filename) as file:
+                    entries = json.load(file)
+            entries.update(self.entries)
+            descriptor, temporary = tempfile.mkstemp(dir = directory, prefix = os.path.basename(self.filename), suffix = '.tmp')
+            try:
+                with os.fdopen(descriptor, 'w') as file:
+                    json.dump(entries, file, indent = 0)
+                os.replace(temporary, self.filename)
+            except BaseException:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+                raise
+        self.entries = entries
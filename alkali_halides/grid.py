@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Cartesian-product grids of displacement vectors.
+
+A grid combines any number of axes, each a set of vectors (n_k, D), into all sums of one vector per axis.
+The full grid is built by broadcasting, and any point can also be computed from its flat index, so a grid
+can be sliced or sharded across workers without building the whole array. The first axis runs slowest.
+"""
+
+import numpy as np
+
+def add_convolve(a, b):
+    """
+    All sums of a vector from a and a vector from b, a running slowest.
+
+    Parameters
+    ----------
+    a : array (N,D)
+    b : array (M,D)
+
+    Returns
+    -------
+    sums : array (N*M,D)
+    """
+    a, b = np.asarray(a, float), np.asarray(b, float)
+    return (a[:, None, :] + b[None, :, :]).reshape(-1, a.shape[-1])
+
+def shard_range(size:int, rank:int, nranks:int):
+    """
+    Contiguous range of indices (start, stop) of one of nranks nearly equal shards.
+    """
+    if not 0 <= rank < nranks:
+        raise ValueError(f'Rank {rank} is not in range({nranks}).')
+    bounds = np.linspace(0, size, nranks + 1).round().astype(int)
+    return int(bounds[rank]), int(bounds[rank + 1])
+
+class ProductGrid(object):
+    """
+    Grid of all sums of one vector per axis.
+
+    Parameters
+    ----------
+    axes : list
+        Arrays (n_k, D) of vectors, or (vector, mults) tuples which give mults[:, None] * vector.
+    """
+    def __init__(self, axes):
+        self.axes = []
+        for axis in axes:
+            if isinstance(axis, tuple):
+                vector, mults = axis
+                axis = np.asarray(mults, float)[:, None] * np.asarray(vector, float)
+            self.axes += [ np.asarray(axis, float) ]
+        self.shape = tuple( len(axis) for axis in self.axes )
+        self.size = int(np.prod(self.shape))
+        self.dim = self.axes[0].shape[-1]
+
+    def __repr__(self):
+        return f'<ProductGrid({" x ".join(str(n) for n in self.shape)})>'
+
+    def __len__(self):
+        return self.size
+
+    def take(self, indices):
+        """
+        Grid points of the given flat indices, as an array (len(indices),D).
+        """
+        indices = np.asarray(indices, int)
+        points = np.zeros((len(indices), self.dim))
+        for axis, index in zip(self.axes, np.unravel_index(indices, self.shape)):
+            points += axis[index]
+        return points
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take( np.arange(self.size)[index] )
+        indices = np.arange(self.size)[index]
+        return self.take(np.atleast_1d(indices)).reshape(np.shape(indices) + (self.dim,))
+
+    def shard(self, rank:int, nranks:int):
+        """
+        Grid points of one of nranks contiguous shards.
+        """
+        return self.take( np.arange(*shard_range(self.size, rank, nranks)) )
+
+    def to_array(self):
+        """
+        All grid points, built by broadcasting, as an array (size,D).
+        """
+        ndim = len(self.axes)
+        points = np.zeros(self.shape + (self.dim,))
+        for k, axis in enumerate(self.axes):
+            points = points + axis.reshape( (1,) * k + (len(axis),) + (1,) * (ndim - k - 1) + (self.dim,) )
+        return points.reshape(-1, self.dim)
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Job-array scripts with tasks packed by their estimated cost.
+
+A generated set of calculations (displacements, strains, alloys or input decks) is a list of input files,
+one task each. The cost of every task is estimated from its atoms, cutoff, bands and irreducible
+k-points, and the tasks are packed into the elements of one array job so that every element has about
+the same run time, within the walltime. The result is a scheduler script (SLURM or PBS), a tab-separated
+list of the tasks of every element and a manifest with the estimates.
+
+Inputs in numbered step directories of the same parent, e.g. the decks <crystal>/01-scf/scf.in and
+<crystal>/02-wfn/wfn.in, depend on each other. They form a chain that is packed into one element and run
+in the order of the steps; when a step fails, the later steps of its chain are skipped.
+
+The scripts only need files, so they can be tried locally: the array index can be given as the first
+argument instead of by the scheduler, e.g. bash job.slurm 3.
+"""
+
+import numpy as np
+import os, re, json, heapq
+from .attrdict import AttrDict
+from .qe import read_pw_input, read_lattice
+from .fft import BOHR
+from .kpoints import irreducible_kpoints
+from .estimate import count_plane_waves, count_kpoints, scale_kgrid
+
+SCHEDULERS = ['slurm', 'pbs']
+COMMAND = 'pw.x -in "$input" > "$output"'
+JSON_COMMAND = 'AH_fakepw -in "$input" > "$output"'
+STEP_PATTERN = r'^(\d+)-'
+TASKS_FILE = 'tasks.txt'
+MANIFEST_FILE = 'manifest.json'
+
+#%% COST
+
+def get_crystal(species):
+    """
+    Crystal of the alkali and halide in a list of elements.
+    """
+    from .create_crystals import crystals
+    for crystal in crystals.values():
+        if crystal.alkali in species and crystal.halide in species:
+            return crystal
+    raise ValueError(f'No crystal in the database matches the elements {sorted(set(species))}.')
+
+def task_parameters(filename:str):
+    """
+    Size of the calculation of an input file (pw.x input or pymatgen json).
+
+    Settings that are not in the file (always for json) are taken from the crystal of its elements:
+    ecutwfc, the scf k-point density and valence occupied bands per two atoms. Json structures are
+    assumed to have no symmetry other than time reversal. The cell of pw.x inputs is converted to Angstrom
+    from the units of CELL_PARAMETERS.
+
+    Returns
+    -------
+    parameters : AttrDict
+        natoms, volume (Bohr^3), ecutwfc (Ry), nbnd and nk (irreducible k-points).
+    """
+    if filename.endswith('.json'):
+        with open(filename) as file:
+            data = json.load(file)
+        if 'lattice' not in data or 'sites' not in data:
+            raise ValueError(f'{filename} is not a pymatgen structure, exclude it from the inputs.')
+        lattice = np.array(data['lattice']['matrix'], float)
+        species = [ site['species'][0]['element'] for site in data['sites'] ]
+        system, ngkpt, kpoints, symmetric = {}, None, None, False
+    else:
+        data = read_pw_input(filename)
+        lattice, species = read_lattice(filename), data.species
+        system = data.namelists.get('system', {})
+        ngkpt, kpoints, symmetric = data.ngkpt, data.kpoints, not system.get('nosym', False)
+
+    crystal = None
+    if 'ecutwfc' not in system or 'nbnd' not in system or (ngkpt is None and kpoints is None):
+        crystal = get_crystal(species)
+    ecutwfc = system.get('ecutwfc', crystal.settings.ecutwfc if crystal else None)
+    nbnd = system.get('nbnd', int(np.ceil(crystal.valence * len(species) / 2)) if crystal else None)
+    if kpoints is not None:
+        nk = len(kpoints)
+    else:
+        if ngkpt is None:
+            ngkpt = scale_kgrid(crystal.settings.ngkpt_scf, crystal.lattice, lattice @ np.linalg.inv(crystal.lattice))
+        if symmetric:
+            kshift = data.kshift if data.kshift is not None else np.zeros(3)
+            nk = len(irreducible_kpoints(ngkpt, lattice, kshift)[0])
+        else:
+            nk = int(count_kpoints([ngkpt], [lattice], [False])[0])
+    volume = abs(np.linalg.det(lattice)) / BOHR**3
+    return AttrDict(natoms = len(species), volume = volume, ecutwfc = float(ecutwfc), nbnd = int(nbnd), nk = int(nk))
+
+def task_costs(files):
+    """
+    Relative cost of every task, the cheapest task is 1.
+
+    A plane-wave scf step costs about nk * (nbnd * npw * log(npw) + nbnd^2 * npw): the FFTs of
+    H|psi> and the orthogonalization of the bands.
+    """
+    costs = np.zeros(len(files))
+    for ii, fn in enumerate(files):
+        task = task_parameters(fn)
+        npw = count_plane_waves(task.volume, task.ecutwfc)
+        costs[ii] = task.nk * (task.nbnd * npw * np.log(npw) + task.nbnd**2 * npw)
+    return costs / costs.min() if len(costs) else costs
+
+def task_chains(files):
+    """
+    Chains of dependent tasks: inputs in numbered step directories (01-scf, 02-wfn, ...) of the same
+    parent directory, in the order of the steps. Other inputs are chains of their own.
+
+    Returns
+    -------
+    chains : list
+        Index arrays into files, in the order of the first input of every chain.
+    """
+    chains = {}
+    for ii, fn in enumerate(files):
+        step_dir = os.path.dirname(fn)
+        step = re.match(STEP_PATTERN, os.path.basename(step_dir))
+        key = os.path.dirname(step_dir) if step else fn
+        chains.setdefault(key, []).append( (int(step.group(1)) if step else 0, fn, ii) )
+    return [ np.array([ ii for _, _, ii in sorted(chain) ], int) for chain in chains.values() ]
+
+#%% PACKING
+
+def pack(costs, nelements:int = None, capacity:float = None):
+    """
+    Pack tasks into array elements.
+
+    With nelements, the tasks are distributed over that many elements, the most expensive first, each
+    to the element with the lowest load (LPT). With only a capacity, as few elements as possible are
+    filled up to the capacity, the most expensive task first (first fit decreasing).
+
+    Returns
+    -------
+    elements : int array (ntasks)
+        Element of every task.
+    loads : array (nelements)
+        Total cost of every element.
+    """
+    costs = np.asarray(costs, float)
+    order = np.argsort(-costs, kind = 'stable')
+    elements = np.zeros(len(costs), int)
+    if capacity is not None and np.any(costs > capacity):
+        raise ValueError(f'A task of cost {costs.max():g} does not fit in the capacity {capacity:g}.')
+
+    if nelements is not None:
+        nelements = max(1, min(nelements, len(costs)))
+        heap = [ (0., element) for element in range(nelements) ]
+        for task in order:
+            load, element = heapq.heappop(heap)
+            elements[task] = element
+            heapq.heappush(heap, (load + costs[task], element))
+        loads = np.bincount(elements, costs, minlength = nelements)
+        if capacity is not None and loads.max() > capacity:
+            needed = len(pack(costs, capacity = capacity)[1])
+            raise ValueError(f'{nelements} elements exceed the capacity, at least {needed} are needed.')
+        return elements, loads
+
+    if capacity is None:
+        raise ValueError('Either the number of elements or the capacity is needed.')
+    loads = []
+    for task in order:
+        fits = [ element for element, load in enumerate(loads) if load + costs[task] <= capacity ]
+        if fits:
+            elements[task] = fits[0]
+            loads[fits[0]] += costs[task]
+        else:
+            elements[task] = len(loads)
+            loads += [costs[task]]
+    return elements, np.array(loads)
+
+#%% SCRIPTS
+
+def walltime_seconds(walltime:str):
+    """
+    Seconds of a walltime [[D-]HH:]MM:SS.
+    """
+    days, _, walltime = walltime.rpartition('-')
+    seconds = 0
+    for part in walltime.split(':'):
+        seconds = 60 * seconds + int(part)
+    return seconds + 86400 * int(days or 0)
+
+def format_walltime(seconds:float):
+    seconds = int(np.ceil(seconds))
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+def scheduler_header(scheduler:str, name:str, nelements:int, walltime:str, nodes:int, cores:int, directives:list):
+    if scheduler == 'slurm':
+        lines = [ f'#SBATCH --job-name={name}', f'#SBATCH --array=0-{nelements - 1}', f'#SBATCH --time={walltime}',
+                  f'#SBATCH --nodes={nodes}', f'#SBATCH --ntasks-per-node={cores}', f'#SBATCH --output=logs/%A_%a.out' ]
+        lines += [ f'#SBATCH {directive}' for directive in directives ]
+        index = 'SLURM_ARRAY_TASK_ID'
+    elif scheduler == 'pbs':
+        lines = [ f'#PBS -N {name}', f'#PBS -J 0-{nelements - 1}', f'#PBS -l walltime={walltime}',
+                  f'#PBS -l select={nodes}:ncpus={cores}:mpiprocs={cores}', f'#PBS -o logs/', '#PBS -j oe' ]
+        lines += [ f'#PBS {directive}' for directive in directives ]
+        index = 'PBS_ARRAY_INDEX'
+    else:
+        raise ValueError(f'Option {scheduler} is not a valid scheduler. Please choose from:\n\t{SCHEDULERS}')
+    return lines, index
+
+def write_array(files, dirname:str = 'jobs', nelements:int = None, walltime:str = '01:00:00', unit_seconds:float = None,
+                scheduler:str = 'slurm', command:str = COMMAND, name:str = 'alkali_halides', nodes:int = 1,
+                cores:int = 1, directives = (), fill:float = 0.9):
+    """
+    Pack the tasks of a set of input files into one array job.
+
+    Parameters
+    ----------
+    files : list
+        Input files, one task each, e.g. from displacements.find_inputs.
+    dirname : str, optional
+        Directory of the script, task list and manifest.
+    nelements : int, optional
+        Number of array elements. The default packs as few elements as fit the walltime (needs unit_seconds).
+    walltime : str, optional
+        Walltime of every element, [[D-]HH:]MM:SS.
+    unit_seconds : float, optional
+        Run time of the cheapest task in seconds, e.g. from a test run. Needed to check the walltime.
+    scheduler : str, optional
+        'slurm' or 'pbs' (PBS Pro array syntax).
+    command : str, optional
+        Shell command of a task, run in the directory of the input, with $input and $output (the input
+        with the extension .out). Tasks whose output has JOB DONE are skipped on a resubmission. pw.x
+        cannot read json structures, so these need another command, e.g. JSON_COMMAND.
+    name : str, optional
+        Name of the job.
+    nodes, cores : int, optional
+        Nodes and cores per node of every element.
+    directives : list, optional
+        Additional scheduler directives, e.g. ['--account=abc'].
+    fill : float, optional
+        Fraction of the walltime that the estimate may fill.
+
+    Returns
+    -------
+    manifest : dict
+        Also written to dirname/manifest.json.
+    """
+    files = [ os.path.abspath(fn) for fn in files ]
+    if command == COMMAND and any( fn.endswith('.json') for fn in files ):
+        raise ValueError(f'pw.x cannot read json structures, give a command that does, e.g. {JSON_COMMAND}')
+    costs = task_costs(files)
+    capacity = None if unit_seconds is None else walltime_seconds(walltime) * fill / unit_seconds
+    if nelements is None and capacity is None:
+        raise ValueError('Provide the number of elements or the run time of a task (unit_seconds).')
+    # Chains are packed as a whole and keep the order of their steps
+    chains = task_chains(files)
+    chain_costs = np.array([ costs[chain].sum() for chain in chains ])
+    chain_elements, loads = pack(chain_costs, nelements, capacity)
+    order = np.concatenate([ chains[chain] for chain in np.lexsort((-chain_costs, chain_elements)) ])
+    chain_of = np.zeros(len(files), int)
+    for chain, tasks in enumerate(chains):
+        chain_of[tasks] = chain
+    elements = chain_elements[chain_of]
+    nelements = len(loads)
+
+    os.makedirs(os.path.join(dirname, 'logs'), exist_ok = True)
+    with open(os.path.join(dirname, TASKS_FILE), 'w') as file:
+        for task in order:
+            file.write(f'{elements[task]}\t{chain_of[task]}\t{os.path.dirname(files[task])}\t{os.path.basename(files[task])}\n')
+
+    header, index = scheduler_header(scheduler, name, nelements, walltime, nodes, cores, list(directives))
+    script  = ['#!/bin/bash'] + header + ['']
+    script += [ f'# {len(files)} tasks in {nelements} elements, packed by estimated cost (see {MANIFEST_FILE})',
+                f'# Run an element locally with: bash {os.path.basename(name)}.{scheduler} ELEMENT', '',
+                f'ELEMENT=${{{index}:-$1}}',
+                f'TASKS="{os.path.abspath(os.path.join(dirname, TASKS_FILE))}"', '',
+                'failed=""',
+                '# the task list is read on fd 3, so that commands reading stdin (mpirun, srun) cannot swallow it',
+                'while IFS=$\'\\t\' read -r element chain dir input <&3; do',
+                '    output="${input%.*}.out"',
+                '    if [ "$chain" = "$failed" ]; then',
+                '        echo "Skipping $dir/$input (an earlier step failed)"',
+                '        continue',
+                '    fi',
+                '    cd "$dir" || { failed="$chain"; continue; }',
+                '    if grep -qs "JOB DONE" "$output"; then',
+                '        echo "Skipping $dir/$input (done)"',
+                '        continue',
+                '    fi',
+                '    echo "Running $dir/$input"',
+                f'    {command} || failed="$chain"',
+                'done 3< <(awk -F "\\t" -v element="$ELEMENT" \'$1 == element\' "$TASKS")', '' ]
+    fn = os.path.join(dirname, f'{name}.{scheduler}')
+    with open(fn, 'w') as file:
+        file.write('\n'.join(script))
+    os.chmod(fn, 0o755)
+
+    seconds = None if unit_seconds is None else loads * unit_seconds
+    manifest = dict(
+        script = os.path.abspath(fn), scheduler = scheduler, walltime = walltime, unit_seconds = unit_seconds,
+        elements = [ dict(element = int(element), cost = float(load),
+                          seconds = None if seconds is None else float(seconds[element]),
+                          tasks = [ files[task] for task in order if elements[task] == element ])
+                     for element, load in enumerate(loads) ],
+        tasks = [ dict(input = fn, cost = float(cost), element = int(element), chain = int(chain))
+                  for fn, cost, element, chain in zip(files, costs, elements, chain_of) ],
+    )
+    with open(os.path.join(dirname, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent = 1)
+    return manifest
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Monkhorst-Pack grids and their reduction by the point group of the lattice.
+"""
+
+import numpy as np
+import itertools
+from functools import lru_cache
+
+def grid_kpoints(ngkpt, kshift = (0., 0., 0.)):
+    """
+    Monkhorst-Pack grid in crystal coordinates.
+
+    Parameters
+    ----------
+    ngkpt : int(3)
+        Number of k-points along each reciprocal lattice vector.
+    kshift : float(3), optional
+        Shift of the grid in units of the grid spacing (0.5 is half a step).
+
+    Returns
+    -------
+    kpoints : array (N,3)
+        All points of the grid, the last axis running fastest.
+    """
+    ngkpt = np.asarray(ngkpt, int)
+    indices = np.indices(ngkpt).reshape(3, -1).T
+    return (indices + np.asarray(kshift, float)) / ngkpt
+
+def cubic_operations():
+    """
+    The 48 point operations of the cube (O_h) as cartesian matrices.
+    """
+    eye = np.identity(3)
+    permutations = eye[ list(itertools.permutations(range(3))) ]        # (6,3,3)
+    signs = np.array( list(itertools.product([1, -1], repeat = 3)), float ) # (8,3)
+    operations = signs[None, :, :, None] * permutations[:, None]          # (6,8,3,3)
+    return operations.reshape(48, 3, 3)
+
+def lattice_operations(lattice, tol:float = 1e-6):
+    """
+    Point operations of the cube that map the lattice onto itself.
+
+    Parameters
+    ----------
+    lattice : array (3,3)
+        Lattice vectors as rows.
+
+    Returns
+    -------
+    operations : array (M,3,3)
+        The operations in crystal coordinates of the reciprocal lattice (integer matrices W such that
+        k' = k @ W).
+    """
+    lattice = np.asarray(lattice, float)
+    # Operation R in crystal coordinates of the direct lattice
+    crystal = np.einsum('ij,njk,kl->nil', lattice, cubic_operations(), np.linalg.inv(lattice))
+    integer = np.all( np.abs(crystal - np.round(crystal)) < tol, axis = (1,2) )
+    return np.round( crystal[integer].transpose(0,2,1) ).astype(int)
+
+@lru_cache(maxsize = 256)
+def _irreducible(ngkpt:tuple, kshift:tuple, lattice:tuple, time_reversal:bool):
+    ngkpt = np.array(ngkpt, int)
+    kshift = np.array(kshift, float)
+    kpoints = grid_kpoints(ngkpt, kshift)
+    operations = lattice_operations( np.reshape(lattice, (3,3)) )
+    if time_reversal:
+        operations = np.concatenate((operations, -operations))
+
+    # Images of all k-points under all operations as grid indices
+    images = np.einsum('ki,nij->nkj', kpoints, operations) * ngkpt - kshift
+    on_grid = np.all( np.abs(images - np.round(images)) < 1e-6, axis = (1,2) )
+    images = np.mod( np.round(images[on_grid]).astype(int), ngkpt )
+    flat = np.ravel_multi_index( images.transpose(2,0,1), ngkpt )
+
+    # The smallest index of each orbit represents the orbit
+    representative = flat.min(axis = 0)
+    unique, weights = np.unique(representative, return_counts = True)
+    return kpoints[unique], weights
+
+def irreducible_kpoints(ngkpt, lattice, kshift = (0., 0., 0.), time_reversal:bool = True):
+    """
+    Reduce a Monkhorst-Pack grid by the point group of the lattice.
+
+    Only the operations of the lattice are used, which is exact for the perfect rocksalt crystals.
+    Structures with displaced atoms have a lower symmetry, and their count is an underestimate.
+
+    Parameters
+    ----------
+    ngkpt : int(3)
+        Number of k-points along each reciprocal lattice vector.
+    lattice : array (3,3)
+        Lattice vectors as rows.
+    kshift : float(3), optional
+        Shift of the grid in units of the grid spacing.
+    time_reversal : bool, optional
+        Whether k and -k are equivalent.
+
+    Returns
+    -------
+    kpoints : array (M,3)
+        Irreducible k-points in crystal coordinates.
+    weights : array (M)
+        Number of grid points represented by each irreducible point.
+    """
+    key = ( tuple(int(n) for n in ngkpt), tuple(float(s) for s in kshift),
+            tuple(np.round(np.ravel(lattice), 8)), time_reversal )
+    kpoints, weights = _irreducible(*key)
+    return kpoints.copy(), weights.copy()
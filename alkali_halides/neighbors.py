@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Periodic neighbor search with cell lists.
+
+Works directly on a lattice and fractional coordinates, for a single structure (N,3) or a batch of
+frames (F,N,3) that share the lattice, e.g. displaced or perturbed copies of one supercell. The cell is
+divided into bins that are at least the cutoff wide, so that only neighboring bins have to be searched.
+All frames are binned together, the frame index being part of the bin key, so that the search is
+vectorized over frames and atoms.
+"""
+
+import numpy as np
+import itertools
+
+def bin_layout(lattice, cutoff:float):
+    """
+    Number of bins along each lattice vector and how many bins away neighbors can be.
+    """
+    lattice = np.asarray(lattice, float)
+    # Distance between the lattice planes spanned by the other two vectors
+    spacing = 1 / np.linalg.norm(np.linalg.inv(lattice).T, axis = 1)
+    nbins = np.maximum(1, np.floor(spacing / cutoff)).astype(int)
+    reach = np.ceil(cutoff * nbins / spacing - 1e-12).astype(int)
+    return nbins, reach
+
+def neighbor_pairs(lattice, frac_coords, cutoff:float):
+    """
+    All pairs of atoms (including periodic images) closer than the cutoff.
+
+    Parameters
+    ----------
+    lattice : array (3,3)
+        Lattice vectors as rows in Angstrom.
+    frac_coords : array (N,3) or (F,N,3)
+        Fractional coordinates of one structure or a batch of frames.
+    cutoff : float
+        Cutoff distance in Angstrom.
+
+    Returns
+    -------
+    frame, i, j : int arrays (P)
+        Frame and atom indices of each pair. Every pair appears once, either as (i,j) or as (j,i).
+    distance : array (P)
+        Distance in Angstrom.
+    image : int array (P,3)
+        Lattice translation applied to atom j.
+    """
+    lattice = np.asarray(lattice, float)
+    frac = np.asarray(frac_coords, float)
+    frac = frac[None] if frac.ndim == 2 else frac
+    nframes, natoms = frac.shape[:2]
+    nbins, reach = bin_layout(lattice, cutoff)
+    size = np.prod(nbins)
+
+    # Wrap into the cell and bin all atoms of all frames
+    cell_image = np.floor(frac).reshape(-1, 3)
+    wrapped = frac.reshape(-1, 3) - cell_image
+    bins = np.minimum(np.floor(wrapped * nbins).astype(int), nbins - 1)
+    bins = np.ravel_multi_index(bins.T, nbins)
+    frames = np.repeat(np.arange(nframes), natoms)
+    key = frames * size + bins
+    order = np.argsort(key, kind = 'stable')
+    counts = np.bincount(key, minlength = nframes * size)
+    starts = np.cumsum(counts) - counts
+
+    # Half of the neighboring bins suffices when every pair is reported once
+    all_bins = np.array(np.unravel_index(np.arange(size), nbins)).T
+    offsets = np.array(list(itertools.product(*[ range(-r, r + 1) for r in reach ])))
+    offsets = offsets[ len(offsets) // 2: ]
+
+    result = [[], [], [], [], []]
+    for offset in offsets:
+        target = all_bins + offset
+        shift = np.floor_divide(target, nbins)
+        target = np.ravel_multi_index((target - shift * nbins).T, nbins)
+        target_key = frames * size + target[bins]
+        start = starts[target_key]
+        count = counts[target_key]
+        total = count.sum()
+        if total == 0:
+            continue
+
+        # Expand to all (atom, atom in target bin) combinations
+        first = np.repeat(np.arange(len(key)), count)
+        second = order[ np.repeat(start - np.cumsum(count) + count, count) + np.arange(total) ]
+        pair_shift = shift[ bins[first] ]
+        delta = (wrapped[second] + pair_shift - wrapped[first]) @ lattice
+        distance = np.sqrt(np.sum(delta**2, axis = 1))
+        keep = distance < cutoff
+        if not np.any(offset):
+            keep &= first < second
+
+        first, second = first[keep], second[keep]
+        result[0] += [ frames[first] ]
+        result[1] += [ first % natoms ]
+        result[2] += [ second % natoms ]
+        result[3] += [ distance[keep] ]
+        # Translation with respect to the unwrapped coordinates
+        result[4] += [ (pair_shift[keep] + cell_image[first] - cell_image[second]).astype(int) ]
+
+    if len(result[0]) == 0:
+        empty = np.zeros(0, int)
+        return empty, empty, empty, np.zeros(0), np.zeros((0,3), int)
+    return tuple( np.concatenate(part) for part in result )
+
+def min_distances(lattice, frac_coords, cutoff:float = 3.0):
+    """
+    Shortest interatomic distance of each frame.
+
+    Frames without pairs closer than the cutoff get infinity.
+
+    Returns
+    -------
+    distances : array (F)
+    """
+    frac = np.asarray(frac_coords, float)
+    nframes = 1 if frac.ndim == 2 else len(frac)
+    frame, _, _, distance, _ = neighbor_pairs(lattice, frac, cutoff)
+    shortest = np.full(nframes, np.inf)
+    np.minimum.at(shortest, frame, distance)
+    return shortest
+
+def query_pairs(lattice, reference, query, cutoff:float):
+    """
+    Pairs of query points and reference atoms (including periodic images) closer than the cutoff.
+
+    Parameters
+    ----------
+    lattice : array (3,3)
+        Lattice vectors as rows in Angstrom.
+    reference : array (N,3)
+        Fractional coordinates of the reference atoms, which are binned.
+    query : array (Q,3)
+        Fractional coordinates of the query points.
+    cutoff : float
+        Cutoff distance in Angstrom.
+
+    Returns
+    -------
+    q, r : int arrays (P)
+        Indices of the query point and the reference atom of each pair.
+    distance : array (P)
+        Distance in Angstrom.
+    """
+    lattice = np.asarray(lattice, float)
+    reference = np.asarray(reference, float)
+    query = np.asarray(query, float)
+    nbins, reach = bin_layout(lattice, cutoff)
+
+    reference = reference - np.floor(reference)
+    query = query - np.floor(query)
+    ref_bins = np.ravel_multi_index(np.minimum(np.floor(reference * nbins).astype(int), nbins - 1).T, nbins)
+    query_bins = np.minimum(np.floor(query * nbins).astype(int), nbins - 1)
+    order = np.argsort(ref_bins, kind = 'stable')
+    counts = np.bincount(ref_bins, minlength = np.prod(nbins))
+    starts = np.cumsum(counts) - counts
+
+    result = [[], [], []]
+    for offset in itertools.product(*[ range(-r, r + 1) for r in reach ]):
+        target = query_bins + offset
+        shift = np.floor_divide(target, nbins)
+        target = np.ravel_multi_index((target - shift * nbins).T, nbins)
+        count = counts[target]
+        total = count.sum()
+        if total == 0:
+            continue
+        first = np.repeat(np.arange(len(query)), count)
+        second = order[ np.repeat(starts[target] - np.cumsum(count) + count, count) + np.arange(total) ]
+        delta = (reference[second] + shift[first] - query[first]) @ lattice
+        distance = np.sqrt(np.sum(delta**2, axis = 1))
+        keep = distance < cutoff
+        result[0] += [ first[keep] ]
+        result[1] += [ second[keep] ]
+        result[2] += [ distance[keep] ]
+
+    if len(result[0]) == 0:
+        return np.zeros(0, int), np.zeros(0, int), np.zeros(0)
+    return tuple( np.concatenate(part) for part in result )
+
+def moved_min_distances(lattice, frac_coords, moved, cutoff:float = 3.0):
+    """
+    Shortest distance between the moved atoms and any other atom (or image) in each frame.
+
+    The atoms that are not moved are taken from the first frame.
+
+    Parameters
+    ----------
+    lattice : array (3,3)
+        Lattice vectors as rows in Angstrom.
+    frac_coords : array (F,N,3)
+        Fractional coordinates of a batch of frames.
+    moved : list
+        Indices of the atoms that move between frames.
+    cutoff : float
+        Cutoff distance in Angstrom. Frames without pairs closer than the cutoff get infinity.
+
+    Returns
+    -------
+    distances : array (F)
+    """
+    lattice = np.asarray(lattice, float)
+    frac = np.asarray(frac_coords, float)
+    moved = np.atleast_1d(moved)
+    fixed = np.setdiff1d(np.arange(frac.shape[1]), moved)
+    shortest = np.full(len(frac), np.inf)
+
+    # Moved atoms against the fixed atoms
+    q, _, distance = query_pairs(lattice, frac[0, fixed], frac[:, moved].reshape(-1, 3), cutoff)
+    np.minimum.at(shortest, q // len(moved), distance)
+
+    # Moved atoms against each other and their own images
+    spacing = 1 / np.linalg.norm(np.linalg.inv(lattice).T, axis = 1)
+    reach = np.ceil(cutoff / spacing).astype(int)
+    images = np.array(list(itertools.product(*[ range(-r, r + 1) for r in reach ])))
+    delta = frac[:, moved, None, :] - frac[:, None, moved, :]                     # (F,M,M,3)
+    delta -= np.round(delta)
+    distance = np.sqrt(np.sum( ((delta[..., None, :] + images) @ lattice)**2, axis = -1 )) # (F,M,M,I)
+    distance[:, np.arange(len(moved)), np.arange(len(moved)), np.all(images == 0, axis = 1)] = np.inf
+    return np.minimum(shortest, distance.reshape(len(frac), -1).min(axis = 1))
+
+def screen_frames(lattice, frac_coords, threshold:float, moved = None):
+    """
+    Flag frames in which two atoms are closer than the threshold.
+
+    Parameters
+    ----------
+    lattice : array (3,3)
+        Lattice vectors as rows in Angstrom.
+    frac_coords : array (N,3) or (F,N,3)
+        Fractional coordinates of one structure or a batch of frames.
+    threshold : float
+        Minimal allowed interatomic distance in Angstrom.
+    moved : list, optional
+        Indices of the only atoms that differ between the frames, as for displacements. The distances
+        between the other atoms are then only computed once.
+
+    Returns
+    -------
+    accepted : bool array (F)
+        Whether all distances in the frame are at least the threshold.
+    distances : array (F)
+        Shortest interatomic distance of each frame (infinity if above the threshold).
+    """
+    frac = np.asarray(frac_coords, float)
+    frac = frac[None] if frac.ndim == 2 else frac
+    if moved is None:
+        distances = min_distances(lattice, frac, threshold)
+    else:
+        fixed = np.setdiff1d(np.arange(frac.shape[1]), moved)
+        distances = np.minimum( min_distances(lattice, frac[0, fixed], threshold),
+                                moved_min_distances(lattice, frac, moved, threshold) )
+        distances[distances >= threshold] = np.inf
+    return distances >= threshold, distances
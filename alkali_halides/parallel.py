@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Parallelization layouts for pw.x and BerkeleyGW runs.
+
+All layouts that fit a node description (cores, memory, number of nodes) are enumerated, i.e. the split
+of the cores into MPI ranks and OpenMP threads and, for pw.x, the k-point pools (-nk), band groups (-nb)
+and linear-algebra group (-nd). Each layout is scored by its load balance, computed from the number of
+irreducible k-points and the divisibility of the bands and the FFT planes, and by heuristic parallel
+efficiencies. Layouts that do not fit in memory are dropped and the others are ranked by predicted time.
+"""
+
+import numpy as np
+from .estimate import plan_table, estimate, count_plane_waves
+from .kpoints import irreducible_kpoints
+from .fft import BOHR, fft_grid
+from .qe import read_pw_input, read_lattice
+
+BYTES_COMPLEX = 16
+BASE_MEMORY = 100e6 # bytes per rank for the executable, pseudopotentials etc.
+WFC_COPIES = 4      # psi, hpsi, spsi and the Davidson correction vectors
+FFT_COPIES = 8      # dense grid arrays (density, potentials, work space)
+
+# Heuristic loss of efficiency per doubling of the parallelization level
+OVERHEAD_THREADS = 0.15
+OVERHEAD_FFT = 0.10
+OVERHEAD_BANDS = 0.05
+
+LAYOUT_DTYPE = [
+    ('ranks', int),
+    ('threads', int),
+    ('npool', int),     # -nk
+    ('nband', int),     # -nb
+    ('ndiag', int),     # -nd
+    ('nfft', int),      # ranks sharing the plane waves and FFT of one k-point
+    ('balance', float), # product of the k-point, band and FFT load balance, 1 is perfect
+    ('time', float),    # predicted wall time relative to a perfectly parallel run on all cores
+    ('mem_rank', float),
+    ('mem_node', float),
+]
+
+def divisors(n:int):
+    n = int(n)
+    candidates = np.arange(1, n + 1)
+    return candidates[ n % candidates == 0 ]
+
+def balance(work, parts):
+    """
+    Fraction of the time that the parts are busy when work items are distributed over them.
+    """
+    work = np.asarray(work, float)
+    parts = np.asarray(parts, float)
+    return work / (parts * np.ceil(work / parts))
+
+def overhead(n, loss:float):
+    return 1 / (1 + loss * np.log2(n))
+
+def pw_layouts(nk:int, nbnd:int, fft, npw:float, ranks:int, threads:int):
+    """
+    All pool, band-group and FFT splits of a number of ranks, as a structured array.
+    """
+    rows = []
+    for npool in divisors(ranks):
+        if npool > nk:
+            break
+        per_pool = ranks // npool
+        for nband in divisors(per_pool):
+            nfft = per_pool // nband
+            if nband > nbnd or nfft > fft[2]:
+                continue
+            # Largest square group for the subspace diagonalization, only for many bands
+            ndiag = int(np.sqrt(min(per_pool, (nbnd / 32)**2)))**2 if nbnd >= 64 else 1
+            rows += [(ranks, threads, npool, nband, max(ndiag, 1), nfft)]
+    layouts = np.zeros(len(rows), LAYOUT_DTYPE)
+    if len(rows) == 0:
+        return layouts
+    for name, column in zip(['ranks', 'threads', 'npool', 'nband', 'ndiag', 'nfft'], np.array(rows).T):
+        layouts[name] = column
+
+    kpool = np.ceil(nk / layouts['npool'])
+    layouts['balance'] = balance(nk, layouts['npool']) * balance(nbnd, layouts['nband']) * balance(fft[2], layouts['nfft'])
+    efficiency = overhead(threads, OVERHEAD_THREADS) * overhead(layouts['nfft'], OVERHEAD_FFT) * overhead(layouts['nband'], OVERHEAD_BANDS)
+    layouts['time'] = 1 / (layouts['balance'] * efficiency)
+    layouts['mem_rank'] = (BASE_MEMORY
+                           + BYTES_COMPLEX * WFC_COPIES * npw * nbnd * kpool / layouts['nfft']
+                           + BYTES_COMPLEX * FFT_COPIES * np.prod(fft) / layouts['nfft']
+                           + BYTES_COMPLEX * 3 * (2 * nbnd)**2 / layouts['ndiag'])
+    return layouts
+
+def bgw_layouts(nk:int, nbnd:int, npw:float, ngeps:float, ranks:int, threads:int):
+    """
+    Rank and thread split for BerkeleyGW, which distributes the bands and the dielectric matrix.
+    """
+    layouts = np.zeros(1, LAYOUT_DTYPE)
+    layouts[['ranks', 'threads', 'npool', 'nband', 'ndiag', 'nfft']] = (ranks, threads, 1, ranks, 1, 1)
+    layouts['balance'] = balance(nbnd, ranks)
+    layouts['time'] = 1 / (layouts['balance'] * overhead(threads, OVERHEAD_THREADS) * overhead(ranks, OVERHEAD_BANDS))
+    layouts['mem_rank'] = (BASE_MEMORY
+                           + BYTES_COMPLEX * 2 * ngeps**2 / ranks
+                           + BYTES_COMPLEX * npw * nbnd * nk / ranks)
+    return layouts
+
+def recommend(nk:int, nbnd:int, fft, npw:float, cores:int, memory:float, nodes:int = 1, code:str = 'pw',
+              ngeps:float = 0, max_threads:int = 8):
+    """
+    Ranked parallelization layouts.
+
+    Parameters
+    ----------
+    nk : int
+        Number of (irreducible) k-points.
+    nbnd : int
+        Number of bands.
+    fft : int(3)
+        Dense FFT grid.
+    npw : float
+        Number of plane waves per k-point.
+    cores : int
+        Cores per node.
+    memory : float
+        Memory per node in GB.
+    nodes : int, optional
+        Number of nodes.
+    code : str, optional
+        'pw' for pw.x, 'bgw' for BerkeleyGW epsilon and sigma.
+    ngeps : float, optional
+        Number of G-vectors of the dielectric matrix (BerkeleyGW only).
+    max_threads : int, optional
+        Largest number of OpenMP threads per rank.
+
+    Returns
+    -------
+    layouts : structured array
+        Layouts that fit in memory, fastest first, see LAYOUT_DTYPE.
+    """
+    if code not in ['pw', 'bgw']:
+        raise ValueError(f'Option {code} is not a valid code. Please choose from:\n\t{["pw", "bgw"]}')
+    layouts = []
+    for threads in divisors(cores):
+        if threads > max_threads:
+            break
+        ranks = nodes * cores // threads
+        if code == 'pw':
+            layouts += [ pw_layouts(nk, nbnd, fft, npw, ranks, threads) ]
+        else:
+            layouts += [ bgw_layouts(nk, nbnd, npw, ngeps, ranks, threads) ]
+    layouts = np.concatenate(layouts)
+    layouts['mem_node'] = layouts['mem_rank'] * layouts['ranks'] / nodes
+    layouts = layouts[ layouts['mem_node'] <= memory * 1e9 ]
+    return layouts[ np.lexsort((layouts['mem_node'], layouts['time'])) ]
+
+def recommend_crystal(crystal, cores:int, memory:float, nodes:int = 1, step:str = 'scf', supercell = None, **kwargs):
+    """
+    Ranked parallelization layouts for a step of the calculations of a crystal.
+
+    Parameters
+    ----------
+    crystal : Crystal or str
+        Crystal or crystal key (e.g. 'LiF').
+    step : str, optional
+        'scf', 'wfn', 'wfn_fi', 'epsilon' or 'sigma'.
+    supercell : int(3), optional
+        Supercell specification as in build_structure.
+
+    See recommend for the other parameters.
+    """
+    row = estimate( plan_table([crystal], [supercell]) )[0]
+    if step == 'scf':
+        return recommend(row['nk_scf'], row['valence'], row['fft'], row['npw'], cores, memory, nodes, **kwargs)
+    if step in ['wfn', 'wfn_fi']:
+        # The wavefunctions for BerkeleyGW are computed on the full grid
+        nk = np.prod(row['ngkpt_co' if step == 'wfn' else 'ngkpt_fi'])
+        return recommend(nk, row['nbnd'], row['fft'], row['npw'], cores, memory, nodes, **kwargs)
+    if step in ['epsilon', 'sigma']:
+        nk = np.prod(row['ngkpt_co'])
+        return recommend(nk, row['nbnd'], row['fft'], row['npw'], cores, memory, nodes, 'bgw', row['ngeps'], **kwargs)
+    raise ValueError(f'Option {step} is not a valid step. Please choose from:\n\t{["scf", "wfn", "wfn_fi", "epsilon", "sigma"]}')
+
+def recommend_input(filename:str, cores:int, memory:float, nodes:int = 1, nbnd:int = None, **kwargs):
+    """
+    Ranked parallelization layouts for a pw.x input file.
+
+    The number of bands is read from the input, or has to be provided with nbnd. The cell is converted
+    from the units of CELL_PARAMETERS (angstrom, bohr or alat). See recommend for the other parameters.
+    """
+    data = read_pw_input(filename)
+    lattice = read_lattice(filename)
+    system = data.namelists.get('system', {})
+    ecutwfc = system['ecutwfc']
+    nbnd = system.get('nbnd', nbnd)
+    if nbnd is None:
+        raise ValueError(f'nbnd is not set in {filename}, please provide it.')
+
+    if data.kpoints is not None:
+        nk = len(data.kpoints)
+    elif system.get('nosym', False):
+        nk = int(np.prod(data.ngkpt))
+    else:
+        nk = len(irreducible_kpoints(data.ngkpt, lattice, data.kshift)[0])
+
+    fft = [ system.get(f'nr{ii}', 0) for ii in [1, 2, 3] ]
+    if min(fft) <= 0:
+        fft = fft_grid(lattice, ecutwfc)
+    npw = count_plane_waves(abs(np.linalg.det(lattice)) / BOHR**3, ecutwfc)
+    return recommend(nk, nbnd, fft, npw, cores, memory, nodes, **kwargs)
+
+def pw_flags(layout):
+    """
+    Command line flags of pw.x for a layout.
+    """
+    return f'-nk {layout["npool"]} -nb {layout["nband"]} -nd {layout["ndiag"]}'
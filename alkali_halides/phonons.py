@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+"""
+Phonons from finite displacements: force constants, dynamical matrices and dispersions.
+
+The forces of the displaced supercells of AH_displace (one set per displaced atom of the primitive cell)
+are fitted to the force constants of that atom with one least-squares problem, the acoustic sum rule is
+imposed on its on-site term, and every force constant becomes a pair term between two atoms of the
+primitive cell with its (minimum image) pair vectors. The dynamical matrices of all q-points are then
+built at once with einsum and diagonalized with a batched eigh, so that a full dispersion along the
+high symmetry path takes milliseconds.
+
+The splitting of the longitudinal optical mode at Gamma is a long-range effect that a supercell misses.
+It is added as the non-analytic term of the Born effective charges and the electronic dielectric
+constant, or, without Born charges, estimated with the Lyddane-Sachs-Teller relation.
+
+Units are Angstrom, eV and amu, frequencies are in 10^13 rad/s (the unit of lit.wL0) unless requested
+otherwise.
+"""
+
+import numpy as np
+import os
+from glob import glob
+from .attrdict import AttrDict
+from .qe import read_forces, read_structure
+from .constants import RYDBERG, K_COULOMB
+from .fft import BOHR
+from .structures import structures
+
+RY_BOHR_TO_EV_ANGSTROM = RYDBERG / BOHR
+FREQUENCY = 9.82269474              # 10^13 rad/s of sqrt(eV / Angstrom^2 / amu)
+UNITS = {
+    '1e13 rad/s': 1.,
+    'THz': 10 / (2 * np.pi),
+    'cm-1': 1e13 / (2 * np.pi * 2.99792458e10),
+    'meV': 6.582119569,
+}
+FCC_PATH = [['G', 'X', 'W', 'K', 'G', 'L', 'U', 'W', 'L', 'K'], ['U', 'X']]
+
+LO_DTYPE = [
+    ('crystal', 'U8'),
+    ('TO', float),          # 10^13 rad/s, highest frequency at Gamma without the long-range term
+    ('LO', float),          # 10^13 rad/s
+    ('lit_wL0', float),     # 10^13 rad/s
+    ('error', float),       # relative error of LO
+    ('method', 'U8'),       # 'born' or 'lst'
+]
+
+#%% HARVESTING
+
+def atomic_masses(species):
+    from pymatgen.core import Element
+    return np.array([ float(Element(element).atomic_mass) for element in species ])
+
+def harvest_forces(dirnames, reference, output:str = '*.out', reference_output:str = None):
+    """
+    Read the displacements and forces of displaced supercells written by AH_displace.
+
+    Parameters
+    ----------
+    dirnames : str or list
+        Directories with the D#### subdirectories, e.g. one per displaced atom.
+    reference : str
+        pw.x input or pymatgen json file of the undisplaced supercell.
+    output : str, optional
+        Glob pattern of the pw.x output in every D#### directory.
+    reference_output : str, optional
+        pw.x output of the undisplaced supercell. Its (residual) forces are subtracted.
+
+    Returns
+    -------
+    data : AttrDict
+        lattice (3,3), species (N) and frac (N,3) of the reference; displacements (M,N,3) in
+        Angstrom and forces (M,N,3) in eV/Angstrom of the M displaced cells that have forces.
+    """
+    if isinstance(dirnames, str):
+        dirnames = [dirnames]
+    lattice, species, frac0, _ = read_structure(reference)
+    residual = 0.
+    if reference_output is not None:
+        residual = read_forces(reference_output) * RY_BOHR_TO_EV_ANGSTROM
+
+    displacements, forces, files = [], [], []
+    for dirname in dirnames:
+        for directory in sorted(glob(os.path.join(dirname, 'D*'))):
+            cells = sorted(glob(os.path.join(directory, '*.json')))
+            outputs = sorted(glob(os.path.join(directory, output)))
+            if not cells or not outputs:
+                # duplicates and cells that did not run
+                continue
+            force = read_forces(outputs[0])
+            if force is None:
+                continue
+            _, _, frac, _ = read_structure(cells[0])
+            delta = (frac - frac0 + 0.5) % 1 - 0.5
+            displacements += [delta @ lattice]
+            forces += [force * RY_BOHR_TO_EV_ANGSTROM - residual]
+            files += [outputs[0]]
+    natoms = len(species)
+    return AttrDict(lattice = lattice, species = list(species), frac = frac0, files = files,
+                    displacements = np.array(displacements, float).reshape(-1, natoms, 3),
+                    forces = np.array(forces, float).reshape(-1, natoms, 3))
+
+#%% FORCE CONSTANTS
+
+def basis_map(lattice, frac, primitive, basis, tol:float = 1e-4):
+    """
+    Atom of the primitive cell of every atom of a supercell.
+
+    Parameters
+    ----------
+    lattice, frac : arrays (3,3), (N,3)
+        Supercell and fractional coordinates of its atoms.
+    primitive, basis : arrays (3,3), (B,3)
+        Primitive cell and fractional coordinates of its atoms.
+
+    Returns
+    -------
+    index : int array (N)
+        Primitive atom of every supercell atom.
+    """
+    coords = np.asarray(frac, float) @ lattice @ np.linalg.inv(primitive)
+    delta = coords[:, None, :] - np.asarray(basis, float)[None, :, :]
+    match = np.all(np.abs(delta - np.round(delta)) < tol, axis = -1)
+    if not np.all(match.sum(axis = 1) == 1):
+        raise ValueError('The supercell does not consist of images of the primitive cell.')
+    return np.argmax(match, axis = 1)
+
+def fit_columns(displacements, forces):
+    """
+    Force constants Phi (N,3,3) of one displaced atom from the forces F = -Phi u of its displacements.
+
+    Parameters
+    ----------
+    displacements : array (M,3)
+        Displacements of the atom in Angstrom, at least three independent ones.
+    forces : array (M,N,3)
+        Forces on all atoms in eV/Angstrom.
+    """
+    displacements = np.asarray(displacements, float)
+    forces = np.asarray(forces, float)
+    if np.linalg.matrix_rank(displacements, tol = 1e-6) < 3:
+        raise ValueError('At least three independent displacements of an atom are needed for its force constants.')
+    solution = np.linalg.lstsq(displacements, -forces.reshape(len(forces), -1), rcond = None)[0]
+    # solution[beta, i*3 + alpha] = Phi(i alpha, atom beta)
+    return solution.reshape(3, -1, 3).transpose(1, 2, 0)
+
+def image_vectors(lattice, vectors, tol:float = 1e-4):
+    """
+    Shortest images of pair vectors in a supercell, with equal weights for images at the same distance.
+
+    Returns
+    -------
+    images : array (P,27,3)
+    weights : array (P,27)
+    """
+    shifts = np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing = 'ij')).reshape(3, -1).T
+    images = vectors[:, None, :] + (shifts @ lattice)[None, :, :]
+    lengths = np.linalg.norm(images, axis = -1)
+    weights = (lengths < lengths.min(axis = 1, keepdims = True) + tol).astype(float)
+    return images, weights / weights.sum(axis = 1, keepdims = True)
+
+def force_constants(data:dict, primitive, basis, asr:bool = True):
+    """
+    Force constants of a crystal from the displacements and forces of its supercell.
+
+    Parameters
+    ----------
+    data : dict
+        lattice, species, frac, displacements and forces as returned by harvest_forces. Every displaced
+        cell moves one atom; every atom of the primitive cell needs at least three independent
+        displacements of one of its images.
+    primitive : array (3,3)
+        Primitive cell in Angstrom, e.g. crystal.lattice.
+    basis : array (B,3)
+        Fractional coordinates of the atoms of the primitive cell, e.g. crystal.structure.coordinates.
+    asr : bool, optional
+        Impose the acoustic sum rule: the forces of a rigid translation vanish.
+
+    Returns
+    -------
+    fc : AttrDict
+        primitive, basis, species (B) and masses (B) of the primitive cell, lattice of the supercell,
+        and the pair terms: a and b (P) the primitive atoms of the pair (b displaced), phi (P,3,3) in
+        eV/Angstrom^2, images (P,27,3) and weights (P,27) of the pair vectors from b to a.
+    """
+    lattice = np.asarray(data['lattice'], float)
+    frac = np.asarray(data['frac'], float)
+    displacements = np.asarray(data['displacements'], float)
+    forces = np.asarray(data['forces'], float)
+    index = basis_map(lattice, frac, primitive, basis)
+    moved = np.argmax(np.linalg.norm(displacements, axis = -1), axis = 1)
+
+    a, b, phi, vectors = [], [], [], []
+    for atom in range(len(basis)):
+        candidates = [ ii for ii in np.unique(moved) if index[ii] == atom ]
+        if not candidates:
+            raise ValueError(f'No displacements of atom {atom} of the primitive cell, displace one of its images (AH_displace --atom).')
+        # the image with the most displacements
+        origin = max(candidates, key = lambda ii : np.sum(moved == ii))
+        sets = moved == origin
+        columns = fit_columns(displacements[sets, origin], forces[sets])
+        if asr:
+            columns[origin] -= columns.sum(axis = 0)
+        delta = (frac - frac[origin] + 0.5) % 1 - 0.5
+        a += [index]
+        b += [np.full(len(frac), atom)]
+        phi += [columns]
+        vectors += [delta @ lattice]
+
+    a, b, phi, vectors = np.concatenate(a), np.concatenate(b), np.concatenate(phi), np.concatenate(vectors)
+    images, weights = image_vectors(lattice, vectors)
+    species = [ data['species'][np.argmax(index == atom)] for atom in range(len(basis)) ]
+    return AttrDict(primitive = np.asarray(primitive, float), basis = np.asarray(basis, float), species = species,
+                    masses = atomic_masses(species), lattice = lattice,
+                    a = a, b = b, phi = phi, images = images, weights = weights)
+
+#%% DYNAMICAL MATRICES
+
+def reciprocal(primitive):
+    """
+    Reciprocal lattice vectors (rows) in 1/Angstrom, including the factor 2 pi.
+    """
+    return 2 * np.pi * np.linalg.inv(primitive).T
+
+def nonanalytic(fc:dict, directions, born, epsinf):
+    """
+    Non-analytic term (Q,3B,3B) of the dynamical matrices at Gamma along directions (Q,3), in eV/Angstrom^2/amu.
+
+    Parameters
+    ----------
+    born : array (B,3,3) or (B)
+        Born effective charges of the atoms of the primitive cell (scalars for isotropic charges).
+    epsinf : float or array (3,3)
+        Electronic dielectric constant.
+    """
+    nbasis = len(fc.basis)
+    born = np.asarray(born, float)
+    if born.ndim == 1:
+        born = born[:, None, None] * np.eye(3)
+    epsinf = np.asarray(epsinf, float) * (np.eye(3) if np.ndim(epsinf) == 0 else 1.)
+    directions = np.asarray(directions, float)
+    norms = np.linalg.norm(directions, axis = -1, keepdims = True)
+    directions = np.divide(directions, norms, out = np.zeros_like(directions), where = norms > 0)
+    volume = abs(np.linalg.det(fc.primitive))
+    # (q.Z_a)_alpha for every q-point and atom
+    charges = np.einsum('qx,axy->qay', directions, born).reshape(len(directions), 3 * nbasis)
+    screening = np.einsum('qx,xy,qy->q', directions, epsinf, directions)
+    screening = np.where(screening > 0, screening, 1.)
+    scale = np.repeat(1 / np.sqrt(fc.masses), 3)
+    term = 4 * np.pi * K_COULOMB / volume * charges[:, :, None] * charges[:, None, :] / screening[:, None, None]
+    return term * scale[None, :, None] * scale[None, None, :]
+
+def dynamical_matrices(fc:dict, qpoints, born = None, epsinf = None, directions = None):
+    """
+    Mass-weighted dynamical matrices of many q-points at once.
+
+    Parameters
+    ----------
+    fc : dict
+        Force constants, see force_constants.
+    qpoints : array (Q,3)
+        q-points in fractional coordinates of the reciprocal primitive cell.
+    born, epsinf : optional
+        Born effective charges and electronic dielectric constant, see nonanalytic. With both, the
+        non-analytic term is added at the Gamma points that have a direction.
+    directions : array (Q,3) or (3), optional
+        Cartesian direction of approach of every Gamma point (other q-points are not affected).
+
+    Returns
+    -------
+    matrices : complex array (Q,3B,3B)
+        In eV/Angstrom^2/amu.
+    """
+    qpoints = np.atleast_2d(np.asarray(qpoints, float))
+    nq, nbasis = len(qpoints), len(fc.basis)
+    qcart = qpoints @ reciprocal(fc.primitive)
+    phases = np.einsum('qpk,pk->qp', np.exp(1j * np.einsum('qx,pkx->qpk', qcart, fc.images)), fc.weights)
+    pairs = np.zeros((len(fc.a), nbasis * nbasis))
+    pairs[np.arange(len(fc.a)), fc.a * nbasis + fc.b] = 1
+    matrices = np.einsum('qp,pxy,pn->qnxy', phases, fc.phi, pairs)
+    matrices = matrices.reshape(nq, nbasis, nbasis, 3, 3).transpose(0, 1, 3, 2, 4).reshape(nq, 3 * nbasis, 3 * nbasis)
+    scale = np.repeat(1 / np.sqrt(fc.masses), 3)
+    matrices = matrices * scale[None, :, None] * scale[None, None, :]
+
+    if born is not None and epsinf is not None and directions is not None:
+        directions = np.broadcast_to(np.asarray(directions, float), (nq, 3))
+        gamma = np.all(np.abs(qpoints) < 1e-8, axis = 1) & np.any(directions != 0, axis = 1)
+        if np.any(gamma):
+            matrices[gamma] = matrices[gamma] + nonanalytic(fc, directions[gamma], born, epsinf)
+    return (matrices + np.conj(matrices.transpose(0, 2, 1))) / 2
+
+def frequencies(fc:dict, qpoints, units:str = '1e13 rad/s', eigenvectors:bool = False, **kwargs):
+    """
+    Phonon frequencies (Q,3B) of many q-points, sorted; imaginary frequencies are negative.
+
+    Parameters
+    ----------
+    units : str, optional
+        One of UNITS.
+    eigenvectors : bool, optional
+        Also return the eigenvectors (Q,3B,3B), as columns.
+    **kwargs
+        born, epsinf and directions, see dynamical_matrices.
+    """
+    if units not in UNITS:
+        raise ValueError(f'Option {units} is not a valid unit. Please choose from:\n\t{list(UNITS)}')
+    matrices = dynamical_matrices(fc, qpoints, **kwargs)
+    values, vectors = np.linalg.eigh(matrices)
+    omega = np.sign(values) * np.sqrt(np.abs(values)) * FREQUENCY * UNITS[units]
+    return (omega, vectors) if eigenvectors else omega
+
+#%% DISPERSION
+
+def band_path(primitive, path = None, npoints:int = 200, structure:str = 'fcc'):
+    """
+    q-points along a path of high symmetry points, spaced evenly in reciprocal space.
+
+    Parameters
+    ----------
+    primitive : array (3,3)
+        Primitive cell in Angstrom.
+    path : list, optional
+        Segments of labels of structures[structure].high_symmetry. The default is FCC_PATH.
+    npoints : int, optional
+        Approximate total number of q-points.
+
+    Returns
+    -------
+    path : AttrDict
+        qpoints (Q,3) fractional, distance (Q) in 1/Angstrom, directions (Q,3) of every point along the
+        path, and ticks (distances) and labels of the high symmetry points.
+    """
+    path = FCC_PATH if path is None else path
+    points = structures[structure].high_symmetry
+    missing = [ label for segment in path for label in segment if label not in points ]
+    if missing:
+        raise ValueError(f'No high symmetry points {missing} for {structure}. Please choose from:\n\t{list(points)}')
+    recip = reciprocal(primitive)
+    lengths = [ np.linalg.norm((np.array(points[end]) - np.array(points[start])) @ recip)
+                for segment in path for start, end in zip(segment[:-1], segment[1:]) ]
+    density = npoints / sum(lengths)
+
+    qpoints, distance, directions, ticks, labels = [], [], [], [], []
+    total, lengths = 0., iter(lengths)
+    for segment in path:
+        for start, end in zip(segment[:-1], segment[1:]):
+            length = next(lengths)
+            number = max(2, int(round(length * density)) + 1)
+            t = np.linspace(0, 1, number)
+            begin, stop = np.array(points[start], float), np.array(points[end], float)
+            qpoints += [begin + t[:, None] * (stop - begin)]
+            distance += [total + t * length]
+            directions += [np.tile((stop - begin) @ recip, (number, 1))]
+            if not labels or ticks[-1] != total:
+                ticks, labels = ticks + [total], labels + [start]
+            elif labels[-1] != start:
+                labels[-1] = f'{labels[-1]}|{start}'
+            total += length
+            ticks, labels = ticks + [total], labels + [end]
+    return AttrDict(qpoints = np.concatenate(qpoints), distance = np.concatenate(distance),
+                    directions = np.concatenate(directions), ticks = np.array(ticks), labels = labels)
+
+def dispersion(fc:dict, path = None, npoints:int = 200, units:str = '1e13 rad/s', structure:str = 'fcc', born = None, epsinf = None):
+    """
+    Phonon dispersion along a path of high symmetry points, see band_path.
+
+    Returns
+    -------
+    dispersion : AttrDict
+        The path with the frequencies (Q,3B) in units.
+    """
+    bands = band_path(fc.primitive, path, npoints, structure)
+    bands.frequencies = frequencies(fc, bands.qpoints, units, born = born, epsinf = epsinf, directions = bands.directions)
+    bands.units = units
+    return bands
+
+#%% LITERATURE
+
+def lo_to(fc:dict, crystal, born = None, epsinf = None):
+    """
+    Transverse and longitudinal optical frequencies at Gamma in 10^13 rad/s.
+
+    With Born charges the LO frequency follows from the non-analytic term along [100] (epsinf defaults
+    to crystal.lit.epsinf), without them from the Lyddane-Sachs-Teller relation
+    wLO^2 = wTO^2 eps0 / epsinf with the literature dielectric constants.
+
+    Returns
+    -------
+    TO, LO : float
+    method : str
+        'born' or 'lst'
+    """
+    gamma = np.zeros((1, 3))
+    TO = frequencies(fc, gamma)[0, -1]
+    if born is not None:
+        epsinf = crystal.lit.epsinf if epsinf is None else epsinf
+        LO = frequencies(fc, gamma, born = born, epsinf = epsinf, directions = [1., 0., 0.])[0, -1]
+        return TO, LO, 'born'
+    return TO, TO * np.sqrt(crystal.lit.eps0 / crystal.lit.epsinf), 'lst'
+
+def compare_lo(fcs:dict, born:dict = None):
+    """
+    Compare the LO frequencies of crystals with lit.wL0.
+
+    Parameters
+    ----------
+    fcs : dict
+        Force constants {crystal key: fc}, see force_constants.
+    born : dict, optional
+        Born effective charges {crystal key: charges}, see lo_to.
+
+    Returns
+    -------
+    table : structured array (LO_DTYPE)
+        One row per crystal, lit_wL0 and error are nan without a literature value.
+    """
+    from .create_crystals import crystals
+    born = born or {}
+    table = np.zeros(len(fcs), LO_DTYPE)
+    for row, (key, fc) in zip(table, fcs.items()):
+        crystal = crystals[key]
+        row['crystal'] = crystal.crystal
+        row['TO'], row['LO'], row['method'] = lo_to(fc, crystal, born.get(key))
+        row['lit_wL0'] = crystal.lit.wL0
+    table['error'] = table['LO'] / table['lit_wL0'] - 1
+    return table
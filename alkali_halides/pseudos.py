@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the pseudopotentials (UPF files) in a directory.
+
+The directory is scanned once and the header of every file (element, valence, suggested cutoffs,
+functional) is stored in an index file keyed by the sha1 hash of the file, so that a file is only parsed
+again when it changes. Files are memory mapped: reading a header only touches the start of the file, and
+the large numeric sections (radial grid, projectors, charge density) are read on demand.
+
+The registry cross-checks the crystals against their pseudopotentials: the number of occupied bands
+(valence) should hold all valence electrons, and settings.ecutwfc should not be below the suggested cutoff.
+"""
+
+import numpy as np
+import os, re, json, mmap, hashlib
+from .attrdict import AttrDict
+
+PSEUDO_DIR = os.environ.get('AH_PSEUDO_DIR', 'pseudos')
+INDEX_FILE = '.pseudo_index.json'
+CHUNK_SIZE = 2**20
+
+CHECK_DTYPE = [
+    ('crystal', 'U8'),
+    ('valence', int),       # occupied bands in the settings
+    ('electrons', float),   # valence electrons of the pseudopotentials
+    ('ecutwfc', float),     # Ry, settings
+    ('suggested', float),   # Ry, largest suggested cutoff of the pseudopotentials (0 if unknown)
+    ('ok', bool),
+    ('message', 'U128'),
+]
+
+#%% PARSING
+
+def file_hash(filename:str):
+    """
+    sha1 hash of a file, read in chunks.
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda : file.read(CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def header_v1(text:str):
+    """
+    Header of a UPF v1 file: one value per line, followed by its description.
+    Raises a ValueError for a line that cannot be parsed.
+    """
+    header = AttrDict(version = 1)
+    for line in text.splitlines():
+        words = line.split()
+        lower = line.lower()
+        if 'element' in lower:
+            header.element = words[0]
+        elif 'z valence' in lower:
+            header.z_valence = float(words[0])
+        elif 'exchange-correlation' in lower:
+            header.functional = ' '.join(line[:lower.index('exchange-correlation')].split())
+            if not header.functional:
+                raise ValueError(f'No functional before Exchange-Correlation in the line: {line.strip()}')
+        elif 'suggested cutoff' in lower:
+            header.wfc_cutoff, header.rho_cutoff = float(words[0]), float(words[1])
+        elif any( kind in words[:1] for kind in ['NC', 'US', 'PAW', 'SL'] ):
+            header.pseudo_type = words[0]
+    return header
+
+def header_v2(text:str):
+    """
+    Header of a UPF v2 file: attributes of the PP_HEADER tag.
+    """
+    attributes = dict(re.findall(r'(\w+)\s*=\s*"([^"]*)"', text))
+    header = AttrDict(version = 2)
+    header.element = attributes.get('element', '').strip()
+    header.z_valence = float(attributes.get('z_valence', 'nan'))
+    header.functional = attributes.get('functional', '').strip()
+    header.wfc_cutoff = float(attributes.get('wfc_cutoff', 0))
+    header.rho_cutoff = float(attributes.get('rho_cutoff', 0))
+    header.pseudo_type = attributes.get('pseudo_type', '').strip()
+    header.relativistic = attributes.get('relativistic', '').strip()
+    return header
+
+def open_mmap(filename:str):
+    """
+    Memory map of a file for reading. Raises a ValueError for an empty file, which cannot be mapped.
+    """
+    if os.path.getsize(filename) == 0:
+        raise ValueError(f'{filename} is empty, is it a UPF file?')
+    with open(filename, 'rb') as file:
+        return mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+def read_header(filename:str):
+    """
+    Parse the header of a UPF file (version 1 or 2) without reading the numeric sections.
+
+    Returns
+    -------
+    header : AttrDict
+        element, z_valence, functional, wfc_cutoff and rho_cutoff (Ry, 0 if not given), pseudo_type
+        and version.
+    """
+    with open_mmap(filename) as data:
+        start = data.find(b'<PP_HEADER')
+        if start < 0:
+            raise ValueError(f'{filename} has no PP_HEADER, is it a UPF file?')
+        opening = data.find(b'>', start)
+        if data[opening - 1:opening] == b'/' or data.find(b'="', start, opening) > 0:
+            # UPF v2, the header is in the attributes of the tag
+            return header_v2(data[start:opening].decode(errors = 'replace'))
+        end = data.find(b'</PP_HEADER>', opening)
+        try:
+            return header_v1(data[opening + 1:end].decode(errors = 'replace'))
+        except (ValueError, IndexError) as error:
+            raise ValueError(f'Cannot parse the PP_HEADER of {filename}: {error}') from error
+
+def read_section(filename:str, name:str):
+    """
+    Numeric contents of a section of a UPF file, e.g. 'PP_R' (radial grid) or 'PP_RHOATOM'.
+    Only the section itself is read from the memory mapped file.
+    """
+    with open_mmap(filename) as data:
+        start = data.find(b'<' + name.encode())
+        while start >= 0 and data[start + len(name) + 1:start + len(name) + 2] not in [b'>', b' ', b'\n', b'\r', b'\t']:
+            start = data.find(b'<' + name.encode(), start + 1)
+        if start < 0:
+            raise KeyError(f'{filename} has no section {name}')
+        opening = data.find(b'>', start)
+        end = data.find(b'</' + name.encode(), opening)
+        text = data[opening + 1:end].decode()
+    return np.array(text.replace('D', 'E').replace('d', 'e').split(), float)
+
+#%% REGISTRY
+
+class PseudoRegistry(object):
+    """
+    Index of the UPF files in a directory.
+
+    Parameters
+    ----------
+    dirname : str, optional
+        Directory with the pseudopotentials. The default is $AH_PSEUDO_DIR or 'pseudos'.
+    index : str, optional
+        Index file, relative to dirname.
+    """
+    def __init__(self, dirname:str = None, index:str = INDEX_FILE):
+        self.dirname = dirname or PSEUDO_DIR
+        self.index = os.path.join(self.dirname, index)
+        self.headers = {}   # hash: header
+        self.files = {}     # filename: dict(hash, size, mtime)
+        if os.path.exists(self.index):
+            with open(self.index) as file:
+                stored = json.load(file)
+            self.headers = { key: AttrDict(header) for key, header in stored['headers'].items() }
+            self.files = stored['files']
+        self.scan()
+
+    def __repr__(self):
+        return f'<PseudoRegistry({self.dirname}, {len(self)} files)>'
+
+    def __len__(self):
+        return len(self.files)
+
+    def __iter__(self):
+        return iter(sorted(self.files))
+
+    def __contains__(self, filename:str):
+        return filename in self.files
+
+    def __getitem__(self, filename:str):
+        """
+        Header of a file, with its filename and hash.
+        """
+        if filename not in self.files:
+            raise KeyError(f'{filename} is not in {self.dirname}')
+        key = self.files[filename]['hash']
+        return AttrDict(self.headers[key], filename = filename, hash = key)
+
+    def scan(self):
+        """
+        Update the index with new and changed files. Unchanged files (same size and modification
+        time) are not read again, changed files are only parsed if their hash is new.
+        """
+        changed = False
+        filenames = []
+        if os.path.isdir(self.dirname):
+            filenames = sorted( fn for fn in os.listdir(self.dirname) if fn.lower().endswith('.upf') )
+        for fn in set(self.files) - set(filenames):
+            del self.files[fn]
+            changed = True
+        for fn in filenames:
+            path = os.path.join(self.dirname, fn)
+            stat = os.stat(path)
+            entry = self.files.get(fn)
+            if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                continue
+            key = file_hash(path)
+            if key not in self.headers:
+                self.headers[key] = read_header(path)
+            self.files[fn] = dict(hash = key, size = stat.st_size, mtime = stat.st_mtime)
+            changed = True
+        if changed:
+            self.save()
+
+    def save(self):
+        """
+        Write the index, keeping only the headers of files that are present.
+        """
+        used = { entry['hash'] for entry in self.files.values() }
+        headers = { key: header for key, header in self.headers.items() if key in used }
+        temporary = self.index + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(dict(headers = headers, files = self.files), file, indent = 1)
+        os.replace(temporary, self.index)
+
+    def by_element(self, element:str):
+        """
+        Headers of all files of an element.
+        """
+        return [ self[fn] for fn in self if self[fn].element == element ]
+
+    def section(self, filename:str, name:str):
+        """
+        Numeric contents of a section of a file, see read_section.
+        """
+        return read_section(os.path.join(self.dirname, self[filename].filename), name)
+
+    def check(self, crystals = None):
+        """
+        Cross-check the valence and cutoff settings of crystals against their pseudopotentials.
+
+        Parameters
+        ----------
+        crystals : list, optional
+            Crystals or crystal keys. The default of None checks all 20 alkali halides.
+
+        Returns
+        -------
+        table : structured array (CHECK_DTYPE)
+            One row per crystal; ok is False with a message for missing pseudopotentials, a number of
+            occupied bands that does not hold the valence electrons, or a cutoff below the suggested one.
+        """
+        from .create_crystals import crystals as all_crystals
+        if crystals is None:
+            crystals = all_crystals.values()
+        crystals = [ all_crystals[crystal] if isinstance(crystal, str) else crystal for crystal in crystals ]
+        table = np.zeros(len(crystals), CHECK_DTYPE)
+        for row, crystal in zip(table, crystals):
+            row['crystal'] = crystal.crystal
+            row['valence'] = crystal.valence
+            row['ecutwfc'] = crystal.settings.ecutwfc
+            missing = [ fn for fn in crystal.pseudos if fn not in self ]
+            if missing:
+                row['message'] = f'missing {" ".join(missing)}'
+                continue
+            headers = [ self[fn] for fn in crystal.pseudos ]
+            row['electrons'] = sum( header.z_valence for header in headers )
+            row['suggested'] = max( header.wfc_cutoff for header in headers )
+            messages = [ f'{fn} is {header.element}' for fn, header, element
+                         in zip(crystal.pseudos, headers, crystal.species) if header.element != element ]
+            if 2 * row['valence'] != row['electrons']:
+                messages += [ f'{row["electrons"]:g} valence electrons need {row["electrons"] / 2:g} occupied bands' ]
+            if row['ecutwfc'] < row['suggested']:
+                messages += [ f'ecutwfc below the suggested {row["suggested"]:g} Ry' ]
+            row['message'] = ', '.join(messages)
+        table['ok'] = table['message'] == ''
+        return table
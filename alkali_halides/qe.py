@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Reading Quantum Espresso (pw.x) input and output files.
+"""
+
+import numpy as np
+import re, json
+from .attrdict import AttrDict
+from .fft import BOHR
+
+CARDNAMES = ['&CONTROL', '&SYSTEM', '&ELECTRONS', '&IONS', '&CELL', '&FCP', '&RISM', 
+             'ATOMIC_SPECIES', 'ATOMIC_POSITIONS', 'K_POINTS', 'ADDITIONAL_K_POINTS', 'CELL_PARAMETERS', 
+             'CONSTRAINTS', 'OCCUPATIONS', 'ATOMIC_VELOCITIES', 'ATOMIC_FORCES', 'SOLVENTS', 'HUBBARD']
+
+def get_card(lines, cardname):
+    """
+    Retrieve cards from a Quantum Espresso file.
+    lines: list of strings.
+    cardname: string with the name of the card.
+    """
+    contents = []
+    walker = iter(lines)
+    for line in walker:
+        if cardname in line:
+            break
+    else:
+        return contents
+    for line in walker:
+        line = line.strip()
+        if len(line) == 0 or any([ line.index(cardname) == 0 for cardname in CARDNAMES if cardname in line.upper()]):
+            break
+        contents += [line]
+    return contents
+
+def read_QE(filename):
+    """
+    Read relevant cards from a Quantum Espresso file.
+    filename: string with the filename.
+    """
+    lines = open(filename,'r').readlines()
+    # CARDS
+    cell_pars = get_card(lines, 'CELL_PARAMETERS')
+    atomic_pos = get_card(lines, 'ATOMIC_POSITIONS')
+    
+    species = [ line.split()[0] for line in atomic_pos ]
+    coords = np.array([ line.split()[1:4] for line in atomic_pos ], float)
+    rprim = np.array([ line.split() for line in cell_pars ], float)
+    
+    return rprim, species, coords
+
+def fortran_value(value:str):
+    """
+    Convert a Fortran namelist value to a python value.
+    """
+    value = value.strip().rstrip(',')
+    if value.lower() in ['.true.', '.t.']:
+        return True
+    if value.lower() in ['.false.', '.f.']:
+        return False
+    if value[:1] in ['"', "'"]:
+        return value[1:-1]
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value.lower().replace('d', 'e'))
+    except ValueError:
+        return value
+
+def read_namelists(lines):
+    """
+    Read all namelists (&CONTROL, &SYSTEM, ...) from the lines of a Quantum Espresso file.
+    Returns a dictionary of namelists with lower case names and keys.
+    """
+    namelists = {}
+    current = None
+    for line in lines:
+        line = line.split('!')[0].strip()
+        if line.startswith('&'):
+            current = namelists.setdefault(line[1:].strip().lower(), {})
+        elif line == '/':
+            current = None
+        elif current is not None:
+            for key, value in re.findall(r"([\w()]+)\s*=\s*('[^']*'|\"[^\"]*\"|[^,\s]+)", line):
+                current[key.lower()] = fortran_value(value)
+    return namelists
+
+def card_option(lines, cardname:str):
+    """
+    Option of a card in lower case, e.g. 'angstrom' for CELL_PARAMETERS {angstrom}, '' if it has none.
+    Raises a ValueError if the card is missing.
+    """
+    for line in lines:
+        words = line.split('!')[0].split()
+        if words and words[0].upper() == cardname:
+            return ' '.join(words[1:]).strip('{}() ').lower()
+    raise ValueError(f'The card {cardname} is missing.')
+
+def unit_scale(option:str, system:dict):
+    """
+    Factor that converts lengths in the unit of a card option (angstrom, bohr, alat or none) to Angstrom.
+    Without an option pw.x uses alat if celldm(1) or A is set and bohr otherwise.
+    """
+    alat = system['celldm(1)'] * BOHR if 'celldm(1)' in system else system.get('a')
+    if 'bohr' in option or (option == '' and alat is None):
+        return BOHR
+    if 'alat' in option or option == '':
+        if alat is None:
+            raise ValueError('Lengths are given in alat, but neither celldm(1) nor A is set.')
+        return alat
+    if 'angstrom' in option:
+        return 1.
+    raise ValueError(f'Option {option} is not a valid unit of length.')
+
+def read_lattice(filename:str):
+    """
+    Lattice vectors (rows) of a pw.x input in Angstrom, converted from the units of CELL_PARAMETERS.
+    """
+    lines = open(filename,'r').readlines()
+    system = read_namelists(lines).get('system', {})
+    rprim, _, _ = read_QE(filename)
+    return rprim * unit_scale(card_option(lines, 'CELL_PARAMETERS'), system)
+
+def read_pw_input(filename):
+    """
+    Read a pw.x input file.
+
+    Returns
+    -------
+    data : AttrDict
+        namelists : dictionary of the namelists, see read_namelists.
+        rprim, species, coords : cell, atoms and positions as from read_QE.
+        ngkpt, kshift : automatic k-grid, or None if the k-points are listed.
+        kpoints : array (N,4) of listed k-points and weights, or None for an automatic grid.
+    """
+    lines = open(filename,'r').readlines()
+    rprim, species, coords = read_QE(filename)
+    data = AttrDict(namelists = read_namelists(lines), rprim = rprim, species = species, coords = coords,
+                    ngkpt = None, kshift = None, kpoints = None)
+    
+    header = [ line for line in lines if line.strip().upper().startswith('K_POINTS') ]
+    card = get_card(lines, 'K_POINTS')
+    if len(header) == 0 or len(card) == 0:
+        return data
+    if 'automatic' in header[0].lower():
+        values = np.array(card[0].split(), int)
+        data.ngkpt, data.kshift = values[:3], values[3:6] / 2
+    elif 'gamma' in header[0].lower():
+        data.ngkpt, data.kshift = np.ones(3, int), np.zeros(3)
+    else:
+        nks = int(card[0].split()[0])
+        data.kpoints = np.array([ line.split()[:4] for line in card[1:nks+1] ], float)
+    return data
+
+def read_structure(filename:str):
+    """
+    Lattice (Angstrom), species and fractional coordinates of a pymatgen json file or pw.x input.
+    """
+    if filename.endswith('.json'):
+        with open(filename) as file:
+            data = json.load(file)
+        lattice = np.array(data['lattice']['matrix'], float)
+        species = [ site['species'][0]['element'] for site in data['sites'] ]
+        frac = np.array([ site['abc'] for site in data['sites'] ], float)
+        return lattice, species, frac, {}
+
+    data = read_pw_input(filename)
+    lines = open(filename,'r').readlines()
+    system = data.namelists.get('system', {})
+    lattice = data.rprim * unit_scale(card_option(lines, 'CELL_PARAMETERS'), system)
+    coords = data.coords
+    option = card_option(lines, 'ATOMIC_POSITIONS')
+    if 'crystal' not in option:
+        coords = coords * unit_scale(option, system) @ np.linalg.inv(lattice)
+    return lattice, data.species, coords, data.namelists
+
+def read_stress(filename):
+    """
+    Read the last total stress from a pw.x output file (tstress = .true.).
+
+    Returns
+    -------
+    stress : array (3,3) or None
+        Stress in kbar as printed by pw.x (positive under compression), None if the output has none.
+    """
+    lines = open(filename, 'r').readlines()
+    stress = None
+    for ii, line in enumerate(lines):
+        if 'total   stress' in line:
+            stress = np.array([ lines[jj].split()[3:6] for jj in range(ii + 1, ii + 4) ], float)
+    return stress
+
+def read_forces(filename):
+    """
+    Read the last forces on the atoms from a pw.x output file (tprnfor = .true.).
+
+    Returns
+    -------
+    forces : array (N,3) or None
+        Total forces in Ry/bohr as printed by pw.x, None if the output has none.
+    """
+    lines = open(filename, 'r').readlines()
+    forces = None
+    for ii, line in enumerate(lines):
+        if 'Forces acting on atoms' in line:
+            block = []
+            for line in lines[ii + 1:]:
+                if 'atom' in line and 'force =' in line:
+                    block += [ line.split('=')[1].split()[:3] ]
+                elif block:
+                    # the end of the total forces, the contributions follow in later blocks
+                    break
+            forces = np.array(block, float)
+    return forces
+
+def read_pw_output(filename):
+    """
+    Read the main results from a pw.x output file, the last value of each.
+
+    Returns
+    -------
+    output : AttrDict
+        total_energy (Ry), pressure and stress (kbar), alat (bohr), ecutwfc (Ry), and converged,
+        None for what is not in the output.
+    """
+    output = AttrDict(total_energy = None, pressure = None, stress = read_stress(filename),
+                      alat = None, ecutwfc = None, converged = False)
+    patterns = dict(
+        total_energy = r'^!\s+total energy\s+=\s+(\S+)',
+        pressure = r'total\s+stress.*P=\s*(\S+)',
+        alat = r'lattice parameter \(alat\)\s+=\s+(\S+)',
+        ecutwfc = r'kinetic-energy cutoff\s+=\s+(\S+)',
+    )
+    with open(filename, 'r') as file:
+        for line in file:
+            for key, pattern in patterns.items():
+                match = re.search(pattern, line)
+                if match:
+                    output[key] = float(match.group(1))
+            if 'convergence has been achieved' in line:
+                output.converged = True
+    return output
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Local results database of calculated properties.
+
+Results are stored in SQLite, one row per value: crystal, calculation type (e.g. 'scf', 'conv',
+'displacement'), a hash of the settings used, the property name, its value and the directory it came
+from. Queries return columns as numpy arrays.
+
+Properties named like the columns of the shipped CSVs (calc_* and conv_*) overlay those values when the
+crystals are loaded: set the environment variable AH_RESULTS to the database file, and the latest value
+of every such property replaces the one in calculated.csv.
+
+Example
+-------
+    store = ResultsStore('results.sqlite')
+    harvest_outputs(store, glob('LiF/*/*.out'), 'LiF', 'conv', prefix = 'conv_')
+    store.query(crystal = 'LiF', key = 'conv_total_energy').value
+"""
+
+import numpy as np
+import os, json, time, sqlite3, hashlib
+from .attrdict import AttrDict
+from .qe import read_pw_output
+
+OVERLAY_PREFIXES = ('calc_', 'conv_')
+COLUMNS = ['crystal', 'calculation', 'settings_hash', 'key', 'value', 'path', 'created']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    crystal TEXT NOT NULL,
+    calculation TEXT NOT NULL,
+    settings_hash TEXT,
+    key TEXT NOT NULL,
+    value REAL,
+    path TEXT,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    settings_hash TEXT PRIMARY KEY,
+    settings TEXT
+);
+CREATE INDEX IF NOT EXISTS results_crystal ON results (crystal, key);
+CREATE INDEX IF NOT EXISTS results_settings ON results (settings_hash);
+CREATE INDEX IF NOT EXISTS results_calculation ON results (calculation);
+"""
+
+def to_builtin(value):
+    """
+    Convert numpy values (also inside lists and dicts) to python values for json.
+    """
+    if isinstance(value, dict):
+        return { str(key): to_builtin(item) for key, item in value.items() }
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [ to_builtin(item) for item in value ]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def settings_hash(settings:dict):
+    """
+    Short sha1 hash of a settings dictionary, independent of the order of the keys.
+    """
+    text = json.dumps(to_builtin(settings), sort_keys = True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+class ResultsStore(object):
+    """
+    SQLite database of calculated properties.
+
+    Parameters
+    ----------
+    filename : str, optional
+        Database file, created if it does not exist. ':memory:' gives a temporary database.
+    """
+    def __init__(self, filename:str = 'results.sqlite'):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(SCHEMA)
+
+    def __repr__(self):
+        return f'<ResultsStore({self.filename}, {len(self)} results)>'
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def add_settings(self, settings:dict):
+        """
+        Store a settings dictionary and return its hash.
+        """
+        if settings is None:
+            return None
+        with self.connection:
+            return self._add_settings(settings)
+
+    def _add_settings(self, settings:dict):
+        """
+        Store a settings dictionary without committing, inside the transaction of the caller.
+        """
+        key = settings_hash(settings)
+        self.connection.execute('INSERT OR IGNORE INTO settings VALUES (?, ?)',
+                                (key, json.dumps(to_builtin(settings), sort_keys = True)))
+        return key
+
+    def settings(self, key:str):
+        """
+        Settings dictionary of a hash, None if unknown.
+        """
+        row = self.connection.execute('SELECT settings FROM settings WHERE settings_hash = ?', (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def insert(self, crystal:str, calculation:str, values:dict, settings:dict = None, path:str = None):
+        """
+        Insert the values {key: value} of one calculation.
+        """
+        self.insert_many([ (crystal, calculation, values, settings, path) ])
+
+    def insert_many(self, calculations):
+        """
+        Insert many calculations in one transaction, including their settings.
+
+        Parameters
+        ----------
+        calculations : iterable
+            Tuples (crystal, calculation, values, settings, path) as for insert.
+        """
+        rows = []
+        created = time.time()
+        hashes = {}
+        with self.connection:
+            for crystal, calculation, values, settings, path in calculations:
+                text = None if settings is None else json.dumps(to_builtin(settings), sort_keys = True)
+                if text is not None and text not in hashes:
+                    hashes[text] = self._add_settings(settings)
+                key = hashes.get(text)
+                rows += [ (str(crystal), calculation, key, name, None if value is None else float(value), path, created)
+                          for name, value in values.items() ]
+            self.connection.executemany(
+                f'INSERT INTO results ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})', rows)
+        return len(rows)
+
+    def query(self, crystal:str = None, calculation:str = None, settings_hash:str = None, key:str = None):
+        """
+        Results matching all given criteria, oldest first.
+
+        Returns
+        -------
+        results : AttrDict
+            One numpy array per column (crystal, calculation, settings_hash, key, value, path, created).
+        """
+        criteria = dict(crystal = crystal, calculation = calculation, settings_hash = settings_hash, key = key)
+        criteria = { name: value for name, value in criteria.items() if value is not None }
+        where = ' AND '.join( f'{name} = ?' for name in criteria ) or '1'
+        rows = self.connection.execute(f'SELECT {", ".join(COLUMNS)} FROM results WHERE {where} ORDER BY id',
+                                       [ str(value) for value in criteria.values() ]).fetchall()
+        columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+        results = AttrDict()
+        for name, column in zip(COLUMNS, columns):
+            if name in ['value', 'created']:
+                results[name] = np.array([ np.nan if item is None else item for item in column ], float)
+            else:
+                results[name] = np.array([ '' if item is None else item for item in column ], str)
+        return results
+
+    def latest(self, prefixes = OVERLAY_PREFIXES):
+        """
+        Latest value of every (crystal, key) whose key starts with one of the prefixes.
+
+        Returns
+        -------
+        latest : dict
+            {crystal: {key: value}}
+        """
+        where = ' OR '.join( 'key GLOB ?' for _ in prefixes )
+        rows = self.connection.execute(
+            f'SELECT crystal, key, value FROM results WHERE id IN '
+            f'(SELECT MAX(id) FROM results WHERE {where} GROUP BY crystal, key)',
+            [ prefix + '*' for prefix in prefixes ]).fetchall()
+        latest = {}
+        for crystal, key, value in rows:
+            latest.setdefault(crystal, {})[key] = value
+        return latest
+
+def overlay(dict_database:dict, filename:str):
+    """
+    Replace the calc_* and conv_* values of the database dictionary by the latest stored results.
+    Crystals that are not in the database and results without a value (None) are ignored.
+    """
+    if filename is None or not os.path.exists(filename):
+        return dict_database
+    store = ResultsStore(filename)
+    for crystal, values in store.latest().items():
+        if crystal in dict_database:
+            dict_database[crystal].update({ key: value for key, value in values.items() if value is not None })
+    store.close()
+    return dict_database
+
+def harvest_outputs(store:ResultsStore, files, crystal:str, calculation:str, settings:dict = None,
+                    prefix:str = '', keys = ('total_energy', 'pressure')):
+    """
+    Bulk insert the results of pw.x output files, see qe.read_pw_output.
+
+    Parameters
+    ----------
+    store : ResultsStore
+    files : list
+        pw.x output files.
+    crystal, calculation : str
+        Crystal and calculation type of all files.
+    settings : dict, optional
+        Settings shared by all files.
+    prefix : str, optional
+        Prefix of the stored keys, e.g. 'conv_' to overlay conv_total_energy and conv_pressure.
+    keys : list, optional
+        Results of read_pw_output to store.
+
+    Returns the number of stored values.
+    """
+    calculations = []
+    for fn in files:
+        output = read_pw_output(fn)
+        values = { prefix + key: output[key] for key in keys if output[key] is not None }
+        if values:
+            calculations += [ (crystal, calculation, values, settings, os.path.dirname(os.path.abspath(fn))) ]
+    return store.insert_many(calculations)
@@ -0,0 +1,100 @@
+"""
+Run the alkali halides daemon and send it requests.
+Call e.g. AH_daemon serve & in a job script, and then AH_daemon structure LiF -s 2 -o LiF.json.
+Without a running daemon the requests are executed in the client.
+"""
+
+import argparse, json, os, sys
+from ..daemon import serve, request
+
+def parse_argv():
+    parser = argparse.ArgumentParser(
+        prog = 'AH_daemon',
+        description = 'Keeps the alkali halides package loaded and serves structures, displacements and input decks',
+    )
+    parser.add_argument('--socket', default=None,
+                        help='Unix domain socket. Default is $AH_SOCKET or alkali_halides-<uid>.sock in the temporary directory')
+    parser.add_argument('--no-fallback', action='store_true',
+                        help='Fail when no daemon is running instead of executing the request in this process')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('serve', help='Run the daemon until it is stopped')
+    commands.add_parser('stop', help='Stop the daemon')
+    commands.add_parser('ping', help='Check whether the daemon is running')
+
+    structure = commands.add_parser('structure', help='Write the structure of a crystal as json')
+    structure.add_argument('crystal', help='Crystal, e.g. LiF')
+    structure.add_argument('-s','--supercell', type=int, nargs='+', default=None,
+                           help='Supercell, N or X Y Z')
+    structure.add_argument('-p','--perturbed', type=float, default=None,
+                           help='Maximum perturbation of the atoms in Angstrom')
+    structure.add_argument('--min-distance', type=float, default=None,
+                           help='Smallest allowed interatomic distance of perturbed structures in Angstrom')
+    structure.add_argument('-o','--output', default=None,
+                           help='Output file. Default is stdout')
+
+    displace = commands.add_parser('displace', help='Apply a displacement recipe to a Quantum Espresso input')
+    displace.add_argument('input', help='Quantum Espresso input file')
+    displace.add_argument('--recipe', required=True,
+                          help='Displacement method and parameters as json or a json file, see AH_displace')
+    displace.add_argument('--atom', type=int, default=0,
+                          help='Index of the atom to displace')
+    displace.add_argument('-o','--output', default='.',
+                          help='Directory in which the D#### directories are made')
+
+    deck = commands.add_parser('deck', help='Write the input deck of a crystal, see AH_decks')
+    deck.add_argument('crystal', help='Crystal, e.g. LiF')
+    deck.add_argument('-d','--dirname', default='decks',
+                      help='Root directory of the decks')
+    deck.add_argument('-p','--pseudo-dir', default='pseudos',
+                      help='Directory containing the pseudopotentials')
+    deck.add_argument('--force', action='store_true',
+                      help='Rewrite files even if they did not change')
+    return parser.parse_args()
+
+def main():
+    cf = parse_argv()
+    try:
+        run(cf)
+    except RuntimeError as error:
+        print(error)
+        sys.exit(1)
+
+def run(cf):
+    send = lambda command, **params : request(command, cf.socket, not cf.no_fallback, **params)
+
+    if cf.command == 'serve':
+        serve(cf.socket)
+    elif cf.command == 'stop':
+        send('shutdown')
+    elif cf.command == 'ping':
+        try:
+            result = request('ping', cf.socket, fallback = False)
+        except OSError:
+            print('No daemon is running')
+            sys.exit(1)
+        print(f'Daemon running with pid {result["pid"]}')
+    elif cf.command == 'structure':
+        supercell = None if cf.supercell is None else cf.supercell[0] if len(cf.supercell) == 1 else cf.supercell
+        structure = send('structure', crystal = cf.crystal, supercell = supercell,
+                         perturbed = cf.perturbed, min_distance = cf.min_distance)
+        if cf.output is None:
+            print(json.dumps(structure))
+        else:
+            with open(cf.output, 'w') as file:
+                json.dump(structure, file)
+    elif cf.command == 'displace':
+        recipe = cf.recipe
+        if os.path.exists(recipe):
+            with open(recipe) as file:
+                recipe = file.read()
+        summary = send('displace', input = os.path.abspath(cf.input), recipe = json.loads(recipe),
+                       atom = cf.atom, dirname = os.path.abspath(cf.output))
+        if summary['error']:
+            print(summary['error'])
+            sys.exit(1)
+        print(f'{summary["input"]}: {summary["written"]} written, {summary["skipped"]} skipped')
+    elif cf.command == 'deck':
+        crystal, written, changed = send('deck', crystal = cf.crystal, dirname = os.path.abspath(cf.dirname),
+                                         pseudo_dir = os.path.abspath(cf.pseudo_dir), force = cf.force)
+        print(f'{crystal:6s} {"written" if written else "unchanged"} ({changed} files)')
@@ -0,0 +1,49 @@
+"""
+Write the Quantum Espresso and BerkeleyGW input decks of the alkali halides.
+Call e.g. AH_decks LiF NaCl -d decks to write the decks of two crystals.
+"""
+
+import argparse
+from tabulate import tabulate
+from ..decks import write_decks
+from ..pseudos import PseudoRegistry
+from ..dielectric import suggest_cutoffs, MODELS
+
+def parse_argv():
+    parser = argparse.ArgumentParser(
+        prog = 'AH_decks',
+        description = 'Writes input decks (scf, wfn, epsilon, sigma, kernel, absorption) for the alkali halides',
+    )
+    parser.add_argument('crystals', nargs='*',
+                        help='Crystals to write, e.g. LiF NaCl. Default is all crystals')
+    parser.add_argument('-d','--dirname', default='decks',
+                        help='Root directory of the decks')
+    parser.add_argument('-p','--pseudo-dir', default='pseudos',
+                        help='Directory containing the pseudopotentials')
+    parser.add_argument('-j','--processes', type=int, default=None,
+                        help='Number of worker processes. Default is all cores')
+    parser.add_argument('--force', action='store_true',
+                        help='Rewrite files even if they did not change')
+    parser.add_argument('--check', action='store_true',
+                        help='Only check valence and ecutwfc against the pseudopotentials in --pseudo-dir')
+    parser.add_argument('--screening', action='store_true',
+                        help='Only compare ecuteps with the cutoff suggested by a model dielectric function')
+    parser.add_argument('--model', default='hybertsen-louie', choices=MODELS,
+                        help='Model dielectric function of --screening')
+    parser.add_argument('--tol', type=float, default=0.01,
+                        help='Largest eps(q) - 1 beyond the suggested ecuteps of --screening')
+    return parser.parse_args()
+
+def main():
+    cf = parse_argv()
+    if cf.check:
+        table = PseudoRegistry(cf.pseudo_dir).check(cf.crystals or None)
+        print(tabulate(table.tolist(), headers=table.dtype.names))
+        return
+    if cf.screening:
+        table = suggest_cutoffs(cf.crystals or None, cf.tol, cf.model)
+        print(tabulate(table.tolist(), headers=table.dtype.names, floatfmt='.4g'))
+        return
+    summary = write_decks(cf.crystals or None, cf.dirname, cf.pseudo_dir, cf.processes, cf.force)
+    for crystal, written, changed in summary:
+        print(f'{crystal:6s} {"written" if written else "unchanged"} ({changed} files)')
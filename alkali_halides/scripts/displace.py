@@ -7,16 +7,13 @@ Then call e.g. displace('-m step') to generate a step displacement.
 import numpy as np
 import os, pickle
 import json
-from pymatgen.core import Structure, Lattice
 from tabulate import tabulate
-from .filehandling import leading_zeros, select
+from .filehandling import select
+from ..qe import read_QE
+from ..displacements import write_displacements, find_inputs, displace_inputs
 from .methods import line_cell, line_cart, mag_cell, mag_cart, zero, plane_cell, volume_cell, step_cell, step_cartesian, shell_cell, shell_cartesian, shell_cartesian_oct, shell_cell_oct
 import argparse, glob
 
-CARDNAMES = ['&CONTROL', '&SYSTEM', '&ELECTRONS', '&IONS', '&CELL', '&FCP', '&RISM', 
-             'ATOMIC_SPECIES', 'ATOMIC_POSITIONS', 'K_POINTS', 'ADDITIONAL_K_POINTS', 'CELL_PARAMETERS', 
-             'CONSTRAINTS', 'OCCUPATIONS', 'ATOMIC_VELOCITIES', 'ATOMIC_FORCES', 'SOLVENTS', 'HUBBARD']
-
 #%%
 
 def get_method_keys():
@@ -104,9 +101,42 @@ def parse_argv():
     parser.add_argument('-f','--find', action='store_true',
                         help='Automatically find Quantum Espresso input files')
 
+    parser.add_argument('--min-dist', type=float, default=0.5, metavar='DIST',
+                        help='Flag displacements that bring atoms closer than DIST Angstrom (0 disables)')
+    
+    parser.add_argument('--reject', action='store_true',
+                        help='Do not write displacements that are flagged by --min-dist')
+
+    parser.add_argument('-i','--index', default=None, metavar='FILE',
+                        help='Fingerprint index of calculated structures. Duplicates get a note instead of a json file')
+
+    parser.add_argument('-r','--recursive', nargs='?', const='.', default=None, metavar='ROOT',
+                        help='Apply one --recipe to all Quantum Espresso inputs found below ROOT (default .)')
+
+    parser.add_argument('--include', action='append', default=None, metavar='PATTERN',
+                        help='With --recursive: input files to use (default *.in), may be repeated')
+
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help='With --recursive: input files to skip, may be repeated')
+
+    parser.add_argument('--recipe', default=None, metavar='JSON',
+                        help='With --recursive: displacement parameters as json or a json file, e.g. '
+                             '\'{"radius": 0.3, "npoints": 5}\' with -m shell-cart')
+
+    parser.add_argument('--atom', type=int, default=0, metavar='INDEX',
+                        help='With --recursive: index of the atom to displace in every input')
+
+    parser.add_argument('-o','--output', default='displacements', metavar='DIR',
+                        help='With --recursive: output root, one directory per input')
+
+    parser.add_argument('-j','--processes', type=int, default=None,
+                        help='With --recursive: number of worker processes. Default is all cores')
+
     parser.add_argument('--SAVEFILE', action='store_const', default='./displace.bin', const='./displace.bin')
     
     cf = parser.parse_args()
+    if cf.recursive is not None and cf.recipe is None and cf.method != 'zero':
+        parser.error('--recursive needs a --recipe')
     
     return cf
     
@@ -131,89 +161,12 @@ def ask_QE_atom():
     
     return fn, move_index, rprim, species, coords
 
-def get_card(lines, cardname):
-    """
-    Retrieve cards from a Quantum Espresso file.
-    lines: list of strings.
-    cardname: string with the name of the card.
-    """
-    contents = []
-    walker = iter(lines)
-    for line in walker:
-        if cardname in line:
-            break
-    else:
-        return contents
-    for line in walker:
-        line = line.strip()
-        if len(line) == 0 or any([ line.index(cardname) == 0 for cardname in CARDNAMES if cardname in line.upper()]):
-            break
-        contents += [line]
-    return contents
-
-def read_QE(filename):
-    """
-    Read relevant cards from a Quantum Espresso file.
-    filename: string with the filename.
-    """
-    lines = open(filename,'r').readlines()
-    # CARDS
-    cell_pars = get_card(lines, 'CELL_PARAMETERS')
-    atomic_pos = get_card(lines, 'ATOMIC_POSITIONS')
-    
-    species = [ line.split()[0] for line in atomic_pos ]
-    coords = np.array([ line.split()[1:4] for line in atomic_pos ], float)
-    rprim = np.array([ line.split() for line in cell_pars ], float)
-    
-    return rprim, species, coords
-
-def create_json(fn, rprim, species, coords):
-    """
-    Create a json file containing the pymatgen structure.
-    fn : str
-        filename of the Quantum Espresso file used to make the structure.
-    rprim : array (3,3)
-        the real space primitive cell.
-    species : list (N)
-        which atoms are present.
-    coords : array (N,3)
-        the coordinates of the atoms in the cell corresponding to species.
-    """
-    structure = Structure(
-        lattice = Lattice(rprim),
-        species = species,
-        coords = coords
-    )
-    fn = fn[:-3] + '.json' if fn[-3:] == '.in' else fn
-    with open(fn,'w') as file:
-        json.dump(structure.as_dict(), file)
-    return fn
-
 def loop_displacements(fn, move_index, rprim, species, pos_abc, dis_abc):
     """
     Loop through displacements and write to json files.
     """
-    # Leading zeros in dir/file names
-    N10 = leading_zeros(dis_abc)
-    
-    ## CREATE JASONS
-    npos_abc = pos_abc.copy()
-    json_files = ['' for ii in range(len(dis_abc))]
-    for ii, dis in enumerate(dis_abc):
-        # adjust position
-        npos_abc[move_index] = pos_abc[move_index] + dis
-        # location of file
-        new_dir = f'D{ii:0{N10}d}'
-        if not cf.nodir:
-            new_fn = new_dir + '/' + fn
-            if not os.path.exists(new_dir): 
-                os.makedirs(new_dir)
-        else:
-            new_fn = new_dir + '-' + fn
-        json_fn = create_json(new_fn, rprim, species, npos_abc)
-        json_files[ii] = json_fn
-    
-    return json_files
+    return write_displacements(dis_abc, fn, move_index, rprim, species, pos_abc,
+                               nodir=cf.nodir, min_dist=cf.min_dist, reject=cf.reject, index=cf.index)
 
 def read_coords(fn, move_index):
     file = json.load(open(fn))
@@ -236,12 +189,42 @@ def stdout(input_data, json_files):
     out += f'Steps:\n\t{len(dis_abc)}\n'
     out += f'Displacement [abc]:\n{dis_abc}\n'
     out += 'Displacement [xyz]:\n'
-    coords = np.array([ read_coords(json_fn, move_index) for json_fn in json_files ])
+    coords = np.array([ read_coords(json_fn, move_index) for json_fn in json_files if json_fn ])
     out += f'{coords}\n'
     with open('displace.out','w') as file:
         file.write(out)
     print('Written user input to displace.out')
 
+def load_recipe(recipe:str, method:str):
+    """
+    Recipe from a json string or file. The method defaults to the one given with --method, a method in
+    the recipe takes precedence.
+    """
+    if recipe is None:
+        recipe = '{}'
+    if os.path.exists(recipe):
+        with open(recipe) as file:
+            recipe = file.read()
+    return {'method': method, **json.loads(recipe)}
+
+def displace_recursive():
+    """
+    Apply one recipe to all Quantum Espresso inputs below a directory, in parallel.
+    """
+    files = find_inputs(cf.recursive, cf.include or ['*.in'], cf.exclude)
+    if len(files) == 0:
+        raise Exception(f'No Quantum Espresso input files found in {cf.recursive}')
+    recipe = load_recipe(cf.recipe, cf.method)
+    print(f'Displacing atom {cf.atom} in {len(files)} inputs')
+    summary = displace_inputs(files, recipe, cf.atom, cf.output, cf.recursive, cf.processes,
+                              nodir=cf.nodir, min_dist=cf.min_dist, reject=cf.reject, index=cf.index)
+    headers = ['input', 'output', 'atom', 'displacements', 'written', 'skipped', 'error']
+    print(tabulate([ [entry[key] for key in headers] for entry in summary ], headers=headers))
+    nwarnings = sum( len(entry['warnings']) for entry in summary )
+    if nwarnings:
+        print(f'{nwarnings} warnings about close atoms and duplicates, see the summary')
+    print(f'Written summary to {os.path.join(cf.output, "summary.json")}')
+
 def get_help_string():
     return '\t'.join(get_method_keys())
 
@@ -254,6 +237,8 @@ def displace():
     ## ARGV
     global cf
     cf = parse_argv()
+    if cf.recursive is not None:
+        return displace_recursive()
     
     ## Data handling
     if cf.load:
@@ -0,0 +1,42 @@
+"""
+A fake pw.x that answers with a rigid-ion model after a configurable latency, for throughput tests.
+Call it like pw.x, e.g. AH_fakepw -in scf.in > scf.out or AH_fakepw < scf.in, or on a json file.
+Options of pw.x (-nk, -nd, ...) are ignored, so it can replace pw.x in job scripts.
+"""
+
+import argparse, os, sys, tempfile
+from ..fakepw import run
+
+def parse_argv():
+    parser = argparse.ArgumentParser(
+        prog = 'AH_fakepw',
+        description = 'Fake pw.x: energy, forces and stress of a Born-Mayer and Coulomb model fitted to calc.a0',
+    )
+    parser.add_argument('-i','-in','-inp','-input', dest='input', default=None,
+                        help='pw.x input or pymatgen json file. Default is stdin')
+    parser.add_argument('-o','--output', default=None,
+                        help='Output file. Default is stdout')
+    parser.add_argument('--latency', type=float, default=float(os.environ.get('AH_FAKEPW_LATENCY', 0)),
+                        help='Run time in seconds. Default is $AH_FAKEPW_LATENCY or 0')
+    parser.add_argument('--per-atom', type=float, default=float(os.environ.get('AH_FAKEPW_PER_ATOM', 0)),
+                        help='Additional run time per atom in seconds. Default is $AH_FAKEPW_PER_ATOM or 0')
+    parser.add_argument('--jitter', type=float, default=float(os.environ.get('AH_FAKEPW_JITTER', 0)),
+                        help='Relative random variation of the run time, e.g. 0.1. Default is $AH_FAKEPW_JITTER or 0')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed of the jitter')
+    cf, _ = parser.parse_known_args()
+    return cf
+
+def main():
+    cf = parse_argv()
+    output = open(cf.output, 'w') if cf.output else sys.stdout
+    if cf.input is None:
+        # pw.x < scf.in
+        with tempfile.NamedTemporaryFile('w', suffix='.in', delete=False) as file:
+            file.write(sys.stdin.read())
+        run(file.name, output, cf.latency, cf.per_atom, cf.jitter, cf.seed)
+        os.remove(file.name)
+    else:
+        run(cf.input, output, cf.latency, cf.per_atom, cf.jitter, cf.seed)
+    if cf.output:
+        output.close()
@@ -0,0 +1,53 @@
+"""
+Pack a generated set of calculations into a cost-balanced job array.
+Call e.g. AH_jobs decks -w 02:00:00 -u 60 to pack all input decks into as few array elements of two hours
+as needed, when the cheapest calculation takes about a minute. The steps of a deck stay in one element.
+"""
+
+import argparse
+from tabulate import tabulate
+from ..displacements import find_inputs
+from ..jobs import write_array, SCHEDULERS, COMMAND, JSON_COMMAND
+
+def parse_argv():
+    parser = argparse.ArgumentParser(
+        prog = 'AH_jobs',
+        description = 'Writes a SLURM or PBS array job with tasks packed by their estimated cost',
+    )
+    parser.add_argument('root', nargs='?', default='.',
+                        help='Directory with the inputs, searched recursively')
+    parser.add_argument('--include', action='append', default=None, metavar='PATTERN',
+                        help='Input files, may be repeated. Default is *.in')
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help='Input files to skip, may be repeated')
+    parser.add_argument('-o','--output', default='jobs',
+                        help='Directory of the script, task list and manifest')
+    parser.add_argument('-n','--elements', type=int, default=None,
+                        help='Number of array elements. Default is as few as fit the walltime')
+    parser.add_argument('-w','--walltime', default='01:00:00',
+                        help='Walltime of every element, [[D-]HH:]MM:SS')
+    parser.add_argument('-u','--unit-seconds', type=float, default=None,
+                        help='Run time of the cheapest task in seconds, to fit the walltime')
+    parser.add_argument('-s','--scheduler', default='slurm', choices=SCHEDULERS)
+    parser.add_argument('-c','--command', default=COMMAND,
+                        help=f'Command of a task, with $input and $output. Default is {COMMAND}, json '
+                             f'structures need another one, e.g. {JSON_COMMAND}')
+    parser.add_argument('--name', default='alkali_halides',
+                        help='Name of the job')
+    parser.add_argument('--nodes', type=int, default=1)
+    parser.add_argument('--cores', type=int, default=1,
+                        help='Cores per node')
+    parser.add_argument('-d','--directive', action='append', default=[],
+                        help='Additional scheduler directive, e.g. --account=abc. May be repeated')
+    return parser.parse_args()
+
+def main():
+    cf = parse_argv()
+    files = find_inputs(cf.root, cf.include or ['*.in'], cf.exclude)
+    if len(files) == 0:
+        raise Exception(f'No input files found in {cf.root}')
+    manifest = write_array(files, cf.output, cf.elements, cf.walltime, cf.unit_seconds, cf.scheduler, cf.command,
+                           cf.name, cf.nodes, cf.cores, cf.directive)
+    rows = [ [element['element'], len(element['tasks']), element['cost'], element['seconds']] for element in manifest['elements'] ]
+    print(tabulate(rows, headers=['element', 'tasks', 'cost', 'seconds'], floatfmt='.1f'))
+    print(f'Written {manifest["script"]}')
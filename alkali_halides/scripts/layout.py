@@ -0,0 +1,60 @@
+"""
+Recommend parallelization layouts for pw.x and BerkeleyGW runs.
+Call e.g. AH_layout LiF --cores 32 --memory 128 or AH_layout -i scf.in --cores 32 --memory 128.
+With --best only the ranks, threads and pw.x flags of the best layout are printed, for use in job scripts:
+    read RANKS THREADS FLAGS <<< "$(AH_layout LiF --cores 32 --memory 128 --best)"
+For the BerkeleyGW steps (epsilon, sigma) only the ranks and threads are printed: BerkeleyGW distributes
+the bands and the dielectric matrix over all ranks by itself.
+"""
+
+import argparse
+from tabulate import tabulate
+from ..parallel import recommend_crystal, recommend_input, pw_flags
+
+def parse_argv():
+    parser = argparse.ArgumentParser(
+        prog = 'AH_layout',
+        description = 'Recommends MPI/OpenMP layouts and pw.x pools for a crystal or a pw.x input',
+    )
+    parser.add_argument('crystal', nargs='?', default=None,
+                        help='Crystal, e.g. LiF')
+    parser.add_argument('-i','--input', default=None,
+                        help='pw.x input file instead of a crystal')
+    parser.add_argument('-c','--cores', type=int, required=True,
+                        help='Cores per node')
+    parser.add_argument('-m','--memory', type=float, required=True,
+                        help='Memory per node in GB')
+    parser.add_argument('-N','--nodes', type=int, default=1,
+                        help='Number of nodes')
+    parser.add_argument('-s','--step', default='scf', choices=['scf', 'wfn', 'wfn_fi', 'epsilon', 'sigma'],
+                        help='Step of the calculation of a crystal')
+    parser.add_argument('--nbnd', type=int, default=None,
+                        help='Number of bands if not set in the pw.x input')
+    parser.add_argument('-n','--number', type=int, default=10,
+                        help='Number of layouts to show')
+    parser.add_argument('--best', action='store_true',
+                        help='Only print ranks, threads and pw.x flags (no flags for epsilon and sigma) of the best layout')
+    cf = parser.parse_args()
+    if (cf.crystal is None) == (cf.input is None):
+        parser.error('Provide either a crystal or an input file')
+    return cf
+
+def main():
+    cf = parse_argv()
+    if cf.input is not None:
+        layouts = recommend_input(cf.input, cf.cores, cf.memory, cf.nodes, cf.nbnd)
+    else:
+        layouts = recommend_crystal(cf.crystal, cf.cores, cf.memory, cf.nodes, cf.step)
+    if len(layouts) == 0:
+        raise SystemExit('No layout fits in memory.')
+    
+    if cf.best:
+        bgw = cf.input is None and cf.step in ['epsilon', 'sigma']
+        print(layouts[0]['ranks'], layouts[0]['threads'], '' if bgw else pw_flags(layouts[0]))
+        return
+    
+    headers = ['Ranks', 'Threads', '-nk', '-nb', '-nd', 'FFT ranks', 'Balance', 'Time', 'Mem/rank (GB)', 'Mem/node (GB)']
+    rows = [ [*layout[['ranks', 'threads', 'npool', 'nband', 'ndiag', 'nfft']].tolist(), 
+              layout['balance'], layout['time'], layout['mem_rank'] / 1e9, layout['mem_node'] / 1e9] 
+            for layout in layouts[:cf.number] ]
+    print(tabulate(rows, headers=headers, floatfmt='.2f'))
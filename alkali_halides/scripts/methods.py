@@ -2,6 +2,7 @@
 
 import numpy as np
 from scipy.linalg import inv
+from ..grid import add_convolve
 
 
 #%% GRID CREATION FUNCTIONS
@@ -15,7 +16,8 @@ def line(QE_data:tuple, cart = False, mag = False):
     
     # Vector of displacement
     if mag:
-        msg = f'Enter displacement vector [{"xyz m (\u212b)" if cart else "abc m (1/\u212b)"}].\n>>> '
+        units = 'xyz m (\u212b)' if cart else 'abc m (1/\u212b)'
+        msg = f'Enter displacement vector [{units}].\n>>> '
         user = input(msg)
         dis_vec = np.array(user.strip().split(),float)
         u_vec = dis_vec[0:3] / np.sqrt( np.sum(dis_vec[0:3]**2) )
@@ -261,7 +263,7 @@ def shell(QE_data:tuple, units, octant:bool = False):
     if octant:
         mult = np.linspace(0,1,N)
     else:
-        mult = np.linspace(0,1,N)
+        mult = np.linspace(-1,1,N)
     mults = [mult] * 3
     
     dis_abcs = [ mult[:,None] * dis_vec for mult, dis_vec in zip(mults, dis_vecs) ]
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Strained cells for elastic constants and the stress-strain fit.
+
+Strains are handled in Voigt notation, (xx, yy, zz, yz, xz, xy) with engineering shear strains
+(e4 = 2 e_yz), so that stress = C @ strain with the (6,6) elastic tensor C. The strain patterns are
+reduced by the symmetry of the crystal: for cubic crystals one pattern (d, 0, 0, d, 0, 0) determines
+C11, C12 and C44, the general case needs the six unit patterns for all 21 constants. Every pattern is
+applied with a few magnitudes, and all strained lattices are made at once as L @ (1 + e).
+
+The fit expresses C in a basis of tensors that respect the symmetry and solves for all coefficients
+with one least-squares problem over all strains and stress components.
+"""
+
+import numpy as np
+import os, json
+from glob import glob
+from pymatgen.core import Structure, Lattice
+from .attrdict import AttrDict
+from .qe import read_stress
+from .scripts.filehandling import leading_zeros
+
+MAGNITUDES = (-0.01, -0.005, 0.005, 0.01)
+KBAR_TO_GPA = 0.1
+SYMMETRIES = ['cubic', 'general']
+
+# Voigt index of each (i,j) component
+VOIGT = np.array([[0, 5, 4], [5, 1, 3], [4, 3, 2]])
+
+#%% VOIGT NOTATION
+
+def voigt_to_strain(voigt):
+    """
+    Strain tensors (...,3,3) from Voigt strains (...,6) with engineering shear strains.
+    """
+    voigt = np.asarray(voigt, float)
+    factor = np.where(VOIGT < 3, 1, 0.5)
+    return voigt[..., VOIGT] * factor
+
+def strain_to_voigt(strain):
+    """
+    Voigt strains (...,6) with engineering shear strains from strain tensors (...,3,3).
+    """
+    strain = np.asarray(strain, float)
+    return np.stack([ strain[..., 0, 0], strain[..., 1, 1], strain[..., 2, 2],
+                      2 * strain[..., 1, 2], 2 * strain[..., 0, 2], 2 * strain[..., 0, 1] ], axis = -1)
+
+def stress_to_voigt(stress):
+    """
+    Voigt stresses (...,6) from stress tensors (...,3,3).
+    """
+    stress = np.asarray(stress, float)
+    return np.stack([ stress[..., 0, 0], stress[..., 1, 1], stress[..., 2, 2],
+                      stress[..., 1, 2], stress[..., 0, 2], stress[..., 0, 1] ], axis = -1)
+
+#%% STRAIN SETS
+
+def strain_patterns(symmetry:str = 'cubic'):
+    """
+    Minimal set of Voigt strain patterns (P,6) that determines the elastic tensor of the symmetry.
+    """
+    if symmetry == 'cubic':
+        return np.array([[1., 0, 0, 1, 0, 0]])
+    if symmetry == 'general':
+        return np.identity(6)
+    raise ValueError(f'Option {symmetry} is not a valid symmetry. Please choose from:\n\t{SYMMETRIES}')
+
+def elastic_basis(symmetry:str = 'cubic'):
+    """
+    Basis (K,6,6) of elastic tensors with the symmetry, C = sum_k c_k basis[k].
+
+    Returns
+    -------
+    basis : array (K,6,6)
+    labels : list (K)
+        Names of the coefficients, e.g. 'C11'.
+    """
+    if symmetry == 'cubic':
+        basis = np.zeros((3, 6, 6))
+        basis[0, [0, 1, 2], [0, 1, 2]] = 1
+        basis[1, :3, :3] = 1 - np.identity(3)
+        basis[2, [3, 4, 5], [3, 4, 5]] = 1
+        return basis, ['C11', 'C12', 'C44']
+    if symmetry == 'general':
+        i, j = np.triu_indices(6)
+        basis = np.zeros((len(i), 6, 6))
+        basis[np.arange(len(i)), i, j] = 1
+        basis[np.arange(len(i)), j, i] = 1
+        return basis, [ f'C{a+1}{b+1}' for a, b in zip(i, j) ]
+    raise ValueError(f'Option {symmetry} is not a valid symmetry. Please choose from:\n\t{SYMMETRIES}')
+
+def strain_set(symmetry:str = 'cubic', magnitudes = MAGNITUDES):
+    """
+    Voigt strains (P*M,6) of every pattern with every magnitude, the pattern running slowest.
+    """
+    patterns = strain_patterns(symmetry)
+    magnitudes = np.asarray(magnitudes, float)
+    return (patterns[:, None, :] * magnitudes[None, :, None]).reshape(-1, 6)
+
+def strain_lattices(lattice, strains):
+    """
+    Strained lattices (M,3,3) of a lattice (3,3) with lattice vectors as rows, for Voigt strains (M,6).
+    """
+    deformation = np.identity(3) + voigt_to_strain(strains)
+    return np.asarray(lattice, float) @ deformation
+
+def strained_cells(crystal, supercell = None, symmetry:str = 'cubic', magnitudes = MAGNITUDES):
+    """
+    Strained cells of a crystal for the elastic constants.
+
+    Parameters
+    ----------
+    crystal : Crystal
+        The crystal, strained around its calculated lattice constant.
+    supercell : int(3), optional
+        Supercell specification as in build_structure.
+    symmetry : str, optional
+        'cubic' or 'general', see strain_patterns.
+    magnitudes : list, optional
+        Magnitudes of every strain pattern.
+
+    Returns
+    -------
+    cells : AttrDict
+        strains (M,6), lattices (M,3,3), species and frac_coords of the (unstrained) structure.
+    """
+    structure = crystal.build_structure(supercell)
+    strains = strain_set(symmetry, magnitudes)
+    return AttrDict(
+        strains = strains,
+        lattices = strain_lattices(structure.lattice.matrix, strains),
+        species = [ str(specie) for specie in structure.species ],
+        frac_coords = structure.frac_coords,
+    )
+
+def write_strains(crystal, dirname:str = 'strains', **kwargs):
+    """
+    Write the strained cells to json files <dirname>/S##/<prefix>.json, and their Voigt strains to
+    <dirname>/strains.json. See strained_cells for the other parameters.
+
+    Returns the list of written files.
+    """
+    cells = strained_cells(crystal, **kwargs)
+    N10 = leading_zeros(len(cells.strains))
+    files, summary = [], []
+    for ii, (strain, lattice) in enumerate(zip(cells.strains, cells.lattices)):
+        new_dir = os.path.join(dirname, f'S{ii:0{N10}d}')
+        os.makedirs(new_dir, exist_ok = True)
+        fn = os.path.join(new_dir, str(crystal.prefix) + '.json')
+        structure = Structure(Lattice(lattice), cells.species, cells.frac_coords)
+        with open(fn, 'w') as file:
+            json.dump(structure.as_dict(), file)
+        files += [fn]
+        summary += [dict(dir = f'S{ii:0{N10}d}', strain = strain.tolist())]
+    with open(os.path.join(dirname, 'strains.json'), 'w') as file:
+        json.dump(dict(crystal = str(crystal.crystal), strains = summary), file, indent = 1)
+    return files
+
+#%% FITTING
+
+def fit_elastic(strains, stresses, symmetry:str = 'cubic', pressure_convention:bool = True):
+    """
+    Least-squares fit of the elastic tensor to the stresses of strained cells.
+
+    Parameters
+    ----------
+    strains : array (M,6) or (M,3,3)
+        Voigt strains or strain tensors.
+    stresses : array (M,6) or (M,3,3)
+        Stresses in kbar. Include the unstrained cell or use symmetric strains to cancel residual stress.
+    symmetry : str, optional
+        'cubic' or 'general', see elastic_basis.
+    pressure_convention : bool, optional
+        Stresses are positive under compression, as printed by pw.x.
+
+    Returns
+    -------
+    elastic : AttrDict
+        C (6,6) in GPa, the fitted coefficients by label (e.g. C11), the bulk modulus B in GPa and
+        the rms residual of the stresses in GPa.
+    """
+    strains = np.asarray(strains, float)
+    stresses = np.asarray(stresses, float)
+    strains = strain_to_voigt(strains) if strains.shape[-2:] == (3, 3) else strains
+    stresses = stress_to_voigt(stresses) if stresses.shape[-2:] == (3, 3) else stresses
+    stresses = stresses * KBAR_TO_GPA * (-1 if pressure_convention else 1)
+
+    # Constant stress offset and one column per basis tensor: stress_m = s0 + sum_k c_k basis[k] @ strain_m
+    basis, labels = elastic_basis(symmetry)
+    design = np.einsum('kij,mj->mik', basis, strains)                         # (M,6,K)
+    offset = np.broadcast_to(np.identity(6), (len(strains), 6, 6))
+    design = np.concatenate((design, offset), axis = 2).reshape(-1, len(basis) + 6)
+    coefficients, *_ = np.linalg.lstsq(design, stresses.reshape(-1), rcond = None)
+    residual = stresses.reshape(-1) - design @ coefficients
+
+    C = np.einsum('k,kij->ij', coefficients[:len(basis)], basis)
+    elastic = AttrDict(C = C, residual = float(np.sqrt(np.mean(residual**2))))
+    for label, coefficient in zip(labels, coefficients):
+        elastic[label] = float(coefficient)
+    elastic.B = float(np.sum(C[:3, :3]) / 9)
+    return elastic
+
+def harvest_stresses(dirname:str = 'strains', output:str = '*.out'):
+    """
+    Read the stresses of the strained cells written by write_strains from pw.x outputs.
+
+    Parameters
+    ----------
+    dirname : str, optional
+        Directory with strains.json.
+    output : str, optional
+        Glob pattern of the pw.x output in every S## directory.
+
+    Returns
+    -------
+    strains, stresses : arrays (M,6), (M,3,3)
+        Voigt strains and stresses in kbar of the cells that have a stress.
+    """
+    with open(os.path.join(dirname, 'strains.json')) as file:
+        summary = json.load(file)['strains']
+    strains, stresses = [], []
+    for entry in summary:
+        for fn in sorted(glob(os.path.join(dirname, entry['dir'], output))):
+            stress = read_stress(fn)
+            if stress is not None:
+                strains += [entry['strain']]
+                stresses += [stress]
+                break
+    return np.array(strains, float).reshape(-1, 6), np.array(stresses, float).reshape(-1, 3, 3)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Supercell matrices that make the most of an atom budget.
+
+Diagonal multiples of the fcc primitive cell are rhombohedral and far from cubic, so they waste atoms
+for a given distance between a defect and its periodic images. Here all supercells up to an atom
+budget are searched: every sublattice of index n is given by exactly one integer matrix in Hermite
+normal form, and the candidates of all indices are evaluated at once:
+
+- the Hermite normal forms are reduced to the three shortest independent lattice vectors of their
+  supercell with a greedy (Minkowski) reduction that runs on all candidates at once, so that the cost
+  per candidate does not grow with the size of the supercell,
+- the distance between periodic images is the length of the shortest of these vectors,
+- the shape is compared through their metric tensor, and they form the returned supercell matrix.
+
+The search only depends on the shape of the primitive cell, so it is done in units of the lattice
+constant and cached per structure type. The matrices are accepted by build_structure, e.g.
+crystal.build_structure(optimal_supercell(crystal, 64)).
+"""
+
+import numpy as np
+from functools import lru_cache
+from .attrdict import AttrDict
+
+OBJECTIVES = ['distance', 'shape']
+
+SUPERCELL_DTYPE = [
+    ('index', int),            # primitive cells in the supercell
+    ('natoms', int),
+    ('image_distance', float), # Angstrom, shortest lattice vector
+    ('efficiency', float),     # image_distance / volume^(1/3), 2^(1/6) = 1.12 at most (fcc)
+    ('shape_error', float),    # distance of the normalised metric tensor to that of the target
+]
+
+def get_crystal(crystal):
+    from .create_crystals import crystals
+    return crystals[crystal] if isinstance(crystal, str) else crystal
+
+#%% CANDIDATES
+
+def hermite_matrices(index:int):
+    """
+    All integer matrices in (lower triangular) Hermite normal form with determinant index, (K,3,3).
+    Each one generates a different sublattice as rows M @ lattice.
+    """
+    matrices = []
+    for a in [ d for d in range(1, index + 1) if index % d == 0 ]:
+        for c in [ d for d in range(1, index // a + 1) if (index // a) % d == 0 ]:
+            f = index // (a * c)
+            b, d, e = np.meshgrid(np.arange(a), np.arange(a), np.arange(c), indexing = 'ij')
+            matrix = np.zeros(b.shape + (3, 3), int)
+            matrix[..., 0, 0], matrix[..., 1, 1], matrix[..., 2, 2] = a, c, f
+            matrix[..., 1, 0], matrix[..., 2, 0], matrix[..., 2, 1] = b, d, e
+            matrices += [ matrix.reshape(-1, 3, 3) ]
+    return np.concatenate(matrices)
+
+def gram(u, v, metric):
+    """
+    Inner products of integer vectors (...,3) with the metric tensor of the lattice.
+    """
+    return np.sum((u @ metric) * v, axis = -1)
+
+def gauss_reduce(u, v, metric):
+    """
+    Lagrange-Gauss reduction of many two-dimensional bases (K,3),(K,3) at once: the returned u and v
+    are the two shortest independent vectors of their plane, |u| <= |v|.
+    """
+    u, v = u.copy(), v.copy()
+    active = np.arange(len(u))
+    while len(active):
+        a, b = u[active], v[active]
+        swap = gram(a, a, metric) > gram(b, b, metric)
+        a[swap], b[swap] = b[swap], a[swap].copy()
+        mu = np.rint(gram(a, b, metric) / gram(a, a, metric))
+        b -= mu[:, None] * a
+        u[active], v[active] = a, b
+        active = active[mu != 0]
+    swap = gram(u, u, metric) > gram(v, v, metric)
+    u[swap], v[swap] = v[swap], u[swap].copy()
+    return u, v
+
+def reduce_bases(bases, metric):
+    """
+    Greedy reduction of many three-dimensional bases (K,3,3) at once, in integer coordinates of a
+    lattice with metric tensor metric.
+
+    Every round sorts the vectors by length, Gauss-reduces the first two and subtracts the closest
+    vector of their plane from the third, until the third stays the longest. In three dimensions the
+    result is Minkowski reduced (Nguyen and Stehle, ACM Trans. Algorithms 5, 46 (2009)): the rows are
+    the three shortest independent lattice vectors, sorted by length.
+    """
+    # integers are exact in floating point, which is much faster
+    bases = np.array(bases, float)
+    offsets = np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], indexing = 'ij')).reshape(2, -1).T
+    active = np.arange(len(bases))
+    while len(active):
+        basis = bases[active]
+        order = np.argsort(gram(basis, basis, metric), axis = 1, kind = 'stable')
+        basis = np.take_along_axis(basis, order[:, :, None], axis = 1)
+        u, v = gauss_reduce(basis[:, 0], basis[:, 1], metric)
+        w = basis[:, 2]
+        # closest vector of the plane of u and v to w, among the neighbours of its projection
+        uu, uv, vv, uw, vw = gram(u, u, metric), gram(u, v, metric), gram(v, v, metric), gram(u, w, metric), gram(v, w, metric)
+        determinant = uu * vv - uv**2
+        projection = np.stack([vv * uw - uv * vw, uu * vw - uv * uw], axis = 1) / determinant[:, None]
+        coefficients = np.rint(projection)[:, None, :] + offsets[None]            # (A,9,2)
+        candidates = w[:, None, :] - coefficients[..., :1] * u[:, None, :] - coefficients[..., 1:] * v[:, None, :]
+        best = np.argmin(gram(candidates, candidates, metric), axis = 1)
+        w = candidates[np.arange(len(w)), best]
+        bases[active] = np.stack([u, v, w], axis = 1)
+        active = active[gram(w, w, metric) < gram(v, v, metric)]
+    return np.rint(bases).astype(int)
+
+def normalised_metric(bases, lattice):
+    """
+    Metric tensors (K,3,3) of bases scaled to unit volume, with the sign of the off-diagonal elements
+    removed (it depends on the choice of the basis vectors).
+    """
+    cartesian = bases @ lattice
+    volume = np.abs(np.linalg.det(cartesian))
+    metric = cartesian @ cartesian.transpose(0, 2, 1)
+    return np.abs(metric) / np.cbrt(np.where(volume > 0, volume, np.nan))[:, None, None]**2
+
+@lru_cache(maxsize = 32)
+def search(rprim:tuple, max_index:int):
+    """
+    Evaluate all supercells of a primitive cell (rprim in units of the lattice constant) up to an index.
+
+    The result is cached per structure type and must not be modified.
+
+    Returns
+    -------
+    candidates : AttrDict
+        hermite (K,3,3), bases (K,3,3) (reduced, positive determinant), index, image_distance (in units
+        of the lattice constant) and metric (K,3,3), see normalised_metric.
+    """
+    lattice = np.array(rprim, float).reshape(3, 3)
+    hermite = np.concatenate([ hermite_matrices(n) for n in range(1, max_index + 1) ])
+    index = np.round(np.linalg.det(hermite)).astype(int)
+    bases = reduce_bases(hermite, lattice @ lattice.T)
+    bases[np.linalg.det(bases) < 0, 2] *= -1
+    distance = np.linalg.norm(bases[:, 0] @ lattice, axis = -1)
+    candidates = AttrDict(hermite = hermite, bases = bases, index = index, image_distance = distance,
+                          metric = normalised_metric(bases, lattice))
+    for value in candidates.values():
+        value.flags.writeable = False
+    return candidates
+
+#%% RANKING
+
+def rank_supercells(crystal, max_atoms:int, objective:str = 'distance', target = None, min_atoms:int = None):
+    """
+    Rank the supercells of a crystal within an atom budget.
+
+    Parameters
+    ----------
+    crystal : Crystal or str
+    max_atoms : int
+        Largest number of atoms in the supercell.
+    objective : str, optional
+        'distance' maximizes the distance between periodic images (ties go to fewer atoms and then the
+        better shape), 'shape' matches the shape of the target (ties go to the larger distance).
+    target : array (3,3), optional
+        Lattice vectors of the target shape as rows, in any scale. The default is a cube.
+    min_atoms : int, optional
+        Smallest number of atoms in the supercell.
+
+    Returns
+    -------
+    matrices : int array (S,3,3)
+        Supercell matrices (new lattice = matrix @ crystal.lattice), best first. Of equivalent
+        supercells (same size, distance and shape) only the first is kept.
+    table : structured array (SUPERCELL_DTYPE)
+        One row per matrix.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f'Option {objective} is not a valid objective. Please choose from:\n\t{OBJECTIVES}')
+    crystal = get_crystal(crystal)
+    structure = crystal.structure
+    natoms = len(structure.coordinates)
+    max_index = max_atoms // natoms
+    if max_index < 1:
+        raise ValueError(f'The primitive cell of {crystal} has more than {max_atoms} atoms.')
+    rprim = structure.basic_to_primitive * structure.rprim
+    candidates = search(tuple(rprim.ravel()), max_index)
+    scale = np.linalg.norm(crystal.lattice[0]) / np.linalg.norm(rprim[0])
+
+    target = np.identity(3) if target is None else np.asarray(target, float)
+    target = target[np.argsort(np.linalg.norm(target, axis = -1), kind = 'stable')]
+    target_metric = normalised_metric(np.identity(3)[None], target)[0]
+    shape_error = np.linalg.norm(candidates.metric - target_metric, axis = (-2, -1))
+    shape_error = np.where(np.isfinite(shape_error), shape_error, np.inf)
+
+    table = np.zeros(len(candidates.index), SUPERCELL_DTYPE)
+    table['index'] = candidates.index
+    table['natoms'] = candidates.index * natoms
+    table['image_distance'] = candidates.image_distance * scale
+    table['efficiency'] = candidates.image_distance / np.cbrt(candidates.index * abs(np.linalg.det(rprim)))
+    table['shape_error'] = shape_error
+
+    distance, error = np.round(table['image_distance'], 6), np.round(shape_error, 6)
+    if objective == 'distance':
+        order = np.lexsort((error, table['natoms'], -distance))
+    else:
+        order = np.lexsort((table['natoms'], -distance, error))
+    if min_atoms is not None:
+        order = order[table['natoms'][order] >= min_atoms]
+    _, first = np.unique(np.stack([table['natoms'], distance, error], axis = 1)[order], axis = 0, return_index = True)
+    order = order[np.sort(first)]
+    return np.array(candidates.bases[order]), table[order]
+
+def optimal_supercell(crystal, max_atoms:int, objective:str = 'distance', target = None, min_atoms:int = None):
+    """
+    Best supercell matrix of a crystal within an atom budget, see rank_supercells.
+
+    The (3,3) integer matrix is accepted by build_structure.
+    """
+    matrices, _ = rank_supercells(crystal, max_atoms, objective, target, min_atoms)
+    if len(matrices) == 0:
+        raise ValueError(f'No supercell of {get_crystal(crystal)} has between {min_atoms} and {max_atoms} atoms.')
+    return matrices[0]
@@ -0,0 +1,36 @@
+import os, json
+import numpy as np
+from alkali_halides.alloys import write_alloys
+
+def summary(dirname):
+    with open(os.path.join(dirname, 'alloys.json')) as file:
+        return json.load(file)['configurations']
+
+def test_rerun_with_index_rewrites(tmp_path):
+    index = str(tmp_path / 'fingerprints.json')
+    dirname = str(tmp_path / 'alloys')
+    kwargs = dict(supercell = 2, nconfigs = 3, seed = 1, index = index)
+    first = write_alloys('KCl', 'KBr', 0.25, dirname, **kwargs)
+    again = write_alloys('KCl', 'KBr', 0.25, dirname, **kwargs)
+    assert len(first) == 3
+    assert again == first
+    assert not any( 'duplicate_of' in entry for entry in summary(dirname) )
+
+def test_index_points_to_earlier_set(tmp_path):
+    index = str(tmp_path / 'fingerprints.json')
+    kwargs = dict(supercell = 2, nconfigs = 3, seed = 1, index = index)
+    write_alloys('KCl', 'KBr', 0.25, str(tmp_path / 'first'), **kwargs)
+    files = write_alloys('KCl', 'KBr', 0.25, str(tmp_path / 'second'), **kwargs)
+    assert files == []
+    assert all( entry['duplicate_of'].startswith(str(tmp_path / 'first')) for entry in summary(str(tmp_path / 'second')) )
+
+def test_translations_share_key():
+    # more than 8 mixed sites, so the packed occupations take several bytes
+    from alkali_halides.alloys import alloy_host, random_occupations, translation_permutations, canonical_keys
+    for supercell in [3, 4]:
+        alloy = alloy_host('KCl', 'KBr', 0.25, supercell)
+        permutations = translation_permutations(alloy)
+        for occupation in random_occupations(5, len(alloy.sites), alloy.nguest, supercell):
+            translated = np.zeros((len(permutations), len(occupation)), bool)
+            np.put_along_axis(translated, permutations, occupation[None, :], axis = 1)
+            assert len(set(canonical_keys(translated, permutations))) == 1
@@ -0,0 +1,73 @@
+import numpy as np
+from alkali_halides.convergence import ConvergenceSweep, TOLERANCES, MINIMA, MAX_RUNS
+from alkali_halides.results import ResultsStore
+
+def synthetic(point):
+    """
+    Quantities that converge exponentially in every setting.
+    """
+    decay = np.exp(-point.ecutwfc / 12) + 0.1 * np.exp(-point.kpoints)
+    return dict(total_energy = -30 + 5 * decay, pressure = 2000 * decay, eps = 2.5 - np.exp(-point.nbnd / 20))
+
+def expected(sweep, axis):
+    """
+    First value on the ladder of the starting value whose next step changes all quantities less than
+    their tolerances.
+    """
+    start, step = sweep.start[axis], sweep.steps[axis]
+    value = start - step * np.floor((start - MINIMA[axis]) / step)
+    while True:
+        before = synthetic(sweep.point(axis, value))
+        after = synthetic(sweep.point(axis, value + step))
+        changes = dict(total_energy = abs(after['total_energy'] - before['total_energy']),
+                       pressure = abs(after['pressure'] - before['pressure']),
+                       eps = abs(after['eps'] - before['eps']) / abs(before['eps']))
+        quantities = ['eps'] if axis == 'nbnd' else ['total_energy', 'pressure']
+        if all( changes[quantity] < TOLERANCES[quantity] for quantity in quantities ):
+            return value
+        value += step
+
+def run(sweep):
+    runs = 0
+    while not sweep.done:
+        batch = sweep.next_batch()
+        # an empty batch only when the last results finished the sweep
+        assert batch or sweep.done
+        for point in reversed(batch):
+            sweep.add_result(point, **synthetic(point))
+        runs += len(batch)
+    return runs
+
+def test_sweep_terminates_at_first_converged_values():
+    sweep = ConvergenceSweep('NaCl')
+    runs = run(sweep)
+    assert sweep.failed == []
+    assert runs < len(sweep.axes) * MAX_RUNS
+    for axis in sweep.axes:
+        assert sweep.converged[axis] == expected(sweep, axis)
+    assert sweep.converged_settings['ecutwfc'] == sweep.converged['ecutwfc']
+
+def test_sweep_from_a_far_start(tmp_path):
+    sweep = ConvergenceSweep('NaCl', start = dict(ecutwfc = 20., kpoints = 1, nbnd = 10))
+    run(sweep)
+    assert sweep.failed == [] and sweep.converged['ecutwfc'] == expected(sweep, 'ecutwfc')
+    sweep.save(str(tmp_path / 'sweep.json'))
+    loaded = ConvergenceSweep.load(str(tmp_path / 'sweep.json'))
+    assert loaded.done and loaded.converged == sweep.converged and loaded.results == sweep.results
+    store = ResultsStore(':memory:')
+    assert sweep.record(store) == 3 * len(sweep.results) + 3
+    assert len(store.query(crystal = 'NaCl', calculation = 'conv').value) == 3
+
+def test_non_monotonic_changes():
+    # the changes of the total energy extrapolate to 11 k-points, but 11 -> 12 is above the tolerance
+    # and only 14 -> 15 converges; 11 and 12 were tried, 13 was not
+    sweep = ConvergenceSweep('NaCl', axes = ['kpoints'], start = dict(kpoints = 10))
+    sweep.started += ['kpoints']
+    energies = {9: -30., 10: -29.9, 11: -29.89, 12: -29.888, 14: -29.5, 15: -29.5 + 1e-9}
+    for kpoints, energy in energies.items():
+        sweep.add_result(sweep.point('kpoints', kpoints), total_energy = energy)
+    assert sweep.first_converged('kpoints') == 14 and sweep.extrapolate('kpoints') == 11
+    batch = sweep.next_batch()
+    assert [ point.value for point in batch ] == [13]
+    sweep.add_result(batch[0], total_energy = -29.5)
+    assert sweep.next_batch() == [] and sweep.converged == dict(kpoints = 13)
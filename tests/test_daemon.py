@@ -0,0 +1,44 @@
+import os, sys, time, tempfile, subprocess, warnings
+import pytest
+from alkali_halides import daemon
+
+SERVER = """
+import sys, warnings
+from alkali_halides import daemon
+def command_noisy(text):
+    print(text)
+    warnings.warn('careful')
+    return len(text)
+daemon.COMMANDS['noisy'] = command_noisy
+daemon.serve(sys.argv[1], preload = False)
+"""
+
+def command_noisy(text:str):
+    print(text)
+    warnings.warn('careful')
+    return len(text)
+
+@pytest.fixture
+def socket_path():
+    socket_path = os.path.join(tempfile.mkdtemp(), 'ah.sock')
+    process = subprocess.Popen([sys.executable, '-c', SERVER, socket_path], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    for _ in range(200):
+        if daemon.is_running(socket_path):
+            break
+        time.sleep(0.05)
+    yield socket_path
+    daemon.request('shutdown', socket_path)
+    process.wait(10)
+
+def test_daemon_returns_warnings(socket_path, capsys):
+    # the second time as well, the daemon does not show a warning only once
+    for _ in range(2):
+        assert daemon.request('noisy', socket_path, fallback = False, text = 'Warning: close atoms') == 20
+        err = capsys.readouterr().err
+        assert 'Warning: close atoms' in err and 'careful' in err
+
+def test_fallback_prints_in_process(monkeypatch, capsys):
+    monkeypatch.setitem(daemon.COMMANDS, 'noisy', command_noisy)
+    with pytest.warns(UserWarning):
+        daemon.request('noisy', os.path.join(tempfile.mkdtemp(), 'none.sock'), text = 'hello')
+    assert 'hello' in capsys.readouterr().out
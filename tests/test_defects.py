@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from alkali_halides.create_crystals import crystals
+from alkali_halides.defects import generate_defects, atom_orbits, VK_BOND
+
+@pytest.fixture(scope = 'module')
+def nacl():
+    return generate_defects('NaCl', 2, kinds = ('vacancy', 'f-centre', 'vk-centre'), substitutes = ['Br'], interstitials = ['Na'])
+
+def test_space_group(nacl):
+    host, _ = nacl
+    # 48 point operations times 8 lattice translations of the 2x2x2 supercell
+    assert len(host.permutations) == 384
+    sites, multiplicity = atom_orbits(host, 'Na')
+    assert len(sites) == 1 and list(multiplicity) == [8]
+
+def test_orbit_multiplicities(nacl):
+    _, defects = nacl
+    found = { defect.name: (defect.kind, defect.charge, defect.unpaired, defect.multiplicity, len(defect.species)) for defect in defects }
+    assert found == {
+        'V_Na': ('vacancy', -1, 0, 8, 15),
+        'V_Cl': ('vacancy', 1, 0, 8, 15),
+        'F_centre': ('f-centre', 0, 1, 8, 15),
+        'Vk': ('vk-centre', 1, 1, 48, 16),        # 8 halides with 12 halide neighbours each, per pair
+        'Br_Cl': ('substitution', 0, 0, 8, 16),
+        'Na_i': ('interstitial', 1, 0, 16, 17),   # the tetrahedral voids, 8 per conventional cell
+    }
+
+def test_geometry(nacl):
+    _, defects = nacl
+    a0 = crystals['NaCl'].calc.a0
+    assert all( np.isclose(defect.image_distance, 2 * a0 / np.sqrt(2)) for defect in defects )
+    vk = next( defect for defect in defects if defect.kind == 'vk-centre' )
+    a, b = vk.site
+    delta = (vk.frac_coords[b] - vk.frac_coords[a] + 0.5) % 1 - 0.5
+    assert np.isclose(np.linalg.norm(delta @ vk.lattice), VK_BOND['Cl'])
+    interstitial = next( defect for defect in defects if defect.kind == 'interstitial' )
+    assert np.isclose(interstitial.nearest, np.sqrt(3) / 4 * a0, rtol = 1e-3)
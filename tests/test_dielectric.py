@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+from alkali_halides.dielectric import model_epsilon, plasma_frequency, suggest_cutoffs, MODELS
+
+EPSINF = np.array([2.3, 1.9])
+DENSITY = np.array([0.05, 0.02])
+
+@pytest.mark.parametrize('model', MODELS)
+def test_limits(model):
+    eps = model_epsilon(np.array([1e-4, 1e-3, 0.1, 1., 5., 30.]), EPSINF, DENSITY, model)
+    assert eps.shape == (2, 6)
+    assert np.allclose(eps[:, 0], EPSINF, rtol = 1e-6)
+    assert np.all(np.diff(eps, axis = 1) < 0)
+    # eps - 1 -> 4 wp^2 / q^4 for large q
+    q = 30.
+    assert np.allclose(eps[:, -1] - 1, 4 * plasma_frequency(DENSITY)**2 / q**4, rtol = 0.05)
+
+def test_suggested_cutoff_grows_with_precision():
+    loose = suggest_cutoffs(['NaCl', 'KBr'], tol = 0.02)
+    tight = suggest_cutoffs(['NaCl', 'KBr'], tol = 0.005)
+    assert list(loose['crystal']) == ['NaCl', 'KBr']
+    assert np.all(tight['ecuteps'] > loose['ecuteps'])
+    assert np.all(tight['nbnd'] >= loose['nbnd'])
+    assert np.all(loose['ok'] == (loose['set_ecuteps'] >= loose['ecuteps']))
@@ -0,0 +1,65 @@
+import json
+import numpy as np
+import pytest
+from alkali_halides.displacements import write_displacements, displace_inputs
+from alkali_halides.fingerprint import FingerprintIndex
+
+RPRIM = 2.82 * np.array([[0, 1, 1], [1, 0, 1], [1, 1, 0]], float)
+SPECIES = ['Na', 'Cl']
+POSITIONS = np.array([[0, 0, 0], [0.5, 0.5, 0.5]])
+DISPLACEMENTS = np.array([[0.02, 0, 0], [0.04, 0, 0], [0.06, 0, 0]])
+
+@pytest.mark.parametrize('nodir', [False, True])
+def test_rerun_with_index_rewrites(tmp_path, nodir):
+    kwargs = dict(nodir = nodir, index = str(tmp_path / 'fingerprints.json'), dirname = str(tmp_path))
+    first = write_displacements(DISPLACEMENTS, 'NaCl.in', 0, RPRIM, SPECIES, POSITIONS, **kwargs)
+    again = write_displacements(DISPLACEMENTS, 'NaCl.in', 0, RPRIM, SPECIES, POSITIONS, **kwargs)
+    assert all(first) and again == first
+    assert not list(tmp_path.rglob('*duplicate*'))
+
+@pytest.mark.parametrize('nodir', [False, True])
+def test_index_points_to_earlier_set(tmp_path, nodir):
+    index = str(tmp_path / 'fingerprints.json')
+    (tmp_path / 'first').mkdir(), (tmp_path / 'second').mkdir()
+    write_displacements(DISPLACEMENTS, 'NaCl.in', 0, RPRIM, SPECIES, POSITIONS, nodir = nodir, index = index,
+                        dirname = str(tmp_path / 'first'))
+    files = write_displacements(DISPLACEMENTS, 'NaCl.in', 0, RPRIM, SPECIES, POSITIONS, nodir = nodir, index = index,
+                                dirname = str(tmp_path / 'second'))
+    assert files == [''] * len(DISPLACEMENTS)
+
+def write_input(path, scale = 1.):
+    cell = '\n'.join( ' '.join(map(str, row)) for row in scale * RPRIM )
+    path.parent.mkdir(parents = True, exist_ok = True)
+    path.write_text(f"CELL_PARAMETERS angstrom\n{cell}\nATOMIC_POSITIONS crystal\nNa 0.0 0.0 0.0\nCl 0.5 0.5 0.5\n")
+    return str(path)
+
+RECIPE = dict(method = 'line', vector = [1, 0, 0], range = [0.1, 0.3, 3])
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_displace_inputs_collects_index_and_warnings(tmp_path, processes):
+    files = [ write_input(tmp_path / 'inputs' / 'a' / 'NaCl.in'), write_input(tmp_path / 'inputs' / 'b' / 'NaCl.in', 1.02) ]
+    index = str(tmp_path / 'fingerprints.json')
+    kwargs = dict(root = str(tmp_path / 'inputs'), processes = processes, index = index, min_dist = 3.)
+    summary = displace_inputs(files, RECIPE, 0, str(tmp_path / 'first'), **kwargs)
+    assert [ entry['written'] for entry in summary ] == [3, 3]
+    assert all( entry['warnings'] and all( message.startswith('Warning') for message in entry['warnings'] )
+                for entry in summary )
+    assert len(FingerprintIndex(index)) == 6
+    with open(tmp_path / 'first' / 'summary.json') as file:
+        assert json.load(file)['inputs'] == summary
+    # a second set only points to the first
+    summary = displace_inputs(files, RECIPE, 0, str(tmp_path / 'second'), **kwargs)
+    assert [ entry['written'] for entry in summary ] == [0, 0]
+    assert all( sum( message.startswith('Duplicate') for message in entry['warnings'] ) == 3 for entry in summary )
+
+def test_displace_inputs_in_process_shares_index(tmp_path):
+    files = [ write_input(tmp_path / 'inputs' / name / 'NaCl.in') for name in ['a', 'b'] ]
+    index = str(tmp_path / 'fingerprints.json')
+    summary = displace_inputs(files, RECIPE, 0, str(tmp_path / 'out'), str(tmp_path / 'inputs'), 1, index = index)
+    assert [ entry['written'] for entry in summary ] == [3, 0]
+    assert len(FingerprintIndex(index)) == 3
+
+def test_recipe_method_takes_precedence():
+    from alkali_halides.scripts.displace import load_recipe
+    assert load_recipe('{"method": "mag", "n": 3}', 'line') == dict(method = 'mag', n = 3)
+    assert load_recipe(None, 'line') == dict(method = 'line')
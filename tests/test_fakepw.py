@@ -0,0 +1,45 @@
+import os, sys, subprocess
+import numpy as np
+import pytest
+from alkali_halides.fft import BOHR
+from alkali_halides.fakepw import prefactor, rock_salt, model
+from alkali_halides.qe import read_structure
+from alkali_halides.results import ResultsStore
+
+A0 = 5.64
+RPRIM = 0.5 * np.array([[0, 1, 1], [1, 0, 1], [1, 1, 0]])
+
+def pressure(alkali, halide, a0):
+    _, _, stress = model(*rock_salt(alkali, halide, a0), {(alkali, halide): prefactor(alkali, halide)})
+    return np.trace(stress) / 3
+
+def test_no_pressure_at_calculated_a0():
+    from alkali_halides.create_crystals import crystals
+    assert abs(pressure('Na', 'Cl', crystals['NaCl'].calc.a0)) < 1e-10
+
+def test_prefactor_uses_results_overlay(tmp_path):
+    filename = str(tmp_path / 'results.sqlite')
+    store = ResultsStore(filename)
+    store.insert('NaCl', 'scf', dict(calc_a0 = 5.5))
+    store.close()
+    script = ('from alkali_halides.fakepw import prefactor, rock_salt, model\n'
+              'print(model(*rock_salt("Na", "Cl", 5.5), {("Na", "Cl"): prefactor("Na", "Cl")})[2].trace())')
+    output = subprocess.run([sys.executable, '-c', script], capture_output = True, text = True, check = True,
+                            env = dict(os.environ, AH_RESULTS = filename))
+    assert abs(float(output.stdout)) < 1e-10
+
+def write_input(path, cell_option, positions):
+    cell = '\n'.join( ' '.join(map(str, row)) for row in RPRIM * A0 / BOHR )
+    path.write_text(f"&SYSTEM\n  ibrav = 0, nat = 2, ntyp = 2\n/\nCELL_PARAMETERS {cell_option}\n{cell}\n{positions}")
+    return str(path)
+
+def test_read_structure_units(tmp_path):
+    filename = write_input(tmp_path / 'scf.in', 'bohr', f'ATOMIC_POSITIONS bohr\nNa 0 0 0\nCl {A0 / 2 / BOHR} 0 0\n')
+    lattice, species, frac, _ = read_structure(filename)
+    assert np.allclose(lattice, RPRIM * A0)
+    assert np.allclose(frac[1] @ lattice, [A0 / 2, 0, 0])
+
+def test_read_structure_missing_card(tmp_path):
+    filename = write_input(tmp_path / 'scf.in', 'bohr', '')
+    with pytest.raises(ValueError, match = 'ATOMIC_POSITIONS'):
+        read_structure(filename)
@@ -0,0 +1,23 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from alkali_halides.fingerprint import FingerprintIndex, fingerprints
+
+def add_and_save(filename, worker, count = 20):
+    for ii in range(count):
+        index = FingerprintIndex(filename)
+        index.add(f'{worker}-{ii}', f'D{ii:04d}')
+        index.save()
+
+def test_fingerprints_invariant_to_translation_and_order():
+    lattice = 5.6 * np.identity(3)
+    species = ['Na', 'Cl', 'Na', 'Cl']
+    frac = np.array([[0, 0, 0], [0.5, 0, 0], [0.5, 0.5, 0], [0, 0.5, 0]])
+    moved = (frac[[2, 3, 0, 1]] + 0.25) % 1
+    assert fingerprints(lattice, species, frac) == fingerprints(lattice, species, moved)
+
+def test_concurrent_saves_keep_all_entries(tmp_path):
+    filename = str(tmp_path / 'fingerprints.json')
+    with ProcessPoolExecutor(4) as pool:
+        list(pool.map(add_and_save, [filename] * 8, range(8)))
+    assert len(FingerprintIndex(filename)) == 8 * 20
+    assert not list(tmp_path.glob('*.tmp'))
@@ -0,0 +1,35 @@
+import pickle
+import numpy as np
+import pytest
+from alkali_halides.attrdict import FrozenAttrDict
+from alkali_halides.create_crystals import crystals
+
+def test_frozen_attrdict():
+    frozen = FrozenAttrDict(a = 1, grid = np.arange(3), nested = dict(b = [1, 2]))
+    with pytest.raises(TypeError):
+        frozen.a = 2
+    with pytest.raises(TypeError):
+        frozen['c'] = 3
+    with pytest.raises(ValueError):
+        frozen.grid[0] = 5
+    with pytest.raises(TypeError):
+        frozen.nested.b = 3
+    changed = frozen.replace(a = 2)
+    assert changed.a == 2 and frozen.a == 1 and changed.grid is frozen.grid
+    copy = pickle.loads(pickle.dumps(frozen))
+    assert isinstance(copy, FrozenAttrDict) and list(copy.grid) == [0, 1, 2] and not copy.grid.flags.writeable
+
+def test_snapshot_and_variant():
+    crystal = crystals['NaCl']
+    snapshot = crystal.freeze()
+    assert snapshot.freeze() is snapshot
+    with pytest.raises(AttributeError):
+        snapshot.nbnd = 3
+    variant = snapshot.with_settings(ecutwfc = snapshot.settings.ecutwfc + 20, ngkpt_scf = 6)
+    assert variant.settings.ecutwfc == crystal.settings.ecutwfc + 20
+    assert list(variant.settings.ngkpt_scf) == [6, 6, 6]
+    # the original is unchanged and the other sections are shared
+    assert snapshot.settings.ecutwfc == crystal.settings.ecutwfc
+    assert variant.calc is snapshot.calc and variant.structure is snapshot.structure
+    with pytest.raises(ValueError):
+        snapshot.with_settings(not_a_setting = 1)
@@ -0,0 +1,107 @@
+import builtins
+import itertools
+import numpy as np
+import pytest
+from alkali_halides.grid import ProductGrid, add_convolve
+from alkali_halides.displacements import Plane, Volume, Shell
+from alkali_halides.scripts import methods
+
+RPRIM = 2.82 * np.array([[0, 1, 1], [1, 0, 1], [1, 1, 0]], float)
+QE_DATA = ('NaCl.in', 0, RPRIM, ['Na', 'Cl'], np.array([[0, 0, 0], [0.5, 0.5, 0.5]]))
+
+def answers(monkeypatch, *lines):
+    lines = iter(lines)
+    monkeypatch.setattr(builtins, 'input', lambda prompt = '' : next(lines))
+
+def nested_grid(vectors, ranges):
+    """
+    Grid points with the nested loops of the original implementation, the first vector slowest.
+    """
+    mults = [ np.linspace(start, stop, int(number)) for start, stop, number in ranges ]
+    return np.array([ sum( m * np.asarray(v, float) for m, v in zip(combination, vectors) )
+                      for combination in itertools.product(*mults) ])
+
+def nested_shell(radius, npoints, octant = False):
+    mult = np.linspace(0, 1, npoints) if octant else np.linspace(-1, 1, npoints)
+    points = []
+    for u, v, w, sign in Shell.FACES:
+        if octant and sign < 0:
+            continue
+        for a in mult:
+            for b in mult:
+                point = np.zeros(3)
+                point[u], point[v], point[w] = a, b, sign
+                points += [ point ]
+    points = np.array(points)
+    return points / np.linalg.norm(points, axis = 1)[:, None] * radius
+
+PLANE = ([[1, 0, 0], [0, 1, 1]], [(-0.1, 0.1, 5), (0, 0.2, 3)])
+VOLUME = (np.identity(3), [(-0.1, 0.1, 4), (0, 0.2, 3), (-0.05, 0.05, 2)])
+
+def test_add_convolve():
+    a, b = np.array([[1., 0, 0], [2, 0, 0]]), np.array([[0., 1, 0], [0, 2, 0], [0, 3, 0]])
+    assert np.array_equal(add_convolve(a, b), nested_grid([[1, 0, 0], [0, 1, 0]], [(1, 2, 2), (1, 3, 3)]))
+
+@pytest.mark.parametrize('method, vectors, ranges', [(Plane, *PLANE), (Volume, *VOLUME)])
+def test_grid_matches_nested_loops(method, vectors, ranges):
+    reference = nested_grid(vectors, ranges)
+    displacement = method(vectors, ranges)
+    assert np.allclose(displacement.to_array(), reference)
+    assert np.allclose(displacement[:], reference)
+
+@pytest.mark.parametrize('octant', [False, True])
+def test_shell_matches_nested_loops(octant):
+    shell = Shell(0.3, 4, octant = octant)
+    assert np.allclose(shell.to_array(), nested_shell(0.3, 4, octant))
+
+def test_plane_method(monkeypatch):
+    answers(monkeypatch, '1 0 0', '0 1 1', '-0.1 0.1 5', '0 0.2 3')
+    dis_abc = methods.plane_cell(QE_DATA)[-1]
+    assert np.allclose(dis_abc, nested_grid(*PLANE))
+    assert np.allclose(dis_abc, Plane(*PLANE).to_array())
+
+def test_volume_method(monkeypatch):
+    answers(monkeypatch, '1 0 0', '0 1 0', '0 0 1', '-0.1 0.1 4', '0 0.2 3', '-0.05 0.05 2')
+    dis_abc = methods.volume_cell(QE_DATA)[-1]
+    assert np.allclose(dis_abc, nested_grid(*VOLUME))
+
+@pytest.mark.parametrize('cart', [False, True])
+def test_octant_shell_method(monkeypatch, cart):
+    answers(monkeypatch, '0.3', '4')
+    dis_abc = (methods.shell_cartesian_oct if cart else methods.shell_cell_oct)(QE_DATA)[-1]
+    assert np.allclose(dis_abc, Shell(0.3, 4, cart = cart, octant = True, rprim = RPRIM).to_array())
+
+@pytest.mark.parametrize('indices', [slice(3, 11), slice(None, None, 4), slice(-5, None)])
+def test_lookup_on_slice(indices):
+    grid = ProductGrid([ (vector, np.linspace(start, stop, int(number))) for vector, (start, stop, number) in zip(*VOLUME) ])
+    reference = nested_grid(*VOLUME)
+    assert np.allclose(grid[indices], reference[indices])
+    assert np.allclose(grid[7], reference[7])
+    assert np.allclose(grid.take([0, 23, 5]), reference[[0, 23, 5]])
+
+@pytest.mark.parametrize('nranks', [1, 3, 5])
+def test_lookup_on_shard(nranks):
+    volume = Volume(*VOLUME)
+    reference = nested_grid(*VOLUME)
+    shards = [ volume.shard(rank, nranks) for rank in range(nranks) ]
+    assert np.allclose(np.concatenate([ shard.to_array() for shard in shards ]), reference)
+    for shard in shards:
+        assert shard.total == len(reference)
+        for ii in range(len(shard)):
+            assert np.allclose(shard[ii], reference[shard.offset + ii])
+    assert np.allclose(np.concatenate([ volume.grid.shard(rank, nranks) for rank in range(nranks) ]), reference)
+
+def test_shell_shard_lookup():
+    shell = Shell(0.3, 4)
+    reference = nested_shell(0.3, 4)
+    shard = shell.shard(2, 4)
+    assert np.allclose(shard[:], reference[shard.offset:shard.offset + len(shard)])
+
+@pytest.mark.parametrize('cart', [False, True])
+def test_full_shell_method(monkeypatch, cart):
+    # The full shell projects all six faces of the cube [-1, 1]^3, not just their positive quarters
+    answers(monkeypatch, '0.3', '4')
+    dis_abc = (methods.shell_cartesian if cart else methods.shell_cell)(QE_DATA)[-1]
+    assert np.allclose(dis_abc, Shell(0.3, 4, cart = cart, rprim = RPRIM).to_array())
+    xyz = dis_abc @ RPRIM if cart else dis_abc
+    assert np.allclose(np.sort(xyz, axis = 0), np.sort(-xyz, axis = 0))
@@ -0,0 +1,60 @@
+import os, re, subprocess
+import numpy as np
+import pytest
+from alkali_halides.fft import BOHR
+from alkali_halides.decks import make_job, write_deck
+from alkali_halides.create_crystals import crystals
+from alkali_halides.displacements import find_inputs
+from alkali_halides.jobs import write_array, task_chains, task_parameters
+
+@pytest.fixture
+def decks(tmp_path):
+    for crystal in ['NaCl', 'KBr', 'LiF']:
+        write_deck(make_job(crystals[crystal]), str(tmp_path / 'decks'))
+    return find_inputs(str(tmp_path / 'decks'))
+
+def test_task_chains(decks):
+    chains = task_chains(decks)
+    assert len(chains) == 3
+    for chain in chains:
+        steps = [ os.path.basename(os.path.dirname(decks[ii])) for ii in chain ]
+        assert steps == ['01-scf', '02-wfn', '03-wfnq', '04-wfn_fi']
+
+def test_chains_stay_in_one_element_in_order(decks, tmp_path):
+    manifest = write_array(decks, str(tmp_path / 'jobs'), nelements = 2)
+    assert len(manifest['elements']) == 2
+    for element in manifest['elements']:
+        crystals = [ fn.split(os.sep)[-3] for fn in element['tasks'] ]
+        for crystal in set(crystals):
+            steps = [ fn.split(os.sep)[-2] for fn in element['tasks'] if fn.split(os.sep)[-3] == crystal ]
+            assert steps == ['01-scf', '02-wfn', '03-wfnq', '04-wfn_fi']
+    assert sum( len(element['tasks']) for element in manifest['elements'] ) == 12
+
+def test_failed_step_skips_its_chain(decks, tmp_path):
+    command = 'test "$input" != scf.in || [ "$(basename "$(dirname "$dir")")" != NaCl ] && echo "JOB DONE" > "$output"'
+    manifest = write_array(decks, str(tmp_path / 'jobs'), nelements = 1, command = command)
+    output = subprocess.run(['bash', manifest['script'], '0'], capture_output = True, text = True, check = True).stdout
+    done = [ fn for fn in decks if os.path.exists(fn[:-3] + '.out') ]
+    assert len(done) == 8 and not any( os.sep + 'NaCl' + os.sep in fn for fn in done )
+    assert output.count('an earlier step failed') == 3
+
+def test_json_needs_a_command(tmp_path):
+    (tmp_path / 'D0.json').write_text('{}')
+    with pytest.raises(ValueError, match = 'json'):
+        write_array([str(tmp_path / 'D0.json')], str(tmp_path / 'jobs'), nelements = 1)
+
+def test_commands_reading_stdin_keep_the_task_list(decks, tmp_path):
+    # mpirun and srun forward stdin to rank 0
+    manifest = write_array(decks, str(tmp_path / 'jobs'), nelements = 1, command = 'cat > /dev/null; echo "JOB DONE" > "$output"')
+    subprocess.run(['bash', manifest['script'], '0'], capture_output = True, text = True, check = True)
+    assert all( os.path.exists(fn[:-3] + '.out') for fn in decks )
+
+def test_cell_units(decks, tmp_path):
+    scf = [ fn for fn in decks if fn.endswith('scf.in') ][0]
+    text = open(scf).read()
+    cell = re.search(r'CELL_PARAMETERS angstrom\n((?:.*\n){3})', text).group(1)
+    rows = np.array(cell.split(), float).reshape(3, 3)
+    bohr = '\n'.join( ' '.join(f'{x:.10f}' for x in row) for row in rows / BOHR ) + '\n'
+    (tmp_path / 'bohr.in').write_text(text.replace(f'CELL_PARAMETERS angstrom\n{cell}', f'CELL_PARAMETERS bohr\n{bohr}'))
+    angstrom, converted = task_parameters(scf), task_parameters(str(tmp_path / 'bohr.in'))
+    assert np.isclose(converted.volume, angstrom.volume) and converted.nk == angstrom.nk
@@ -0,0 +1,57 @@
+import sys
+import numpy as np
+import pytest
+from alkali_halides.fft import BOHR
+from alkali_halides.qe import read_lattice
+from alkali_halides.parallel import recommend_input
+from alkali_halides.scripts import layout
+
+A0 = 5.64
+RPRIM = 0.5 * np.array([[0, 1, 1], [1, 0, 1], [1, 1, 0]])
+
+def write_input(path, option, scale, celldm = ''):
+    cell = '\n'.join( ' '.join(f'{x:.10f}' for x in row) for row in RPRIM * scale )
+    path.write_text(f"""&SYSTEM
+  ibrav = 0, nat = 2, ntyp = 2, ecutwfc = 40, nbnd = 8 {celldm}
+/
+ATOMIC_SPECIES
+Na 22.99 Na.upf
+Cl 35.45 Cl.upf
+CELL_PARAMETERS {option}
+{cell}
+ATOMIC_POSITIONS crystal
+Na 0.0 0.0 0.0
+Cl 0.5 0.5 0.5
+K_POINTS automatic
+4 4 4 0 0 0
+""")
+    return str(path)
+
+@pytest.mark.parametrize('option, scale, celldm', [
+    ('angstrom', A0, ''),
+    ('bohr', A0 / BOHR, ''),
+    ('alat', 1., f', celldm(1) = {A0 / BOHR}'),
+    ('', 1., f', A = {A0}'),
+])
+def test_read_lattice_units(tmp_path, option, scale, celldm):
+    filename = write_input(tmp_path / 'scf.in', option, scale, celldm)
+    assert np.allclose(read_lattice(filename), A0 * RPRIM)
+
+def test_recommend_input_independent_of_units(tmp_path):
+    angstrom = recommend_input(write_input(tmp_path / 'a.in', 'angstrom', A0), 32, 128)
+    bohr = recommend_input(write_input(tmp_path / 'b.in', 'bohr', A0 / BOHR), 32, 128)
+    keys = ['ranks', 'threads', 'npool', 'nband', 'ndiag', 'nfft']
+    assert np.array_equal(angstrom[keys], bohr[keys])
+    assert np.allclose(angstrom['mem_rank'], bohr['mem_rank'])
+
+def test_alat_without_lattice_parameter(tmp_path):
+    with pytest.raises(ValueError, match = 'alat'):
+        read_lattice(write_input(tmp_path / 'scf.in', 'alat', 1.))
+
+@pytest.mark.parametrize('step, pw', [('scf', True), ('epsilon', False), ('sigma', False)])
+def test_best_flags(monkeypatch, capsys, step, pw):
+    monkeypatch.setattr(sys, 'argv', ['AH_layout', 'LiF', '-c', '32', '-m', '128', '-s', step, '--best'])
+    layout.main()
+    words = capsys.readouterr().out.split()
+    assert ('-nk' in words) == pw
+    assert len(words) == (8 if pw else 2)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from alkali_halides.create_crystals import crystals
+from alkali_halides.fakepw import model, prefactors
+from alkali_halides.constants import K_COULOMB
+from alkali_halides.phonons import force_constants, frequencies, lo_to, FREQUENCY
+
+STEP = 0.01
+
+@pytest.fixture(scope = 'module')
+def fc():
+    crystal = crystals['NaCl']
+    structure = crystal.build_structure(2)
+    lattice, frac = structure.lattice.matrix, structure.frac_coords
+    species = [ str(specie) for specie in structure.species ]
+    first = [ species.index(element) for element in ['Na', 'Cl'] ]
+    displacements, forces = [], []
+    for atom in first:
+        for step in np.concatenate([np.eye(3), -np.eye(3)]) * STEP:
+            displacement = np.zeros((len(frac), 3))
+            displacement[atom] = step
+            moved = frac + displacement @ np.linalg.inv(lattice)
+            displacements += [displacement]
+            forces += [model(lattice, species, moved, prefactors(species))[1]]
+    data = dict(lattice = lattice, species = species, frac = frac, displacements = displacements, forces = forces)
+    return force_constants(data, crystal.lattice, crystal.structure.coordinates)
+
+def test_acoustic_sum_rule(fc):
+    omega = frequencies(fc, np.zeros((1, 3)))[0]
+    assert np.allclose(omega[:3], 0, atol = 1e-6)
+    assert np.all(omega[3:] > 1)
+
+def test_lo_to_splitting(fc):
+    born, epsinf = np.array([1., -1.]), 2.
+    TO, LO, method = lo_to(fc, crystals['NaCl'], born, epsinf)
+    assert method == 'born' and LO > TO
+    # wLO^2 - wTO^2 = 4 pi Z^2 / (V epsinf mu) for a diatomic crystal
+    mu = 1 / np.sum(1 / fc.masses)
+    volume = abs(np.linalg.det(fc.primitive))
+    split = 4 * np.pi * K_COULOMB / (volume * epsinf * mu) * FREQUENCY**2
+    assert np.isclose(LO**2 - TO**2, split, rtol = 1e-6)
+    # the transverse modes are not affected
+    omega = frequencies(fc, np.zeros((1, 3)), born = born, epsinf = epsinf, directions = [1., 0., 0.])[0]
+    assert np.allclose(omega[3:5], TO)
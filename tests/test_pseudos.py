@@ -0,0 +1,42 @@
+import pytest
+from alkali_halides.pseudos import read_header, read_section, PseudoRegistry
+
+HEADER_V1 = """<PP_INFO>
+</PP_INFO>
+<PP_HEADER>
+   0                   Version Number
+  Na                   Element
+   NC                  Norm - Conserving pseudopotential
+    F                  Nonlinear Core Correction
+ SLA  PW   PBE  PBE    {xc}
+    9.00000000000      Z valence
+    0.00000000000      Total energy
+    40.0000000  160.0000000 Suggested cutoff for wfc and rho
+</PP_HEADER>
+<PP_R>
+  0.1 0.2 0.3
+</PP_R>
+"""
+
+@pytest.mark.parametrize('xc', ['Exchange-Correlation functional', 'exchange-correlation functional',
+                                'EXCHANGE-CORRELATION'])
+def test_header_v1_functional_any_case(tmp_path, xc):
+    filename = tmp_path / 'Na.upf'
+    filename.write_text(HEADER_V1.format(xc = xc))
+    header = read_header(str(filename))
+    assert header.functional == 'SLA PW PBE PBE'
+    assert header.element == 'Na' and header.z_valence == 9 and header.wfc_cutoff == 40
+    assert list(read_section(str(filename), 'PP_R')) == [0.1, 0.2, 0.3]
+
+def test_header_v1_without_functional(tmp_path):
+    filename = tmp_path / 'Na.upf'
+    filename.write_text(HEADER_V1.replace(' SLA  PW   PBE  PBE', '').format(xc = 'Exchange-Correlation'))
+    with pytest.raises(ValueError, match = 'Cannot parse the PP_HEADER of .*Na.upf'):
+        read_header(str(filename))
+
+def test_empty_file(tmp_path):
+    (tmp_path / 'Na.upf').write_text('')
+    with pytest.raises(ValueError, match = 'is empty'):
+        read_header(str(tmp_path / 'Na.upf'))
+    with pytest.raises(ValueError, match = 'is empty'):
+        PseudoRegistry(str(tmp_path))
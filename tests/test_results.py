@@ -0,0 +1,30 @@
+import pytest
+from alkali_halides.results import ResultsStore, settings_hash
+from alkali_halides.create_crystals import construct_database
+
+def test_failed_batch_stores_nothing():
+    store = ResultsStore(':memory:')
+    settings = dict(ecutwfc = 80)
+    with pytest.raises(ValueError):
+        store.insert_many([ ('KCl', 'scf', dict(total_energy = -1.), settings, None),
+                            ('KBr', 'scf', dict(total_energy = 'not a number'), settings, None) ])
+    assert len(store) == 0
+    assert store.settings(settings_hash(settings)) is None
+
+def test_batch_stores_settings():
+    store = ResultsStore(':memory:')
+    settings = dict(ecutwfc = 80)
+    assert store.insert_many([ ('KCl', 'scf', dict(total_energy = -1., pressure = 0.1), settings, None) ]) == 2
+    assert store.settings(settings_hash(settings)) == settings
+    assert set(store.query(crystal = 'KCl').settings_hash) == { settings_hash(settings) }
+
+def test_overlay_skips_missing_values(tmp_path):
+    filename = str(tmp_path / 'results.sqlite')
+    csv = construct_database()
+    store = ResultsStore(filename)
+    store.insert('KCl', 'scf', dict(calc_a0 = None))
+    store.insert('NaCl', 'scf', dict(calc_a0 = 5.5))
+    store.close()
+    database = construct_database(filename)
+    assert database['KCl']['calc_a0'] == csv['KCl']['calc_a0']
+    assert database['NaCl']['calc_a0'] == 5.5
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from alkali_halides.create_crystals import crystals
+from alkali_halides.supercells import hermite_matrices, reduce_bases, rank_supercells, optimal_supercell
+
+def successive_minima(matrix, lattice):
+    """
+    Lengths of the three shortest independent vectors of a sublattice, by brute force.
+    """
+    # index times every primitive vector is in the sublattice, shorter vectors have smaller coordinates
+    index = round(abs(np.linalg.det(matrix)))
+    reach = np.arange(-index - 1, index + 2)
+    grid = np.array(np.meshgrid(reach, reach, reach, indexing = 'ij')).reshape(3, -1).T
+    coords = grid @ np.linalg.inv(matrix)
+    members = grid[np.all(np.abs(coords - np.rint(coords)) < 1e-8, axis = 1) & np.any(grid != 0, axis = 1)]
+    members = members[np.argsort(np.linalg.norm(members @ lattice, axis = 1), kind = 'stable')]
+    basis = [members[0]]
+    for vector in members[1:]:
+        if np.linalg.matrix_rank(np.array(basis + [vector])) == len(basis) + 1:
+            basis += [vector]
+            if len(basis) == 3:
+                break
+    return np.linalg.norm(np.array(basis) @ lattice, axis = 1)
+
+def test_reduced_bases_are_successive_minima():
+    structure = crystals['NaCl'].structure
+    lattice = structure.basic_to_primitive * structure.rprim
+    rng = np.random.default_rng(0)
+    for index in [1, 2, 7, 12, 20]:
+        hermite = hermite_matrices(index)
+        hermite = hermite[rng.choice(len(hermite), min(len(hermite), 10), replace = False)]
+        bases = reduce_bases(hermite, lattice @ lattice.T)
+        assert np.all(np.abs(np.rint(np.linalg.det(bases))) == index)
+        lengths = np.linalg.norm(bases @ lattice, axis = -1)
+        assert np.all(np.diff(lengths, axis = 1) > -1e-12)
+        for matrix, length in zip(hermite, lengths):
+            assert np.allclose(length, successive_minima(matrix, lattice))
+
+def test_64_atom_cube():
+    a0 = crystals['NaCl'].calc.a0
+    structure = crystals['NaCl'].build_structure(optimal_supercell('NaCl', 64, 'shape'))
+    assert len(structure) == 64
+    assert np.allclose(structure.lattice.abc, 2 * a0) and np.allclose(structure.lattice.angles, 90)
+
+def test_largest_image_distance():
+    matrices, table = rank_supercells('NaCl', 250)
+    # the 5x5x5 multiple of the fcc primitive cell, fcc packs the images best
+    assert table[0]['natoms'] == 250 and np.isclose(table[0]['efficiency'], 2**(1 / 6))
+    assert np.isclose(table[0]['image_distance'], 5 * crystals['NaCl'].calc.a0 / np.sqrt(2))
+    assert np.all(np.diff(table['image_distance']) <= 1e-9)
+    with pytest.raises(ValueError):
+        optimal_supercell('NaCl', 250, min_atoms = 260)